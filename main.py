@@ -5,8 +5,14 @@ This file orchestrates the entire pipeline and provides the CLI interface.
 
 import os
 import argparse
+import asyncio
+import atexit
+import functools
+import hashlib
 import logging
-import sys
+import logging.handlers
+import queue
+import orjson
 from dotenv import load_dotenv
 
 from pipeline.orchestrator import AAOIFIOrchestrator
@@ -15,18 +21,42 @@ from utils.gemini_client import GeminiClient
 # Load environment variables
 load_dotenv()
 
+# Buffer size for output files, so long audit trails need few write() calls
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Part of every result cache key; bump it whenever a change to the pipeline
+# (prompts, stages, output format) makes earlier cached results stale
+RESULT_CACHE_VERSION = 1
+
+# Pre-encoded markdown fragments for the quality scores report
+_QUALITY_REPORT_HEADER = b"# Quality Scores Report\n\n"
+_H2 = b"## "
+_SCORE = b"Score: "
+_NL2 = b"\n\n"
+
 def setup_logging(debug_level):
     """Configure logging based on the debug level."""
     log_level = logging.INFO
     if debug_level >= 1:
         log_level = logging.DEBUG
         
-    # Configure root logger
-    logging.basicConfig(
-        level=log_level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[logging.StreamHandler()]
+    # The real StreamHandler lives on a background listener thread so that
+    # agents only enqueue records instead of blocking on stderr writes
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
     )
+    listener.start()
+    atexit.register(listener.stop)
+    
+    # Configure root logger
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
     
     # Set specific module log levels
     if debug_level >= 2:
@@ -36,8 +66,78 @@ def setup_logging(debug_level):
     
     return logging.getLogger('main')
 
-def main():
-    """Main entry point for the application."""
+def read_standard(path):
+    """Read the input standard as text."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def iter_pdf_files(pdf_dir):
+    """Lazily yield the names of the PDF files in a directory."""
+    with os.scandir(pdf_dir) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and entry.name.lower().endswith('.pdf'):
+                yield entry.name
+
+def result_cache_key(standard_text, args, use_rag, llm_client):
+    """Build a content-addressed key for a pipeline run."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"v{RESULT_CACHE_VERSION}\0".encode('utf-8'))
+    digest.update(standard_text.encode('utf-8'))
+    digest.update(f"\0model={llm_client.model_name}\0quality={args.default_quality}".encode('utf-8'))
+    digest.update(f"\0generation={sorted(llm_client.generation_config.items())}".encode('utf-8'))
+    digest.update(f"\0retries={args.max_retries}\0rag={use_rag}".encode('utf-8'))
+    if use_rag:
+        digest.update(f"\0rag_dir={os.path.abspath(args.rag_data_dir)}".encode('utf-8'))
+    return digest.hexdigest()
+
+def load_cached_result(cache_path):
+    """Load a cached pipeline result, or return None on a miss."""
+    try:
+        with open(cache_path, 'rb') as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def save_cached_result(cache_path, result):
+    """Atomically store a pipeline result in the cache."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(dict(result), default=str))
+    os.replace(tmp_path, cache_path)
+
+def _write_file(path, content):
+    """
+    Write a single output file.
+    
+    Args:
+        path: Path of the file to write
+        content: A string, bytes, or an iterable of string/bytes chunks
+    """
+    with open(path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+        if isinstance(content, (str, bytes)):
+            content = (content,)
+        for chunk in content:
+            f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+
+async def _write_files_async(writes):
+    await asyncio.gather(
+        *(asyncio.to_thread(_write_file, path, content) for path, content in writes)
+    )
+
+def write_outputs(writes):
+    """
+    Write all output files as one batch.
+    
+    Args:
+        writes: List of (path, content) tuples, where content is a string,
+            bytes, or an iterable of string/bytes chunks
+    """
+    asyncio.run(_write_files_async(writes))
+
+@functools.cache
+def build_parser():
+    """Build the command line parser once per process."""
     parser = argparse.ArgumentParser(
         description="AAOIFI Standards Enhancement System"
     )
@@ -88,8 +188,17 @@ def main():
         default="data",
         help="Directory containing PDF documents for RAG (default: data)"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run the pipeline, ignoring results cached from identical runs"
+    )
     
-    args = parser.parse_args()
+    return parser
+
+def main():
+    """Main entry point for the application."""
+    args = build_parser().parse_args()
     
     # Setup logging
     logger = setup_logging(args.debug)
@@ -104,7 +213,7 @@ def main():
     
     # Initialize Gemini client
     try:
-        gemini_client = GeminiClient()
+        gemini_client = GeminiClient(args.model)
         logger.info(f"Initialized Gemini client with model: {gemini_client.model_name}")
     except ValueError as e:
         logger.error(f"Failed to initialize Gemini client: {str(e)}")
@@ -120,68 +229,106 @@ def main():
             logger.warning(f"RAG data directory {pdf_dir} does not exist, creating it")
             os.makedirs(pdf_dir, exist_ok=True)
         
-        pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
-        if not pdf_files:
+        # Only look for the first PDF up front; the full listing is needed
+        # later for the RAG usage report or when debugging
+        pdf_iter = iter_pdf_files(pdf_dir)
+        first_pdf = next(pdf_iter, None)
+        pdf_iter.close()
+        if first_pdf is None:
             logger.warning(f"No PDF files found in {pdf_dir}, RAG will not be used effectively")
+        elif args.debug > 0:
+            pdf_files = list(iter_pdf_files(pdf_dir))
+            logger.debug("Found %d PDF files for RAG: %s", len(pdf_files), ", ".join(pdf_files))
         else:
-            logger.info(f"Found {len(pdf_files)} PDF files for RAG: {', '.join(pdf_files)}")
+            logger.info(f"Found PDF files for RAG in {pdf_dir}")
     else:
         logger.info("RAG is explicitly disabled by command line flag")
     
     # Read input file
-    with open(args.input, 'r', encoding='utf-8') as f:
-        standard_text = f.read()
+    standard_text = read_standard(args.input)
     
     logger.info(f"Processing standard from {args.input}")
     if args.debug > 0:
-        logger.debug(f"Input text length: {len(standard_text)} characters")
-        logger.debug(f"First 100 characters: {standard_text[:100]}...")
-    
-    # Initialize the orchestrator with the configured parameters
-    orchestrator = AAOIFIOrchestrator(
-        max_retries=args.max_retries,
-        default_quality_score=args.default_quality,
-        llm_client=gemini_client,
-        use_rag=use_rag,
-        rag_data_dir=args.rag_data_dir if use_rag else None
-    )
+        logger.debug("Input text length: %d characters", len(standard_text))
+        logger.debug("First 100 characters: %s...", standard_text[:100])
+    
+    # Reuse the result of an identical earlier run if one is cached
+    cache_key = result_cache_key(standard_text, args, use_rag, gemini_client)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(args.output)), ".aaoifi_cache")
+    cache_path = os.path.join(cache_dir, f"{cache_key}.json")
+    
+    result = None if args.no_cache else load_cached_result(cache_path)
+    if result is not None:
+        logger.info(f"Cache hit for input {args.input}, skipping pipeline")
+    else:
+        # Initialize the orchestrator with the configured parameters
+        orchestrator = AAOIFIOrchestrator(
+            max_retries=args.max_retries,
+            default_quality_score=args.default_quality,
+            llm_client=gemini_client,
+            use_rag=use_rag,
+            rag_data_dir=args.rag_data_dir if use_rag else None
+        )
     
     # Process the standard
     try:
-        result = orchestrator.process(standard_text)
+        if result is None:
+            result = orchestrator.process(standard_text)
+            # A run with skipped stages or fallback results is not worth
+            # replaying; the next run should try those stages again
+            if result.degraded:
+                logger.info(f"Not caching result, stages fell back: {', '.join(sorted(result.degraded))}")
+            else:
+                try:
+                    save_cached_result(cache_path, result)
+                except OSError as e:
+                    logger.warning(f"Failed to cache pipeline result: {str(e)}")
         
         # Save the enhanced standard as markdown
         output_path = os.path.join(args.output, "enhanced_standard.md")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(result["final_output"])
         
         # Save the audit trail exactly as formatted by the orchestrator
         audit_path = os.path.join(args.output, "audit_trail.md")
-        with open(audit_path, 'w', encoding='utf-8') as f:
-            f.write(result["audit_trail"])
+        
+        writes = [
+            (output_path, result["final_output"]),
+            (audit_path, result["audit_trail"])
+        ]
         
         # Add RAG usage information to the audit
+        rag_path = None
         if use_rag:
             rag_path = os.path.join(args.output, "rag_usage.md")
-            with open(rag_path, 'w', encoding='utf-8') as f:
-                f.write("# RAG System Usage Report\n\n")
-                f.write(f"PDF directory: {pdf_dir}\n\n")
-                f.write(f"PDF files available: {len(pdf_files)}\n\n")
-                f.write("## Files Used:\n\n")
-                for file in pdf_files:
-                    f.write(f"- {file}\n")
-                f.write("\n## RAG Integration:\n\n")
-                f.write("The RAG system was used to augment the Enhancer and Validator components with relevant information from the AAOIFI standards documentation.\n")
-            logger.info(f"RAG usage report saved to {rag_path}")
+            pdf_files = list(iter_pdf_files(pdf_dir)) if first_pdf is not None else []
+            rag_report = [
+                "# RAG System Usage Report\n\n",
+                f"PDF directory: {pdf_dir}\n\n",
+                f"PDF files available: {len(pdf_files)}\n\n",
+                "## Files Used:\n\n"
+            ]
+            rag_report.extend(f"- {file}\n" for file in pdf_files)
+            rag_report.append("\n## RAG Integration:\n\n")
+            rag_report.append("The RAG system was used to augment the Enhancer and Validator components with relevant information from the AAOIFI standards documentation.\n")
+            writes.append((rag_path, "".join(rag_report)))
         
         # Save quality scores report if debug mode is enabled
+        quality_path = None
         if args.debug > 0:
             quality_path = os.path.join(args.output, "quality_scores.md")
-            with open(quality_path, 'w', encoding='utf-8') as f:
-                f.write("# Quality Scores Report\n\n")
-                for stage, score in result.get("quality_scores", {}).items():
-                    f.write(f"## {stage.capitalize()}\n\n")
-                    f.write(f"Score: {score}\n\n")
+            quality_report = [_QUALITY_REPORT_HEADER]
+            for stage, score in result.get("quality_scores", {}).items():
+                quality_report += (
+                    _H2, stage.capitalize().encode('utf-8'), _NL2,
+                    _SCORE, str(score).encode('ascii'), _NL2
+                )
+            writes.append((quality_path, quality_report))
+        
+        # Submit all file writes together instead of one after another
+        write_outputs(writes)
+        
+        if rag_path:
+            logger.info(f"RAG usage report saved to {rag_path}")
+        if quality_path:
             logger.info(f"Quality scores saved to {quality_path}")
         
         logger.info(f"Enhanced standard saved to {output_path}")
@@ -2,11 +2,31 @@
 Base agent for the AAOIFI Standards Enhancement System.
 """
 
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
 from abc import ABC, abstractmethod
 
 from langchain_openai import ChatOpenAI
+from langchain.schema import AIMessage, BaseMessage
+
+# Agent loggers by agent name, so repeated agent construction skips the
+# logging module's global lock
+_LOGGER_CACHE: Dict[str, logging.Logger] = {}
+
+# LLM responses shared by all agents, keyed by a hash of (model, prompt)
+_RESPONSE_CACHE_SIZE = 128
+_RESPONSE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+# Upper bound on concurrent provider requests in process_batch
+_BATCH_MAX_CONCURRENCY = 8
+
+# Default upper bound on concurrently running agents in aprocess_many
+_ASYNC_MAX_CONCURRENCY = 4
 
 class BaseAgent(ABC):
     """
@@ -19,7 +39,8 @@ class BaseAgent(ABC):
         self, 
         llm: ChatOpenAI,
         name: str,
-        stage_description: str
+        stage_description: str,
+        on_token: Optional[Callable[[str], None]] = None
     ):
         """
         Initialize the base agent.
@@ -28,11 +49,223 @@ class BaseAgent(ABC):
             llm: The language model to use
             name: The name of the agent
             stage_description: A description of the agent's stage in the pipeline
+            on_token: Optional callback receiving each streamed chunk of the LLM response
         """
         self.llm = llm
         self.name = name
         self.stage_description = stage_description
-        self.logger = logging.getLogger(f"agent.{name}")
+        self.on_token = on_token
+        
+        # Bind the LLM's invoke and stream methods once for the per-call hot path
+        self._invoke = llm.invoke
+        self._ainvoke = llm.ainvoke
+        self._batch = llm.batch
+        self._stream = llm.stream
+        self._astream = llm.astream
+        
+        self.logger = _LOGGER_CACHE.get(name)
+        if self.logger is None:
+            self.logger = _LOGGER_CACHE.setdefault(name, logging.getLogger(f"agent.{name}"))
+    
+    def _enable_json_mode(self) -> None:
+        """
+        Ask the LLM for a strict JSON object response where supported.
+        
+        Only OpenAI chat models accept the response_format option; other
+        models keep relying on the format instructions in the prompt.
+        """
+        if isinstance(self.llm, ChatOpenAI):
+            json_llm = self.llm.bind(response_format={"type": "json_object"})
+            self._invoke = json_llm.invoke
+            self._ainvoke = json_llm.ainvoke
+            self._batch = json_llm.batch
+            self._stream = json_llm.stream
+            self._astream = json_llm.astream
+    
+    def _dbg(self, msg: str, *args: Any) -> None:
+        """
+        Log a debug message lazily.
+        
+        Use %-style placeholders (self._dbg("prompt=%s", prompt)) rather than
+        f-strings so large prompts and responses are only formatted when
+        debug logging is enabled.
+        
+        Args:
+            msg: The message format string
+            *args: The arguments for the format string
+        """
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(msg, *args)
+    
+    def _stream_invoke(self, prompt: Any) -> AIMessage:
+        """
+        Invoke the LLM in streaming mode.
+        
+        Chunks are forwarded to on_token as they arrive, so callers can start
+        consuming the output before generation finishes. Responses are cached
+        by model and prompt, so a repeated prompt skips the LLM call.
+        
+        Args:
+            prompt: The prompt to send to the LLM
+            
+        Returns:
+            The complete response message
+        """
+        cache_key = self._response_cache_key(prompt)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
+        content_buffer = []
+        for chunk in self._stream(prompt):
+            content = chunk.content
+            if not content:
+                continue
+            content_buffer.append(content)
+            if self.on_token is not None:
+                self.on_token(content)
+        
+        return self._cache_response(cache_key, "".join(content_buffer))
+    
+    async def _astream_invoke(self, prompt: Any) -> AIMessage:
+        """
+        Asynchronous counterpart of _stream_invoke.
+        
+        Args:
+            prompt: The prompt to send to the LLM
+            
+        Returns:
+            The complete response message
+        """
+        cache_key = self._response_cache_key(prompt)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
+        content_buffer = []
+        async for chunk in self._astream(prompt):
+            content = chunk.content
+            if not content:
+                continue
+            content_buffer.append(content)
+            if self.on_token is not None:
+                self.on_token(content)
+        
+        return self._cache_response(cache_key, "".join(content_buffer))
+    
+    def _cached_response(self, cache_key: str) -> Optional[AIMessage]:
+        """
+        Look up a cached LLM response, replaying it to on_token on a hit.
+        
+        Args:
+            cache_key: The response cache key
+            
+        Returns:
+            The cached response message, or None on a miss
+        """
+        with _RESPONSE_CACHE_LOCK:
+            cached = _RESPONSE_CACHE.get(cache_key)
+            if cached is not None:
+                _RESPONSE_CACHE.move_to_end(cache_key)
+        
+        if cached is None:
+            return None
+        
+        self.logger.info("Using cached LLM response")
+        if self.on_token is not None:
+            self.on_token(cached)
+        return AIMessage(content=cached)
+    
+    def _cache_response(self, cache_key: str, response_content: str) -> AIMessage:
+        """
+        Store an LLM response in the cache.
+        
+        Args:
+            cache_key: The response cache key
+            response_content: The complete response content
+            
+        Returns:
+            The response message
+        """
+        with _RESPONSE_CACHE_LOCK:
+            _RESPONSE_CACHE[cache_key] = response_content
+            if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_SIZE:
+                _RESPONSE_CACHE.popitem(last=False)
+        
+        return AIMessage(content=response_content)
+    
+    def _response_cache_key(self, prompt: Any) -> str:
+        """
+        Build the response cache key for a prompt.
+        
+        Args:
+            prompt: The prompt sent to the LLM
+            
+        Returns:
+            A hex digest of the model settings and the prompt
+        """
+        model = getattr(self.llm, "model_name", None) or getattr(self.llm, "model", "")
+        temperature = getattr(self.llm, "temperature", None)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{type(self.llm).__name__}\0{model}\0{temperature}\0".encode("utf-8"))
+        digest.update(str(prompt).encode("utf-8"))
+        return digest.hexdigest()
+    
+    def _build_messages(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        """
+        Build the LLM messages for a state.
+        
+        Agents that support process_batch override this method and accept
+        the batched LLM response as a second argument to _process.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The messages to send to the LLM
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support batched processing")
+    
+    @classmethod
+    def process_batch(
+        cls,
+        agents_and_states: Sequence[Tuple["BaseAgent", Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Process several states with a single batched LLM call per model.
+        
+        The prompts are sent with llm.batch, which runs up to
+        _BATCH_MAX_CONCURRENCY requests concurrently, and each response is
+        then parsed by its agent in order. Batched responses are not
+        streamed to on_token and bypass the response cache.
+        
+        Args:
+            agents_and_states: Pairs of an agent and the state it should process
+            
+        Returns:
+            The updated states, in the same order as the input pairs
+        """
+        pairs = list(agents_and_states)
+        prompts = [agent._build_messages(state) for agent, state in pairs]
+        
+        # Group the prompts by bound LLM so each model receives one batch
+        groups: Dict[int, List[int]] = {}
+        for index, (agent, _) in enumerate(pairs):
+            groups.setdefault(id(agent._batch.__self__), []).append(index)
+        
+        responses: List[Any] = [None] * len(pairs)
+        for indices in groups.values():
+            batch = pairs[indices[0]][0]._batch(
+                [prompts[index] for index in indices],
+                config={"max_concurrency": _BATCH_MAX_CONCURRENCY}
+            )
+            for index, response in zip(indices, batch):
+                responses[index] = response
+        
+        return [
+            agent._process(state, response)
+            for (agent, state), response in zip(pairs, responses)
+        ]
     
     @abstractmethod
     def _process(self, state: Dict[str, Any]) -> Dict[str, Any]:
@@ -58,3 +291,64 @@ class BaseAgent(ABC):
             The updated state
         """
         return self._process(state)
+    
+    async def _aprocess(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Process the state asynchronously.
+        
+        Agents that implement _build_messages await the LLM natively and
+        only run the CPU-bound parsing in _process on a worker thread, the
+        same split process_batch uses. Other agents run _process in a
+        worker thread. Agents can override this method.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The updated state
+        """
+        if type(self)._build_messages is BaseAgent._build_messages:
+            return await asyncio.to_thread(self._process, state)
+        
+        response = await self._astream_invoke(self._build_messages(state))
+        return await asyncio.to_thread(self._process, state, response)
+    
+    async def acall(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Asynchronous counterpart of __call__, so independent agents can be
+        awaited together with asyncio.gather.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The updated state
+        """
+        return await self._aprocess(state)
+    
+    @classmethod
+    async def aprocess_many(
+        cls,
+        agents_and_states: Sequence[Tuple["BaseAgent", Dict[str, Any]]],
+        max_concurrency: int = _ASYNC_MAX_CONCURRENCY
+    ) -> List[Dict[str, Any]]:
+        """
+        Process independent states concurrently.
+        
+        Each pair is run through acall, with at most max_concurrency agents
+        awaiting the LLM at once.
+        
+        Args:
+            agents_and_states: Pairs of an agent and the state it should process
+            max_concurrency: The maximum number of concurrently running agents
+            
+        Returns:
+            The updated states, in the same order as the input pairs
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(agent: "BaseAgent", state: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await agent.acall(state)
+        
+        return await asyncio.gather(*(run(agent, state) for agent, state in agents_and_states))
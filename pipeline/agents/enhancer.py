@@ -2,25 +2,125 @@
 Enhancer agent for the AAOIFI Standards Enhancement System.
 """
 
-import logging
+import functools
+import os
 import re
-import json
-from typing import Dict, Any, Optional, List
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Any, Optional, List
 from datetime import datetime
 
+import orjson
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain.output_parsers import PydanticOutputParser, OutputFixingParser
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 
 from pipeline.agents.base_agent import BaseAgent
 from pipeline.models.models import KnowledgeRequest, AuditEntry
 
+# Quality score used when none can be extracted from the LLM response
+_DEFAULT_QUALITY_SCORE = int(os.environ.get("DEFAULT_QUALITY_SCORE", "70"))
+
+# Patterns used to parse LLM responses, compiled once at import time
+_QUALITY_SCORE_RE = re.compile(r'Quality score:\s*(\d+)')
+_ENHANCED_TEXT_RE = re.compile(r'Enhanced text:\s*([\s\S]+?)(?:Quality score:|$)')
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+_JSON_BRACES_RE = re.compile(r'(\{[\s\S]*\})')
+_NOTES_RE = re.compile(r'Notes:\s*([\s\S]+?)(?:Improvements:|Recommendations:|Needs knowledge:|$)')
+_NEEDS_KNOWLEDGE_RE = re.compile(r'Needs knowledge:\s*(true|false)', re.IGNORECASE)
+_KNOWLEDGE_QUERY_RE = re.compile(r'Knowledge query:\s*([^\n]+)')
+
+# Responses larger than this are not sent back to the LLM for fixing
+_MAX_FIXABLE_RESPONSE_SIZE = 32 * 1024
+
+# Headers of the numbered lists in an unstructured response
+_LIST_HEADERS = ("Improvements:", "Recommendations:")
+
+def _numbered_item(line: str) -> Optional[str]:
+    """Return the text of a "1. text" list item, or None if the line is not one."""
+    line = line.lstrip()
+    digits = 0
+    while digits < len(line) and line[digits] in "0123456789":
+        digits += 1
+    if digits == 0 or line[digits:digits + 1] != ".":
+        return None
+    return line[digits + 1:].strip() or None
+
+def _scan_numbered_lists(text: str) -> Dict[str, List[str]]:
+    """
+    Collect the numbered items following each list header in a single pass
+    over the lines of the text.
+    
+    Args:
+        text: The text to scan
+        
+    Returns:
+        A dictionary mapping each header in _LIST_HEADERS to its items
+    """
+    lists: Dict[str, List[str]] = {}
+    current = None
+    
+    for line in text.splitlines():
+        if current is not None:
+            item = _numbered_item(line)
+            if item is not None:
+                current.append(item)
+                continue
+            # Blank lines are allowed between the header and the first item
+            if not current and not line.strip():
+                continue
+            current = None
+        
+        for header in _LIST_HEADERS:
+            position = line.find(header)
+            if position != -1 and header not in lists:
+                current = lists[header] = []
+                item = _numbered_item(line[position + len(header):])
+                if item is not None:
+                    current.append(item)
+                break
+    
+    return {header: lists.get(header, []) for header in _LIST_HEADERS}
+
+@functools.lru_cache(maxsize=256)
+def _extract_json(text: str) -> str:
+    """
+    Extract JSON content from a text that might contain markdown or other
+    formatting. Results are cached on the raw text.
+    
+    Args:
+        text: The text to extract JSON from
+        
+    Returns:
+        The extracted JSON string or the original text if no JSON found
+    """
+    # Fast path: the prompt asks for a bare JSON object
+    stripped = text.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        return stripped
+    
+    # Try to find JSON content between triple backticks
+    if '```' in text:
+        json_match = _JSON_FENCE_RE.search(text)
+        if json_match:
+            return json_match.group(1).strip()
+    
+    # Try to find JSON content between curly braces
+    json_match = _JSON_BRACES_RE.search(text)
+    if json_match:
+        return json_match.group(1).strip()
+    
+    return text
+
 class EnhancerOutput(BaseModel):
     """
     Output from the enhancer agent.
     """
     
+    # The core schema is only built when the model is first used
+    model_config = ConfigDict(defer_build=True)
+    
     enhanced_text: str = Field(
         description="The enhanced text of the standard"
     )
@@ -47,34 +147,30 @@ class EnhancerOutput(BaseModel):
         description="The query to use for knowledge retrieval"
     )
 
-class Enhancer(BaseAgent):
+@dataclass(slots=True)
+class AuditStep:
     """
-    Agent responsible for enhancing the AAOIFI standard.
-    
-    This agent:
-    - Improves language and clarity
-    - Enhances structure and formatting
-    - Makes recommendations for further improvement
+    A processing step recorded in the enhancer's audit info.
     """
     
-    def __init__(self, llm: ChatOpenAI):
-        """
-        Initialize the enhancer agent.
-        
-        Args:
-            llm: The language model to use
-        """
-        super().__init__(
-            llm=llm,
-            name="enhancer",
-            stage_description="Improves the standard for clarity, completeness, and compliance",
-        )
-        
-        self.parser = PydanticOutputParser(pydantic_object=EnhancerOutput)
-        self.fixing_parser = OutputFixingParser.from_llm(parser=self.parser, llm=llm)
-        
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a specialized AI assistant that enhances AAOIFI (Accounting and Auditing Organization for Islamic Financial Institutions) standards. Your task is to improve the language, clarity, and completeness of the standard.
+    step: str
+    timestamp: str
+    description: str
+    success: Optional[bool] = None
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the step to a dictionary, leaving out unset optional fields."""
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+# The parser and prompt only depend on the output schema, so they are built
+# once and shared by every Enhancer instance
+_ENHANCER_PARSER = PydanticOutputParser(pydantic_object=EnhancerOutput)
+
+_ENHANCER_HUMAN_TEMPLATE = "Here is the reviewed AAOIFI standard to enhance:\n\n{reviewed_text}"
+
+_ENHANCER_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
+    ("system", """You are a specialized AI assistant that enhances AAOIFI (Accounting and Auditing Organization for Islamic Financial Institutions) standards. Your task is to improve the language, clarity, and completeness of the standard.
 
 Your enhancements should focus on:
 1. Improving clarity and readability
@@ -98,13 +194,59 @@ Remember that your output needs to be parseable as JSON.
 
 {format_instructions}
 """),
-            ("human", "Here is the reviewed AAOIFI standard to enhance:\n\n{reviewed_text}")
-        ])
+    ("human", _ENHANCER_HUMAN_TEMPLATE)
+])
+
+@functools.cache
+def _enhancer_prompt() -> ChatPromptTemplate:
+    """Partial the prompt with the parser's format instructions on first use."""
+    return _ENHANCER_PROMPT_TEMPLATE.partial(
+        format_instructions=_ENHANCER_PARSER.get_format_instructions()
+    )
+
+@functools.cache
+def _enhancer_system_message() -> SystemMessage:
+    """Render the invariant system message of the prompt once."""
+    return _enhancer_prompt().format_messages(reviewed_text="")[0]
+
+class Enhancer(BaseAgent):
+    """
+    Agent responsible for enhancing the AAOIFI standard.
+    
+    This agent:
+    - Improves language and clarity
+    - Enhances structure and formatting
+    - Makes recommendations for further improvement
+    """
+    
+    def __init__(
+        self,
+        llm: ChatOpenAI,
+        on_token: Optional[Callable[[str], None]] = None,
+        default_quality_score: int = _DEFAULT_QUALITY_SCORE
+    ):
+        """
+        Initialize the enhancer agent.
         
-        self.prompt = self.prompt.partial(
-            format_instructions=self.parser.get_format_instructions()
+        Args:
+            llm: The language model to use
+            on_token: Optional callback receiving each streamed chunk of the LLM response
+            default_quality_score: Score used when none can be parsed from the response
+        """
+        super().__init__(
+            llm=llm,
+            name="enhancer",
+            stage_description="Improves the standard for clarity, completeness, and compliance",
+            on_token=on_token,
         )
         
+        self.parser = _ENHANCER_PARSER
+        self.fixing_parser = OutputFixingParser.from_llm(parser=self.parser, llm=llm)
+        self.prompt = _enhancer_prompt()
+        self._system_message = _enhancer_system_message()
+        self._output: Optional[EnhancerOutput] = None
+        self._default_quality_score = int(default_quality_score)
+        
         # Initialize audit information
         self.audit_info = {
             "start_time": None,
@@ -124,10 +266,10 @@ Remember that your output needs to be parseable as JSON.
             text: The text to extract the quality score from
             
         Returns:
-            The quality score, or 70 as a default
+            The quality score, or the agent's default score
         """
         # Try to find "Quality score: X" pattern
-        quality_match = re.search(r'Quality score:\s*(\d+)', text)
+        quality_match = _QUALITY_SCORE_RE.search(text)
         if quality_match:
             try:
                 return int(quality_match.group(1))
@@ -135,10 +277,8 @@ Remember that your output needs to be parseable as JSON.
                 pass
         
         # Default to a reasonable score to avoid infinite loops
-        import os
-        default_score = int(os.environ.get("DEFAULT_QUALITY_SCORE", "70"))
-        self.logger.warning(f"Could not extract quality score, using default: {default_score}")
-        return default_score
+        self.logger.warning(f"Could not extract quality score, using default: {self._default_quality_score}")
+        return self._default_quality_score
     
     def _extract_enhanced_text(self, text: str) -> str:
         """
@@ -151,7 +291,7 @@ Remember that your output needs to be parseable as JSON.
             The enhanced text, or the original text as a fallback
         """
         # Try to find the enhanced text between "Enhanced text:" and the next section
-        enhanced_match = re.search(r'Enhanced text:\s*([\s\S]+?)(?:Quality score:|$)', text)
+        enhanced_match = _ENHANCED_TEXT_RE.search(text)
         if enhanced_match:
             return enhanced_match.group(1).strip()
         
@@ -168,18 +308,24 @@ Remember that your output needs to be parseable as JSON.
         Returns:
             The extracted JSON string or the original text if no JSON found
         """
-        # Try to find JSON content between triple backticks
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-        if json_match:
-            return json_match.group(1).strip()
-        
-        # Try to find JSON content between curly braces
-        json_match = re.search(r'(\{[\s\S]*\})', text)
-        if json_match:
-            return json_match.group(1).strip()
-        
-        return text
-    
+        return _extract_json(text)
+
+    def _is_fixable(self, json_content: str) -> bool:
+        """
+        Check whether extracted content is worth sending to the fixing parser.
+
+        Args:
+            json_content: The content extracted from the LLM response
+
+        Returns:
+            True if the content looks like JSON and is small enough to resend
+        """
+        return (
+            bool(json_content)
+            and json_content.lstrip()[:1] in ("{", "[")
+            and len(json_content) <= _MAX_FIXABLE_RESPONSE_SIZE
+        )
+
     def _parse_unstructured_response(self, response: str) -> EnhancerOutput:
         """
         Parse an unstructured response into an EnhancerOutput.
@@ -194,37 +340,29 @@ Remember that your output needs to be parseable as JSON.
         quality_score = self._extract_quality_score(response)
         
         # Extract notes if possible
-        notes_match = re.search(r'Notes:\s*([\s\S]+?)(?:Improvements:|Recommendations:|Needs knowledge:|$)', response)
+        notes_match = _NOTES_RE.search(response)
         notes = notes_match.group(1).strip() if notes_match else "Extracted from unstructured response"
         
-        # Extract improvements if possible
-        improvements = []
-        improvements_match = re.search(r'Improvements:\s*(?:(\d+\.\s*[^\n]+\n)+)', response)
-        if improvements_match:
-            improvements_text = improvements_match.group(0)
-            improvements = re.findall(r'\d+\.\s*([^\n]+)', improvements_text)
-        
-        # Extract recommendations if possible
-        recommendations = []
-        recommendations_match = re.search(r'Recommendations:\s*(?:(\d+\.\s*[^\n]+\n)+)', response)
-        if recommendations_match:
-            recommendations_text = recommendations_match.group(0)
-            recommendations = re.findall(r'\d+\.\s*([^\n]+)', recommendations_text)
+        # Extract improvements and recommendations if possible
+        numbered_lists = _scan_numbered_lists(response)
+        improvements = numbered_lists["Improvements:"]
+        recommendations = numbered_lists["Recommendations:"]
         
         # Extract needs_knowledge if possible
         needs_knowledge = False
-        needs_knowledge_match = re.search(r'Needs knowledge:\s*(true|false)', response, re.IGNORECASE)
+        needs_knowledge_match = _NEEDS_KNOWLEDGE_RE.search(response)
         if needs_knowledge_match:
             needs_knowledge = needs_knowledge_match.group(1).lower() == 'true'
         
         # Extract knowledge_query if possible
         knowledge_query = None
         if needs_knowledge:
-            knowledge_query_match = re.search(r'Knowledge query:\s*([^\n]+)', response)
+            knowledge_query_match = _KNOWLEDGE_QUERY_RE.search(response)
             if knowledge_query_match:
                 knowledge_query = knowledge_query_match.group(1).strip()
         
-        return EnhancerOutput(
+        # Every field was just extracted with its final type, so skip validation
+        return EnhancerOutput.model_construct(
             enhanced_text=enhanced_text,
             quality_score=quality_score,
             notes=notes,
@@ -245,7 +383,12 @@ Remember that your output needs to be parseable as JSON.
             True if knowledge should be requested, False otherwise
         """
         # If we've already processed the state, check if we need knowledge
-        if hasattr(self, "_output") and self._output.needs_knowledge:
+        # A blank query would only search for the boilerplate AAOIFI terms
+        if (
+            self._output is not None
+            and self._output.needs_knowledge
+            and (self._output.knowledge_query or "").strip()
+        ):
             return True
         
         return False
@@ -272,9 +415,37 @@ Remember that your output needs to be parseable as JSON.
             requester=self.name,
             query=self._output.knowledge_query or "",
             context=f"Enhancing AAOIFI standard.",
-            timestamp=datetime.now()
         )
     
+    def _record_step(
+        self,
+        step: str,
+        description: str,
+        timestamp: Optional[str] = None,
+        success: Optional[bool] = None,
+        error: Optional[str] = None
+    ) -> str:
+        """
+        Record a processing step in the audit info.
+        
+        Args:
+            step: The name of the step
+            description: A description of the step
+            timestamp: An ISO timestamp to reuse, taken now if not given
+            success: Whether the step succeeded, if applicable
+            error: The error message of a failed step, if any
+            
+        Returns:
+            The timestamp recorded for the step
+        """
+        if timestamp is None:
+            timestamp = datetime.now().isoformat()
+        
+        self.audit_info["processing_steps"].append(
+            AuditStep(step, timestamp, description, success, error)
+        )
+        return timestamp
+    
     def _get_audit_entry(self) -> Dict[str, Any]:
         """
         Get a detailed audit entry for the enhancer processing.
@@ -286,27 +457,50 @@ Remember that your output needs to be parseable as JSON.
             "stage": self.name,
             "start_time": self.audit_info["start_time"],
             "end_time": self.audit_info["end_time"],
-            "quality_score": getattr(self, "_output", None) and self._output.quality_score or 0,
+            "quality_score": self._output.quality_score if self._output is not None else 0,
             "tools_used": self.audit_info["tools_used"],
-            "processing_steps": self.audit_info["processing_steps"],
+            "processing_steps": [step.to_dict() for step in self.audit_info["processing_steps"]],
             "justification": self.audit_info["justification"],
             "improvements": self.audit_info["improvements"],
             "recommendations": self.audit_info["recommendations"]
         }
     
-    def _process(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    def _build_messages(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        """
+        Build the LLM messages for a state.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The system message followed by the reviewed text
+        """
+        # Only the human message varies, so build the messages directly
+        return [
+            self._system_message,
+            HumanMessage(content=_ENHANCER_HUMAN_TEMPLATE.format(reviewed_text=self._reviewed_text(state)))
+        ]
+    
+    @staticmethod
+    def _reviewed_text(state: Dict[str, Any]) -> str:
+        """Get the text to enhance, falling back to earlier stages' text."""
+        return state.get("reviewed_text", state.get("preprocessed_text", state.get("standard_text", "")))
+    
+    def _process(self, state: Dict[str, Any], response: Optional[AIMessage] = None) -> Dict[str, Any]:
         """
         Process the state.
         
         Args:
             state: The current state
+            response: An LLM response obtained by process_batch, if any
             
         Returns:
             The updated state
         """
         # Reset audit info for this processing run
+        start_time = datetime.now().isoformat()
         self.audit_info = {
-            "start_time": datetime.now().isoformat(),
+            "start_time": start_time,
             "end_time": None,
             "tools_used": [],
             "processing_steps": [],
@@ -316,76 +510,85 @@ Remember that your output needs to be parseable as JSON.
         }
         
         # Record the processing step
-        self.audit_info["processing_steps"].append({
-            "step": "initialization",
-            "timestamp": datetime.now().isoformat(),
-            "description": "Enhancer agent initialized with reviewed standard text"
-        })
+        self._record_step(
+            "initialization",
+            "Enhancer agent initialized with reviewed standard text",
+            timestamp=start_time
+        )
         
         # Format the prompt with the reviewed text
-        reviewed_text = state.get("reviewed_text", state.get("preprocessed_text", state.get("standard_text", "")))
-        
-        formatted_prompt = self.prompt.format(reviewed_text=reviewed_text)
+        formatted_prompt = self._build_messages(state)
         
         # Record the processing step
-        self.audit_info["processing_steps"].append({
-            "step": "prompt_creation",
-            "timestamp": datetime.now().isoformat(),
-            "description": "Created prompt for LLM to enhance the standard"
-        })
+        self._record_step("prompt_creation", "Created prompt for LLM to enhance the standard")
         
-        # Get the response from the LLM
-        response = self.llm.invoke(formatted_prompt)
-        self.logger.debug(f"Raw response: {response.content}")
+        # Get the response from the LLM unless it was already batched
+        if response is None:
+            response = self._stream_invoke(formatted_prompt)
+        self._dbg("Raw response: %s", response.content)
         
         # Record the processing step
-        self.audit_info["processing_steps"].append({
-            "step": "llm_response",
-            "timestamp": datetime.now().isoformat(),
-            "description": "Received response from LLM"
-        })
+        self._record_step("llm_response", "Received response from LLM")
         
         # Parse the response
         parsing_method = "unknown"
         try:
             # First, try to extract JSON from the response
             json_content = self._extract_json_from_response(response.content)
-            self.logger.debug(f"Extracted JSON: {json_content}")
+            self._dbg("Extracted JSON: %s", json_content)
             
-            # Try standard parsing first
+            # Fast path: decode with orjson and validate the resulting dict
+            self._output = None
             try:
-                self._output = self.parser.parse(json_content)
-                parsing_method = "standard_parser"
-                self.logger.info("Successfully parsed output with standard parser")
-            except Exception as e:
-                self.logger.warning(f"Standard parsing failed: {e}, trying fixing parser")
-                # If regular parsing fails, try the fixing parser
+                self._output = EnhancerOutput.model_validate(orjson.loads(json_content))
+                parsing_method = "orjson_fast_path"
+                self.logger.info("Successfully parsed output with orjson fast path")
+            except (orjson.JSONDecodeError, ValidationError) as e:
+                self._dbg("orjson fast path failed: %s", e)
+            
+            if self._output is None:
+                # Try standard parsing next
                 try:
-                    self._output = self.fixing_parser.parse(json_content)
-                    parsing_method = "fixing_parser"
-                    self.logger.info("Successfully parsed output with fixing parser")
-                except Exception as fix_e:
-                    self.logger.warning(f"Fixing parser failed: {fix_e}, trying manual parsing")
-                    # If fixing parser fails, try to parse as regular JSON
-                    try:
-                        json_obj = json.loads(json_content)
-                        self._output = EnhancerOutput(**json_obj)
-                        parsing_method = "manual_json_parsing"
-                        self.logger.info("Successfully parsed output with manual JSON parsing")
-                    except Exception as json_e:
-                        # If all JSON parsing fails, try unstructured parsing
-                        self.logger.warning(f"Manual JSON parsing failed: {json_e}, falling back to unstructured parsing")
+                    self._output = self.parser.parse(json_content)
+                    parsing_method = "standard_parser"
+                    self.logger.info("Successfully parsed output with standard parser")
+                except Exception as e:
+                    # Only ask the LLM to fix content that looks like JSON and
+                    # is small enough to resend; anything else goes straight to
+                    # unstructured parsing
+                    if not self._is_fixable(json_content):
+                        self.logger.warning(f"Standard parsing failed: {e}, content is not fixable JSON, falling back to unstructured parsing")
                         self._output = self._parse_unstructured_response(response.content)
                         parsing_method = "unstructured_parsing"
                         self.logger.info("Successfully parsed output with unstructured parsing")
+                    else:
+                        self.logger.warning(f"Standard parsing failed: {e}, trying fixing parser")
+                        # If regular parsing fails, try the fixing parser
+                        try:
+                            self._output = self.fixing_parser.parse(json_content)
+                            parsing_method = "fixing_parser"
+                            self.logger.info("Successfully parsed output with fixing parser")
+                        except Exception as fix_e:
+                            self.logger.warning(f"Fixing parser failed: {fix_e}, trying manual parsing")
+                            # If fixing parser fails, try to parse as regular JSON
+                            try:
+                                json_obj = orjson.loads(json_content)
+                                self._output = EnhancerOutput(**json_obj)
+                                parsing_method = "manual_json_parsing"
+                                self.logger.info("Successfully parsed output with manual JSON parsing")
+                            except Exception as json_e:
+                                # If all JSON parsing fails, try unstructured parsing
+                                self.logger.warning(f"Manual JSON parsing failed: {json_e}, falling back to unstructured parsing")
+                                self._output = self._parse_unstructured_response(response.content)
+                                parsing_method = "unstructured_parsing"
+                                self.logger.info("Successfully parsed output with unstructured parsing")
             
             # Record successful parsing and store relevant information
-            self.audit_info["processing_steps"].append({
-                "step": "parsing",
-                "timestamp": datetime.now().isoformat(),
-                "description": f"Successfully parsed LLM response using {parsing_method}",
-                "success": True
-            })
+            parsed_time = self._record_step(
+                "parsing",
+                f"Successfully parsed LLM response using {parsing_method}",
+                success=True
+            )
             
             # Store improvements and recommendations
             if hasattr(self._output, "improvements"):
@@ -406,25 +609,24 @@ Remember that your output needs to be parseable as JSON.
             self.logger.error(f"Response content: {response.content}")
             
             # Record parsing failure
-            self.audit_info["processing_steps"].append({
-                "step": "parsing",
-                "timestamp": datetime.now().isoformat(),
-                "description": f"Failed to parse LLM response: {str(e)}",
-                "success": False,
-                "error": str(e)
-            })
+            parsed_time = self._record_step(
+                "parsing",
+                f"Failed to parse LLM response: {str(e)}",
+                success=False,
+                error=str(e)
+            )
             
-            # Create a fallback output
-            import os
-            default_score = int(os.environ.get("DEFAULT_QUALITY_SCORE", "70"))
+            # Create a fallback output that keeps the text unchanged
+            default_score = self._default_quality_score
             
-            self._output = EnhancerOutput(
-                enhanced_text=reviewed_text,
+            self._output = EnhancerOutput.model_construct(
+                enhanced_text=self._reviewed_text(state),
                 quality_score=default_score,
                 notes=f"Error parsing response: {e}",
                 improvements=["Unable to enhance standard due to parsing error"],
                 recommendations=["Review original standard manually"],
                 needs_knowledge=False,
+                knowledge_query=None,
             )
             
             # Store improvements and recommendations
@@ -440,8 +642,12 @@ Remember that your output needs to be parseable as JSON.
         
         self.logger.info(f"Enhancer quality score: {self._output.quality_score}")
         
-        # Set the end time
-        self.audit_info["end_time"] = datetime.now().isoformat()
+        # Processing ends with parsing; reuse its timestamp
+        self.audit_info["end_time"] = parsed_time
+        
+        # Record the score in the state's quality scores in place
+        quality_scores = state["quality_scores"]
+        quality_scores["enhancer"] = self._output.quality_score
         
         # Check if we need knowledge
         if self._should_request_knowledge(state):
@@ -457,10 +663,7 @@ Remember that your output needs to be parseable as JSON.
             # Update the state with audit information
             return {
                 "knowledge_request": knowledge_request,
-                "quality_scores": {
-                    **state["quality_scores"],
-                    "enhancer": self._output.quality_score
-                },
+                "quality_scores": quality_scores,
                 "notes": self._output.notes,
                 "audit_entry": self._get_audit_entry()
             }
@@ -468,10 +671,7 @@ Remember that your output needs to be parseable as JSON.
         # Return the updated state with audit information
         return {
             "enhanced_text": self._output.enhanced_text,
-            "quality_scores": {
-                **state["quality_scores"],
-                "enhancer": self._output.quality_score
-            },
+            "quality_scores": quality_scores,
             "notes": self._output.notes,
             "audit_entry": self._get_audit_entry()
         }
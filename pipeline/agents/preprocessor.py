@@ -2,14 +2,16 @@
 Preprocessor agent for the AAOIFI Standards Enhancement System.
 """
 
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List
+import functools
 import logging
 import re
 
 from langchain.llms.base import BaseLLM
 from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 from pipeline.agents.base_agent import BaseAgent
 from pipeline.models.models import KnowledgeRequest
@@ -19,6 +21,9 @@ class PreprocessorOutput(BaseModel):
     Output from the preprocessor agent.
     """
     
+    # The core schema is only built when the model is first used
+    model_config = ConfigDict(defer_build=True)
+    
     preprocessed_text: str = Field(
         description="The preprocessed text of the standard"
     )
@@ -41,33 +46,14 @@ class PreprocessorOutput(BaseModel):
         description="The query to use for knowledge retrieval"
     )
 
-class Preprocessor(BaseAgent):
-    """
-    Agent responsible for preprocessing the AAOIFI standard.
-    
-    This agent:
-    - Parses and structures the input
-    - Flags missing content or structure
-    - Can request Knowledge Retrieval if gaps are found
-    """
-    
-    def __init__(self, llm: BaseLLM):
-        """
-        Initialize the preprocessor agent.
-        
-        Args:
-            llm: The language model to use
-        """
-        super().__init__(
-            llm=llm,
-            name="preprocessor",
-            stage_description="Parses and structures the input standard",
-        )
-        
-        self.parser = PydanticOutputParser(pydantic_object=PreprocessorOutput)
-        
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a specialized AI assistant that preprocesses AAOIFI (Accounting and Auditing Organization for Islamic Financial Institutions) standards. Your task is to parse and structure the input text to prepare it for review and enhancement.
+# The parser and prompt only depend on the output schema, so they are built
+# once and shared by every Preprocessor instance
+_PREPROCESSOR_PARSER = PydanticOutputParser(pydantic_object=PreprocessorOutput)
+
+_PREPROCESSOR_HUMAN_TEMPLATE = "Here is the AAOIFI standard to preprocess:\n\n{standard_text}"
+
+_PREPROCESSOR_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
+    ("system", """You are a specialized AI assistant that preprocesses AAOIFI (Accounting and Auditing Organization for Islamic Financial Institutions) standards. Your task is to parse and structure the input text to prepare it for review and enhancement.
 
 AAOIFI standards are comprehensive documents that provide guidance on Shariah-compliant accounting, auditing, governance, ethics, and Shariah standards for Islamic financial institutions. Your job is to:
 
@@ -93,12 +79,49 @@ Be thorough but concise in your preprocessing.
 
 {format_instructions}
 """),
-            ("human", "Here is the AAOIFI standard to preprocess:\n\n{standard_text}")
-        ])
+    ("human", _PREPROCESSOR_HUMAN_TEMPLATE)
+])
+
+@functools.cache
+def _preprocessor_prompt() -> ChatPromptTemplate:
+    """Partial the prompt with the parser's format instructions on first use."""
+    return _PREPROCESSOR_PROMPT_TEMPLATE.partial(
+        format_instructions=_PREPROCESSOR_PARSER.get_format_instructions()
+    )
+
+@functools.cache
+def _preprocessor_system_message() -> SystemMessage:
+    """Render the invariant system message of the prompt once."""
+    return _preprocessor_prompt().format_messages(standard_text="")[0]
+
+class Preprocessor(BaseAgent):
+    """
+    Agent responsible for preprocessing the AAOIFI standard.
+    
+    This agent:
+    - Parses and structures the input
+    - Flags missing content or structure
+    - Can request Knowledge Retrieval if gaps are found
+    """
+    
+    def __init__(self, llm: BaseLLM, on_token: Optional[Callable[[str], None]] = None):
+        """
+        Initialize the preprocessor agent.
         
-        self.prompt = self.prompt.partial(
-            format_instructions=self.parser.get_format_instructions()
+        Args:
+            llm: The language model to use
+            on_token: Optional callback receiving each streamed chunk of the LLM response
+        """
+        super().__init__(
+            llm=llm,
+            name="preprocessor",
+            stage_description="Parses and structures the input standard",
+            on_token=on_token,
         )
+        
+        self.parser = _PREPROCESSOR_PARSER
+        self.prompt = _preprocessor_prompt()
+        self._system_message = _preprocessor_system_message()
     
     def _should_request_knowledge(self, state: Dict[str, Any]) -> bool:
         """
@@ -111,7 +134,12 @@ Be thorough but concise in your preprocessing.
             True if knowledge should be requested, False otherwise
         """
         # If we've already processed the state, check if we need knowledge
-        if hasattr(self, "_output") and self._output.needs_knowledge:
+        # A blank query would only search for the boilerplate AAOIFI terms
+        if (
+            hasattr(self, "_output")
+            and self._output.needs_knowledge
+            and (self._output.knowledge_query or "").strip()
+        ):
             return True
         
         return False
@@ -126,32 +154,43 @@ Be thorough but concise in your preprocessing.
         Returns:
             A knowledge request
         """
-        # Explicitly create with current timestamp to avoid validation errors
-        from datetime import datetime
-        
         return KnowledgeRequest(
             requester=self.name,
             query=self._output.knowledge_query or "",
             context=f"Preprocessing AAOIFI standard. Missing elements: {', '.join(self._output.missing_elements)}",
-            timestamp=datetime.now(),  # Explicitly set the timestamp
             additional_params={}
         )
     
-    def _process(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    def _build_messages(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        """
+        Build the LLM messages for a state.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The system message followed by the standard text
+        """
+        # Only the human message varies, so build the messages directly
+        return [
+            self._system_message,
+            HumanMessage(content=_PREPROCESSOR_HUMAN_TEMPLATE.format(standard_text=state["standard_text"]))
+        ]
+    
+    def _process(self, state: Dict[str, Any], response: Optional[AIMessage] = None) -> Dict[str, Any]:
         """
         Process the state.
         
         Args:
             state: The current state
+            response: An LLM response obtained by process_batch, if any
             
         Returns:
             The updated state
         """
-        # Format the prompt with the standard text
-        formatted_prompt = self.prompt.format(standard_text=state["standard_text"])
-        
-        # Get the response from the LLM
-        response = self.llm.invoke(formatted_prompt)
+        # Get the response from the LLM unless it was already batched
+        if response is None:
+            response = self._stream_invoke(self._build_messages(state))
         
         # Parse the response
         try:
@@ -161,14 +200,19 @@ Be thorough but concise in your preprocessing.
             self.logger.error(f"Response content: {response.content}")
             
             # Create a fallback output
-            self._output = PreprocessorOutput(
+            self._output = PreprocessorOutput.model_construct(
                 preprocessed_text=state["standard_text"],
                 quality_score=0,
                 notes=f"Error parsing response: {e}",
                 missing_elements=["Unable to process standard"],
                 needs_knowledge=False,
+                knowledge_query=None,
             )
         
+        # Record the score in the state's quality scores in place
+        quality_scores = state["quality_scores"]
+        quality_scores["preprocessor"] = self._output.quality_score
+        
         # Check if we need knowledge
         if self._should_request_knowledge(state):
             self.logger.info("Preprocessor requesting knowledge")
@@ -183,19 +227,13 @@ Be thorough but concise in your preprocessing.
             # Return the state with the knowledge request
             return {
                 "knowledge_request": knowledge_request,
-                "quality_scores": {
-                    **state["quality_scores"],
-                    "preprocessor": self._output.quality_score
-                },
+                "quality_scores": quality_scores,
                 "notes": self._output.notes
             }
         
         # Return the updated state
         return {
             "preprocessed_text": self._output.preprocessed_text,
-            "quality_scores": {
-                **state["quality_scores"],
-                "preprocessor": self._output.quality_score
-            },
+            "quality_scores": quality_scores,
             "notes": self._output.notes
         }
@@ -2,17 +2,29 @@
 Reviewer agent for the AAOIFI Standards Enhancement System.
 """
 
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List, Tuple
+import asyncio
+import functools
 import logging
+import re
 
 from langchain.llms.base import BaseLLM
 from langchain.prompts import ChatPromptTemplate
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 
 from pipeline.agents.base_agent import BaseAgent
 from pipeline.models.models import KnowledgeRequest
 
+# Patterns spotting a knowledge request in a partially streamed response,
+# in either the JSON or the plain-text output format
+_NEEDS_KNOWLEDGE_HINT_RE = re.compile(r'"needs_knowledge"\s*:\s*true|Needs knowledge:\s*true', re.IGNORECASE)
+_KNOWLEDGE_QUERY_HINT_RE = re.compile(r'"knowledge_query"\s*:\s*"((?:[^"\\]|\\.)+)"|Knowledge query:\s*([^\n]+)\n')
+
+# Only the end of the streamed response is scanned for the hints
+_HINT_WINDOW = 1024
+
 class ReviewerOutput(BaseModel):
     """
     Output from the reviewer agent.
@@ -26,19 +38,14 @@ class ReviewerOutput(BaseModel):
     needs_knowledge: bool = Field(False, description="Whether external knowledge is needed")
     knowledge_query: Optional[str] = Field(None, description="The query to use for knowledge retrieval")
 
-class Reviewer(BaseAgent):
-    """
-    Reviews the AAOIFI standard for quality and Shariah compliance.
-    """
-    def __init__(self, llm: BaseLLM):
-        super().__init__(
-            llm=llm,
-            name="reviewer",
-            stage_description="Evaluates quality and Shariah compliance",
-        )
-        self.parser = PydanticOutputParser(pydantic_object=ReviewerOutput)
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a specialized AI assistant that reviews AAOIFI standards. Your job is to:
+# The parser and prompt only depend on the output schema, so they are built
+# once and shared by every Reviewer instance
+_REVIEWER_PARSER = PydanticOutputParser(pydantic_object=ReviewerOutput)
+
+_REVIEWER_HUMAN_TEMPLATE = "Here is the preprocessed AAOIFI standard to review:\n\n{preprocessed_text}"
+
+_REVIEWER_PROMPT_TEMPLATE = ChatPromptTemplate.from_messages([
+    ("system", """You are a specialized AI assistant that reviews AAOIFI standards. Your job is to:
 
 1. Check if the standard is clear, structured, and complete.
 2. Ensure it aligns with Shariah principles.
@@ -64,41 +71,80 @@ Be fair and thorough. Standards scoring below 50 will be sent back for revision.
 
 {format_instructions}
 """),
-            ("human", "Here is the preprocessed AAOIFI standard to review:\n\n{preprocessed_text}")
-        ])
-        self.prompt = self.prompt.partial(format_instructions=self.parser.get_format_instructions())
+    ("human", _REVIEWER_HUMAN_TEMPLATE)
+])
+
+@functools.cache
+def _reviewer_prompt() -> ChatPromptTemplate:
+    """Partial the prompt with the parser's format instructions on first use."""
+    return _REVIEWER_PROMPT_TEMPLATE.partial(
+        format_instructions=_REVIEWER_PARSER.get_format_instructions()
+    )
+
+@functools.cache
+def _reviewer_system_message() -> SystemMessage:
+    """Render the invariant system message of the prompt once."""
+    return _reviewer_prompt().format_messages(preprocessed_text="")[0]
+
+class Reviewer(BaseAgent):
+    """
+    Reviews the AAOIFI standard for quality and Shariah compliance.
+    """
+    def __init__(self, llm: BaseLLM, on_knowledge_query: Optional[Callable[[str], Any]] = None):
+        super().__init__(
+            llm=llm,
+            name="reviewer",
+            stage_description="Evaluates quality and Shariah compliance",
+        )
+        # Called with the knowledge query as soon as it appears in the streamed
+        # response, e.g. to start a speculative search; if it returns a future
+        # that turns out not to be needed, the future is cancelled
+        self.on_knowledge_query = on_knowledge_query
+        self.parser = _REVIEWER_PARSER
+        self.prompt = _reviewer_prompt()
+        self._system_message = _reviewer_system_message()
+        self._enable_json_mode()
 
     def _should_request_knowledge(self, state: Dict[str, Any]) -> bool:
-        if hasattr(self, "_output") and self._output.needs_knowledge:
+        # A blank query would only search for the boilerplate AAOIFI terms
+        if (
+            hasattr(self, "_output")
+            and self._output.needs_knowledge
+            and (self._output.knowledge_query or "").strip()
+        ):
             return True
         return False
 
     def _create_knowledge_request(self, state: Dict[str, Any]) -> KnowledgeRequest:
-        issues = []
-        if self._output.shariah_issues:
-            issues.append(f"Shariah issues: {', '.join(self._output.shariah_issues)}")
-        if self._output.clarity_issues:
-            issues.append(f"Clarity issues: {', '.join(self._output.clarity_issues)}")
-        if self._output.structure_issues:
-            issues.append(f"Structure issues: {', '.join(self._output.structure_issues)}")
+        issues = "; ".join(
+            f"{category} issues: {', '.join(items)}"
+            for category, items in (
+                ("Shariah", self._output.shariah_issues),
+                ("Clarity", self._output.clarity_issues),
+                ("Structure", self._output.structure_issues),
+            )
+            if items
+        )
 
         return KnowledgeRequest(
             requester=self.name,
             query=self._output.knowledge_query or "",
-            context=f"Reviewing AAOIFI standard. Issues identified: {'; '.join(issues)}",
-            timestamp=None,
+            context=f"Reviewing AAOIFI standard. Issues identified: {issues}",
         )
 
-    def _process(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        formatted_prompt = self.prompt.format(preprocessed_text=state["preprocessed_text"])
-        response = self.llm.invoke(formatted_prompt)
+    def _parse_response(self, state: Dict[str, Any], content: str) -> ReviewerOutput:
+        # Fast path: validate the JSON response directly with pydantic-core
+        try:
+            return ReviewerOutput.model_validate_json(content)
+        except ValidationError:
+            pass
 
         try:
-            self._output = self.parser.parse(response.content)
+            return self.parser.parse(content)
         except Exception as e:
-            self.logger.error(f"Error parsing response: {e}")
-            self.logger.error(f"Response content: {response.content}")
-            self._output = ReviewerOutput(
+            self.logger.error("Error parsing response: %s", e)
+            self.logger.error("Response content: %s", content)
+            return ReviewerOutput.model_construct(
                 reviewed_text=state["preprocessed_text"],
                 quality_score=0,
                 notes=f"Error parsing response: {e}",
@@ -108,6 +154,11 @@ Be fair and thorough. Standards scoring below 50 will be sent back for revision.
                 needs_knowledge=False,
             )
 
+    def _build_result(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # Record the score in the state's quality scores in place
+        quality_scores = state["quality_scores"]
+        quality_scores["reviewer"] = self._output.quality_score
+
         if self._should_request_knowledge(state):
             self.logger.info("Reviewer requesting knowledge")
             knowledge_request = self._create_knowledge_request(state)
@@ -115,18 +166,68 @@ Be fair and thorough. Standards scoring below 50 will be sent back for revision.
             state["knowledge_requests"].append(knowledge_request)
             return {
                 "knowledge_request": knowledge_request,
-                "quality_scores": {
-                    **state["quality_scores"],
-                    "reviewer": self._output.quality_score
-                },
+                "quality_scores": quality_scores,
                 "notes": self._output.notes
             }
 
         return {
             "reviewed_text": self._output.reviewed_text,
-            "quality_scores": {
-                **state["quality_scores"],
-                "reviewer": self._output.quality_score
-            },
+            "quality_scores": quality_scores,
             "notes": self._output.notes
         }
+
+    def _build_messages(self, state: Dict[str, Any]) -> List[BaseMessage]:
+        # Only the human message varies, so build the messages directly
+        return [
+            self._system_message,
+            HumanMessage(content=_REVIEWER_HUMAN_TEMPLATE.format(preprocessed_text=state["preprocessed_text"]))
+        ]
+
+    def _process(self, state: Dict[str, Any], response: Optional[AIMessage] = None) -> Dict[str, Any]:
+        if response is None:
+            response = self._stream_invoke(self._build_messages(state))
+        self._output = self._parse_response(state, response.content)
+        return self._build_result(state)
+
+    async def _aprocess(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        speculation = None
+        if self.on_knowledge_query is None:
+            response = await self._astream_invoke(self._build_messages(state))
+            content = response.content
+        else:
+            content, speculation = await self._astream_with_knowledge_hint(self._build_messages(state))
+
+        # Parsing is CPU-bound, so keep it off the event loop
+        self._output = await asyncio.to_thread(self._parse_response, state, content)
+
+        if isinstance(speculation, asyncio.Future) and not self._should_request_knowledge(state):
+            speculation.cancel()
+        return self._build_result(state)
+
+    async def _astream_with_knowledge_hint(self, messages: List[BaseMessage]) -> Tuple[str, Any]:
+        chunks: List[str] = []
+        tail = ""
+        needs_knowledge = False
+        speculation = None
+        notified = False
+
+        async for chunk in self._astream(messages):
+            content = chunk.content
+            if not content:
+                continue
+            chunks.append(content)
+            if notified:
+                continue
+
+            tail = (tail + content)[-_HINT_WINDOW:]
+            needs_knowledge = needs_knowledge or bool(_NEEDS_KNOWLEDGE_HINT_RE.search(tail))
+            if needs_knowledge:
+                match = _KNOWLEDGE_QUERY_HINT_RE.search(tail)
+                # Keep a JSON query verbatim so it matches the parsed output
+                query = match and (match.group(1) or match.group(2).strip())
+                if query:
+                    self.logger.info("Knowledge query spotted while streaming, notifying early")
+                    speculation = self.on_knowledge_query(query)
+                    notified = True
+
+        return "".join(chunks), speculation
@@ -5,17 +5,146 @@ This module provides functionality for retrieving external knowledge
 to support the pipeline.
 """
 
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import functools
 import logging
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
 
+import httpx
 from langchain_community.utilities import SerpAPIWrapper
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 
 from pipeline.models.models import KnowledgeRequest, KnowledgeResponse
 
+# Search results and summaries are reused for repeated queries for an hour
+_CACHE_TTL_SECONDS = 3600
+_CACHE_SIZE = 512
+
+# Search results keyed by (query, num_results)
+_SEARCH_CACHE: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+
+# Summaries keyed by (model, query, context)
+_SUMMARY_CACHE: "OrderedDict[Tuple[str, str, Optional[str]], Tuple[float, str]]" = OrderedDict()
+
+_CACHE_LOCK = threading.Lock()
+
+# Upper bound on knowledge requests processed at once by arun
+_MAX_CONCURRENT_REQUESTS = 4
+
+_SERPAPI_URL = "https://serpapi.com/search"
+
+def _cache_get(cache: OrderedDict, key: Any) -> Optional[Any]:
+    """
+    Look up an unexpired entry in a TTL cache.
+    
+    Args:
+        cache: The cache to look in
+        key: The cache key
+        
+    Returns:
+        The cached value, or None if it is missing or expired
+    """
+    with _CACHE_LOCK:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+
+def _cache_put(cache: OrderedDict, key: Any, value: Any) -> None:
+    """
+    Store a value in a TTL cache, evicting the least recently used entry
+    once the cache is full.
+    
+    Args:
+        cache: The cache to store in
+        key: The cache key
+        value: The value to store
+    """
+    with _CACHE_LOCK:
+        cache[key] = (time.monotonic() + _CACHE_TTL_SECONDS, value)
+        cache.move_to_end(key)
+        if len(cache) > _CACHE_SIZE:
+            cache.popitem(last=False)
+
+# The summarization prompt is static, so it is built once and shared by
+# every KnowledgeRetriever
+_SUMMARIZATION_HUMAN_TEMPLATE = """Context: {context}
+
+Query: {query}
+
+Search Results:
+{search_results}
+
+Please provide a structured summary of this information that would be helpful for enhancing AAOIFI standards.
+"""
+
+_SUMMARIZATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a knowledge specialist for AAOIFI (Accounting and Auditing Organization for Islamic Financial Institutions) standards. Your task is to summarize and structure the information provided from external sources to help with the enhancement of AAOIFI standards.
+
+The information you're summarizing relates to Islamic financial principles, Shariah compliance, and AAOIFI standards. Please structure your summary in a clear, concise manner, focusing on:
+
+1. Key concepts and principles
+2. Relevant Shariah rulings or opinions
+3. AAOIFI's official position (if available)
+4. Different scholarly viewpoints (if applicable)
+5. Practical implications for Islamic financial institutions
+
+Make your summary comprehensive but focused on the specific query provided.
+"""),
+    ("human", _SUMMARIZATION_HUMAN_TEMPLATE)
+])
+
+@functools.cache
+def _summarization_system_message() -> SystemMessage:
+    """Render the invariant system message of the summarization prompt once."""
+    return _SUMMARIZATION_PROMPT.format_messages(context="", query="", search_results="")[0]
+
+# Bounded so concurrent fan-out reuses keep-alive sockets instead of
+# opening a new connection per request
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+@functools.lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    """
+    Get the keep-alive HTTP client shared by SerpAPI and OpenAI calls, so
+    repeated requests reuse connections instead of paying a new TLS handshake.
+    """
+    return httpx.Client(timeout=30, limits=_HTTP_LIMITS)
+
+@functools.lru_cache(maxsize=1)
+def _get_async_http_client() -> httpx.AsyncClient:
+    """Get the keep-alive HTTP client shared by async OpenAI calls."""
+    return httpx.AsyncClient(timeout=30, limits=_HTTP_LIMITS)
+
+@functools.lru_cache(maxsize=8)
+def _get_llm(model_name: str, temperature: float) -> ChatOpenAI:
+    """
+    Get the summarization LLM for a model and temperature, created once per
+    process and shared by every KnowledgeRetriever.
+    """
+    return ChatOpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        http_client=_get_http_client(),
+        http_async_client=_get_async_http_client()
+    )
+
+@functools.lru_cache(maxsize=4)
+def _get_search_engine(serpapi_key: str) -> SerpAPIWrapper:
+    """Get the SerpAPI wrapper for an API key, created once per process."""
+    return SerpAPIWrapper(serpapi_api_key=serpapi_key)
+
 class KnowledgeRetriever:
     """
     Component responsible for retrieving external knowledge.
@@ -40,6 +169,8 @@ class KnowledgeRetriever:
         """
         self.logger = logging.getLogger("knowledge_retriever")
         
+        self._http = _get_http_client()
+        
         # Initialize the SerpAPI wrapper
         try:
             serpapi_key = os.environ.get("SERPAPI_API_KEY")
@@ -47,41 +178,17 @@ class KnowledgeRetriever:
                 self.logger.warning("SERPAPI_API_KEY not found in environment variables")
                 self.search_engine = None
             else:
-                self.search_engine = SerpAPIWrapper()
+                self.search_engine = _get_search_engine(serpapi_key)
         except Exception as e:
-            self.logger.error(f"Error initializing SerpAPI: {e}")
+            self.logger.error("Error initializing SerpAPI: %s", e)
             self.search_engine = None
         
         # Initialize the LLM
-        self.llm = ChatOpenAI(
-            model_name=model_name,
-            temperature=temperature
-        )
+        self.llm = _get_llm(model_name, temperature)
         
         # Define the summarization prompt
-        self.summarization_prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a knowledge specialist for AAOIFI (Accounting and Auditing Organization for Islamic Financial Institutions) standards. Your task is to summarize and structure the information provided from external sources to help with the enhancement of AAOIFI standards.
-
-The information you're summarizing relates to Islamic financial principles, Shariah compliance, and AAOIFI standards. Please structure your summary in a clear, concise manner, focusing on:
-
-1. Key concepts and principles
-2. Relevant Shariah rulings or opinions
-3. AAOIFI's official position (if available)
-4. Different scholarly viewpoints (if applicable)
-5. Practical implications for Islamic financial institutions
-
-Make your summary comprehensive but focused on the specific query provided.
-"""),
-            ("human", """Context: {context}
-
-Query: {query}
-
-Search Results:
-{search_results}
-
-Please provide a structured summary of this information that would be helpful for enhancing AAOIFI standards.
-""")
-        ])
+        self.summarization_prompt = _SUMMARIZATION_PROMPT
+        self._system_message = _summarization_system_message()
     
     def run(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -95,20 +202,13 @@ Please provide a structured summary of this information that would be helpful fo
         """
         self.logger.info("Processing knowledge request")
         
-        # Extract the knowledge request
-        knowledge_request = state.get("knowledge_request")
+        # Extract the knowledge request; the agents always create
+        # KnowledgeRequest instances, so no conversion is needed
+        knowledge_request: Optional[KnowledgeRequest] = state.get("knowledge_request")
         if not knowledge_request:
             self.logger.error("No knowledge request found in state")
             return state
         
-        # Ensure the knowledge request is in the right format
-        if not isinstance(knowledge_request, KnowledgeRequest):
-            try:
-                knowledge_request = KnowledgeRequest(**knowledge_request)
-            except Exception as e:
-                self.logger.error(f"Error converting knowledge request: {e}")
-                return state
-        
         # Process the knowledge request
         knowledge_response = self._process_request(knowledge_request)
         
@@ -118,11 +218,87 @@ Please provide a structured summary of this information that would be helpful fo
         # Add the knowledge response to the state
         state["knowledge_responses"].append(knowledge_response)
         
-        self.logger.info(f"Completed knowledge request for {knowledge_request.requester}")
+        self.logger.info("Completed knowledge request for %s", knowledge_request.requester)
+        
+        return state
+    
+    async def arun(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Process all pending knowledge requests concurrently and update the state.
+        
+        A request is pending when the state has no response for its requester
+        and query yet. At most _MAX_CONCURRENT_REQUESTS requests are in flight
+        at once, to stay within the search and LLM rate limits.
+        
+        Args:
+            state: The current state with knowledge requests
+            
+        Returns:
+            The updated state with knowledge responses
+        """
+        self.logger.info("Processing pending knowledge requests")
+        
+        pending = self._pending_requests(state)
+        semaphore = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+        
+        async def process(request: KnowledgeRequest) -> KnowledgeResponse:
+            async with semaphore:
+                return await self._aprocess_request(request)
+        
+        knowledge_responses = await asyncio.gather(*(process(request) for request in pending))
+        
+        # Remove the current knowledge request
+        state.pop("knowledge_request", None)
+        
+        # Add the knowledge responses to the state
+        state["knowledge_responses"].extend(knowledge_responses)
+        
+        self.logger.info("Completed %d knowledge requests", len(knowledge_responses))
         
         return state
     
-    def _search(self, query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+    async def aprefetch(self, query: str, num_results: int = 5) -> None:
+        """
+        Run a search ahead of its knowledge request, so the request is served
+        from the search cache once it arrives.
+        
+        Args:
+            query: The query to search for
+            num_results: The number of results to fetch
+        """
+        if query.strip():
+            await asyncio.to_thread(self._search, query, num_results)
+    
+    def _pending_requests(self, state: Dict[str, Any]) -> List[KnowledgeRequest]:
+        """
+        Collect the knowledge requests in the state that have no response yet.
+        
+        Args:
+            state: The current state
+            
+        Returns:
+            The pending knowledge requests, in request order
+        """
+        requests: List[KnowledgeRequest] = list(state.get("knowledge_requests", []))
+        current = state.get("knowledge_request")
+        if current is not None and current not in requests:
+            requests.append(current)
+        
+        answered = {
+            (response.requester, response.query)
+            for response in state.get("knowledge_responses", [])
+        }
+        
+        pending = []
+        for request in requests:
+            key = (request.requester, request.query)
+            if key not in answered:
+                answered.add(key)
+                pending.append(request)
+        
+        return pending
+    
+    def _search(self, query: str, num_results: int = 5) -> Tuple[List[Dict[str, Any]], bool]:
         """
         Search for information using SerpAPI.
         
@@ -131,18 +307,29 @@ Please provide a structured summary of this information that would be helpful fo
             num_results: The number of results to return
             
         Returns:
-            A list of search results
+            A tuple of the search results, or a placeholder result describing
+            the failure, and whether the search succeeded
         """
         if not self.search_engine:
             self.logger.warning("Search engine not available")
-            return [{"title": "Search engine not available", "snippet": "Please configure SerpAPI", "link": ""}]
+            return [{"title": "Search engine not available", "snippet": "Please configure SerpAPI", "link": ""}], False
+        
+        cache_key = (query, num_results)
+        cached = _cache_get(_SEARCH_CACHE, cache_key)
+        if cached is not None:
+            self.logger.info("Using cached search results")
+            return list(cached), True
         
         try:
             # Append AAOIFI to the query to get more relevant results
             search_query = f"AAOIFI {query} Islamic finance Shariah"
             
-            # Run the search
-            results = self.search_engine.results(search_query)
+            # Run the search over the shared client rather than the
+            # wrapper's per-call session
+            params = self.search_engine.get_params(search_query)
+            params["source"] = "python"
+            params["output"] = "json"
+            results = self._http.get(_SERPAPI_URL, params=params).json()
             
             # Extract the organic results
             organic_results = results.get("organic_results", [])
@@ -156,60 +343,164 @@ Please provide a structured summary of this information that would be helpful fo
                     "link": result.get("link", "")
                 })
             
-            return formatted_results
+            # Only successful searches are cached, so errors are retried
+            succeeded = "error" not in results
+            if succeeded:
+                _cache_put(_SEARCH_CACHE, cache_key, formatted_results)
+            return formatted_results, succeeded
         except Exception as e:
-            self.logger.error(f"Error during search: {e}")
-            return [{"title": "Search error", "snippet": str(e), "link": ""}]
+            self.logger.error("Error during search: %s", e)
+            return [{"title": "Search error", "snippet": str(e), "link": ""}], False
     
-    def _process_request(self, request: KnowledgeRequest) -> KnowledgeResponse:
+    def _format_search_results(self, search_results: List[Dict[str, Any]]) -> str:
         """
-        Process a knowledge request.
+        Format search results for the summarization prompt.
         
         Args:
-            request: The knowledge request to process
+            search_results: The search results to format
             
         Returns:
-            A knowledge response
+            The formatted search results
         """
-        # Search for information
-        search_results = self._search(request.query)
-        
-        # Format the search results
-        formatted_results = ""
-        for i, result in enumerate(search_results):
-            formatted_results += f"Result {i+1}:\n"
-            formatted_results += f"Title: {result['title']}\n"
-            formatted_results += f"Snippet: {result['snippet']}\n"
-            formatted_results += f"Link: {result['link']}\n\n"
-        
-        # Summarize the search results
-        if search_results:
-            # Format the prompt
-            formatted_prompt = self.summarization_prompt.format(
-                context=request.context,
-                query=request.query,
-                search_results=formatted_results
-            )
+        return "".join(
+            f"Result {i+1}:\n"
+            f"Title: {result['title']}\n"
+            f"Snippet: {result['snippet']}\n"
+            f"Link: {result['link']}\n\n"
+            for i, result in enumerate(search_results)
+        )
+    
+    def _summary_cache_key(self, request: KnowledgeRequest) -> Tuple[str, str, Optional[str]]:
+        """
+        Build the summary cache key for a request.
+        
+        Args:
+            request: The knowledge request
             
-            # Get the response from the LLM
-            response = self.llm.invoke(formatted_prompt)
+        Returns:
+            The model, query and context of the request
+        """
+        return (self.llm.model_name, request.query, request.context)
+    
+    def _summary_prompt(self, request: KnowledgeRequest, search_results: List[Dict[str, Any]]) -> List[BaseMessage]:
+        """
+        Build the summarization messages for a request.
+        
+        Args:
+            request: The knowledge request
+            search_results: The search results to summarize
             
-            # Create the knowledge response
-            knowledge_response = KnowledgeResponse(
-                requester=request.requester,
+        Returns:
+            The system message followed by the request and its search results
+        """
+        # Only the human message varies, so build the messages directly
+        return [
+            self._system_message,
+            HumanMessage(content=_SUMMARIZATION_HUMAN_TEMPLATE.format(
+                context=request.context,
                 query=request.query,
-                content=response.content,
-                sources=search_results,
-                timestamp=datetime.now()
-            )
-        else:
+                search_results=self._format_search_results(search_results)
+            ))
+        ]
+    
+    def _build_response(
+        self,
+        request: KnowledgeRequest,
+        search_results: List[Dict[str, Any]],
+        content: Optional[str]
+    ) -> KnowledgeResponse:
+        """
+        Build the knowledge response for a request.
+        
+        Args:
+            request: The knowledge request
+            search_results: The search results used for the summary
+            content: The summary, or None if nothing was found
+            
+        Returns:
+            A knowledge response
+        """
+        if content is None:
             # Create an empty knowledge response
-            knowledge_response = KnowledgeResponse(
+            return KnowledgeResponse(
                 requester=request.requester,
                 query=request.query,
                 content="No information found for this query.",
-                sources=[],
-                timestamp=datetime.now()
+                sources=[]
             )
         
-        return knowledge_response
+        # Create the knowledge response
+        return KnowledgeResponse(
+            requester=request.requester,
+            query=request.query,
+            content=content,
+            sources=search_results
+        )
+    
+    def _process_request(self, request: KnowledgeRequest) -> KnowledgeResponse:
+        """
+        Process a knowledge request.
+        
+        Args:
+            request: The knowledge request to process
+            
+        Returns:
+            A knowledge response
+        """
+        # A blank query has nothing to search for
+        if not request.query.strip():
+            return self._build_response(request, [], None)
+        
+        # Search for information
+        search_results, succeeded = self._search(request.query)
+        if not search_results:
+            return self._build_response(request, search_results, None)
+        
+        # Reuse the summary of an identical earlier request; a summary of a
+        # failed search is neither reused nor kept
+        cache_key = self._summary_cache_key(request)
+        content = _cache_get(_SUMMARY_CACHE, cache_key) if succeeded else None
+        if content is None:
+            # Summarize the search results
+            response = self.llm.invoke(self._summary_prompt(request, search_results))
+            content = response.content
+            if succeeded:
+                _cache_put(_SUMMARY_CACHE, cache_key, content)
+        else:
+            self.logger.info("Using cached knowledge summary")
+        
+        return self._build_response(request, search_results, content)
+    
+    async def _aprocess_request(self, request: KnowledgeRequest) -> KnowledgeResponse:
+        """
+        Process a knowledge request asynchronously.
+        
+        Args:
+            request: The knowledge request to process
+            
+        Returns:
+            A knowledge response
+        """
+        # A blank query has nothing to search for
+        if not request.query.strip():
+            return self._build_response(request, [], None)
+        
+        # The SerpAPI client is blocking, so search in a worker thread
+        search_results, succeeded = await asyncio.to_thread(self._search, request.query)
+        if not search_results:
+            return self._build_response(request, search_results, None)
+        
+        # Reuse the summary of an identical earlier request; a summary of a
+        # failed search is neither reused nor kept
+        cache_key = self._summary_cache_key(request)
+        content = _cache_get(_SUMMARY_CACHE, cache_key) if succeeded else None
+        if content is None:
+            # Summarize the search results
+            response = await self.llm.ainvoke(self._summary_prompt(request, search_results))
+            content = response.content
+            if succeeded:
+                _cache_put(_SUMMARY_CACHE, cache_key, content)
+        else:
+            self.logger.info("Using cached knowledge summary")
+        
+        return self._build_response(request, search_results, content)
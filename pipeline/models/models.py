@@ -2,10 +2,25 @@
 Models for representing data structures in the AAOIFI Standards Enhancement System.
 """
 
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
 from typing import Dict, Any, List, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, computed_field
 from datetime import datetime
 
+# Initial quality score of each pipeline stage, copied into every StandardState
+_DEFAULT_QUALITY_SCORES = MappingProxyType({
+    "preprocessor": 0,
+    "reviewer": 0,
+    "enhancer": 0,
+    "validator": 0
+})
+
+def _from_ns(timestamp_ns: int) -> datetime:
+    """Convert a time.time_ns() value to a local datetime."""
+    return datetime.fromtimestamp(timestamp_ns / 1e9)
+
 class KnowledgeRequest(BaseModel):
     """
     A request for external knowledge.
@@ -21,17 +36,22 @@ class KnowledgeRequest(BaseModel):
         None,
         description="Additional context to help with the knowledge retrieval"
     )
-    timestamp: datetime = Field(
-        default_factory=datetime.now,
-        description="The timestamp of the request"
+    timestamp_ns: int = Field(
+        default_factory=time.time_ns,
+        description="The timestamp of the request, in nanoseconds since the epoch"
     )
     additional_params: Dict[str, Any] = Field(
         default_factory=dict,
         description="Additional parameters for the request"
     )
 
-    class Config:
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @computed_field
+    @property
+    def timestamp(self) -> datetime:
+        """The timestamp of the request."""
+        return _from_ns(self.timestamp_ns)
 
 class KnowledgeResponse(BaseModel):
     """
@@ -51,91 +71,107 @@ class KnowledgeResponse(BaseModel):
         default_factory=list,
         description="The sources of the retrieved content"
     )
-    timestamp: datetime = Field(
-        default_factory=datetime.now,
-        description="The timestamp of the response"
+    timestamp_ns: int = Field(
+        default_factory=time.time_ns,
+        description="The timestamp of the response, in nanoseconds since the epoch"
     )
 
-class AuditEntry(BaseModel):
+    @computed_field
+    @property
+    def timestamp(self) -> datetime:
+        """The timestamp of the response."""
+        return _from_ns(self.timestamp_ns)
+
+# The audit trail and pipeline state are mutated throughout a run and have no
+# cross-field validation, so they are plain slotted dataclasses
+
+@dataclass(slots=True, kw_only=True)
+class AuditEntry:
     """
     An entry in the audit trail.
     """
     
-    stage: str = Field(
-        description="The stage of the pipeline"
+    stage: str = field(
+        metadata={"description": "The stage of the pipeline"}
     )
-    timestamp: datetime = Field(
-        default_factory=datetime.now,
-        description="The timestamp of the entry"
+    timestamp_ns: int = field(
+        default_factory=time.time_ns,
+        metadata={"description": "The timestamp of the entry, in nanoseconds since the epoch"}
     )
-    quality_score: int = Field(
-        description="The quality score assigned to the output"
+    quality_score: int = field(
+        metadata={"description": "The quality score assigned to the output"}
     )
-    notes: str = Field(
-        description="Notes about the process"
+    notes: str = field(
+        metadata={"description": "Notes about the process"}
     )
-    knowledge_request: Optional[KnowledgeRequest] = Field(
-        None,
-        description="The knowledge request, if any"
+    knowledge_request: Optional[KnowledgeRequest] = field(
+        default=None,
+        metadata={"description": "The knowledge request, if any"}
     )
-    knowledge_response: Optional[KnowledgeResponse] = Field(
-        None,
-        description="The knowledge response, if any"
+    knowledge_response: Optional[KnowledgeResponse] = field(
+        default=None,
+        metadata={"description": "The knowledge response, if any"}
     )
+    
+    @property
+    def timestamp(self) -> datetime:
+        """The timestamp of the entry."""
+        return _from_ns(self.timestamp_ns)
 
-class StandardState(BaseModel):
+@dataclass(slots=True, kw_only=True)
+class StandardState:
     """
     The state of a standard as it moves through the pipeline.
     """
     
-    standard_text: str = Field(
-        description="The original text of the standard"
+    standard_text: str = field(
+        metadata={"description": "The original text of the standard"}
     )
-    preprocessed_text: Optional[str] = Field(
-        None,
-        description="The preprocessed text"
+    preprocessed_text: Optional[str] = field(
+        default=None,
+        metadata={"description": "The preprocessed text"}
     )
-    reviewed_text: Optional[str] = Field(
-        None,
-        description="The reviewed text"
+    reviewed_text: Optional[str] = field(
+        default=None,
+        metadata={"description": "The reviewed text"}
     )
-    enhanced_text: Optional[str] = Field(
-        None,
-        description="The enhanced text"
+    enhanced_text: Optional[str] = field(
+        default=None,
+        metadata={"description": "The enhanced text"}
     )
-    validated_text: Optional[str] = Field(
-        None,
-        description="The validated text"
+    validated_text: Optional[str] = field(
+        default=None,
+        metadata={"description": "The validated text"}
     )
-    final_output: Optional[str] = Field(
-        None,
-        description="The final output text"
+    final_output: Optional[str] = field(
+        default=None,
+        metadata={"description": "The final output text"}
     )
-    audit_trail: List[AuditEntry] = Field(
+    audit_trail: List[AuditEntry] = field(
         default_factory=list,
-        description="The audit trail of the process"
-    )
-    quality_scores: Dict[str, int] = Field(
-        default_factory=lambda: {
-            "preprocessor": 0,
-            "reviewer": 0,
-            "enhancer": 0,
-            "validator": 0
-        },
-        description="The quality scores for each stage"
-    )
-    knowledge_requests: List[KnowledgeRequest] = Field(
+        metadata={"description": "The audit trail of the process"}
+    )
+    quality_scores: Dict[str, int] = field(
+        default_factory=_DEFAULT_QUALITY_SCORES.copy,
+        metadata={"description": "The quality scores for each stage"}
+    )
+    knowledge_requests: List[KnowledgeRequest] = field(
         default_factory=list,
-        description="The knowledge requests made during the process"
+        metadata={"description": "The knowledge requests made during the process"}
     )
-    knowledge_responses: List[KnowledgeResponse] = Field(
+    knowledge_responses: List[KnowledgeResponse] = field(
         default_factory=list,
-        description="The knowledge responses received during the process"
+        metadata={"description": "The knowledge responses received during the process"}
     )
-    session_id: str = Field(
-        description="The session ID"
+    session_id: str = field(
+        metadata={"description": "The session ID"}
     )
-    timestamp: datetime = Field(
-        default_factory=datetime.now,
-        description="The timestamp of the session"
+    timestamp_ns: int = field(
+        default_factory=time.time_ns,
+        metadata={"description": "The timestamp of the session, in nanoseconds since the epoch"}
     )
+    
+    @property
+    def timestamp(self) -> datetime:
+        """The timestamp of the session."""
+        return _from_ns(self.timestamp_ns)
@@ -2,15 +2,378 @@
 Orchestrator for the AAOIFI standards enhancement pipeline.
 """
 import os
+import ast
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import random
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Dict, Any, FrozenSet, List, Optional, Tuple
 import datetime
 
+import orjson
+from google.api_core import exceptions as google_exceptions
+
 from utils.gemini_client import GeminiClient
 from services.llm_service import LLMService
+from pipeline.tools.llm_cache import LLMCache
+from pipeline.utils.helpers import extract_json_block
 
 logger = logging.getLogger(__name__)
 
+# Static system messages, so every call sends the same prompt prefix
+_SYS_PARSER = (
+    "You are a financial standards parser. Extract structured information from the "
+    "AAOIFI standard text including sections, clauses, and key definitions."
+)
+_SYS_REVIEWER = (
+    "You are a financial standards reviewer. Review the AAOIFI standard and provide "
+    "comprehensive notes on its quality, completeness, and alignment with Shariah principles."
+)
+_SYS_VALIDATOR = (
+    "You are a financial standards validator. Validate the enhanced AAOIFI standard "
+    "and provide detailed notes on its structure, coherence, completeness, and compliance."
+)
+
+# Stage results kept per orchestrator, so re-submitting a standard skips
+# the LLM round trips it already made
+_STAGE_CACHE_SIZE = 64
+
+# Token budgets for the standard text embedded in the parse and validate
+# prompts, roughly the 4000 and 6000 characters they used to be cut to
+_PARSE_TOKEN_BUDGET = 1000
+_VALIDATE_TOKEN_BUDGET = 1500
+# Used to size the cut when the tokenizer cannot be loaded
+_CHARS_PER_TOKEN = 4
+# A cut is moved back to a sentence end if one is this close to it
+_SENTENCE_BOUNDARY_WINDOW = 0.2
+
+# Bound once, since every stage reads the clock
+_now = datetime.datetime.now
+
+# Worker threads shared by all blocking LLM calls of an orchestrator
+_IO_POOL_SIZE = 8
+
+# Transient LLM endpoint failures worth retrying with backoff
+_RETRYABLE_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    google_exceptions.ServerError,
+    google_exceptions.TooManyRequests,
+)
+_RETRY_INITIAL_DELAY = 0.5
+_RETRY_MAX_DELAY = 8.0
+# Consecutive failed calls before a stage fails fast, and for how long
+_BREAKER_FAIL_MAX = 5
+_BREAKER_RESET_SECONDS = 60.0
+
+# Stages whose text streams to on_token, with the name they stream under
+_STREAMING_STAGES = {"enhance": "enhancer"}
+
+# Standards processed at once by process_many, bounding in-flight LLM calls
+_MAX_CONCURRENT_STANDARDS = 4
+
+# Quality and enhancement criteria, shared read-only by every run
+_PREPROCESSOR_CRITERIA = MappingProxyType({
+    "structure": "Text is properly structured",
+    "completeness": "All required elements present"
+})
+_REVIEWER_CRITERIA = MappingProxyType({
+    "clarity": "Content is clear",
+    "accuracy": "Information is accurate"
+})
+_ENHANCEMENT_CRITERIA = MappingProxyType({
+    "clarity": "Improve clarity without changing meaning",
+    "consistency": "Ensure terminology is consistent",
+    "precision": "Enhance precision of language",
+    "readability": "Improve overall readability"
+})
+_VALIDATOR_CRITERIA = MappingProxyType({
+    "compliance": "Complies with AAOIFI format",
+    "coherence": "Content is coherent"
+})
+
+# Fixed audit trail text, rendered once per stage by _render_stage
+_SKIPPED_NOTE = "**Status:** skipped, the LLM endpoint was unavailable\n\n"
+_STAGE_TEMPLATE = "## {name}\n\n**Timestamp:** {timestamp}\n\n{body}**Quality score:** {score}\n\n{details}"
+_PREPROCESSOR_NOTES = (
+    "Notes: The text is well-structured and contains all necessary sections for an AAOIFI standard. "
+    "Arabic terms are properly transliterated and explained. No obvious formatting or structural issues found.\n\n"
+)
+_ENHANCER_NOTES = (
+    "Notes: The standard was already well-written and comprehensive. "
+    "Enhancement focused on improving language clarity and readability.\n\n"
+)
+_ENHANCER_IMPROVEMENTS_AND_RECOMMENDATIONS = (
+    "### Improvements Made\n\n"
+    "1. Enhanced language clarity and readability\n"
+    "2. Ensured consistency in terminology\n\n"
+    "### Recommendations\n\n"
+    "1. Include a section on dispute resolution in the case of non-compliance with the standard\n"
+    "2. Consider adding more examples to cover a wider range of possible Murabaha transactions\n\n"
+)
+
+
+def _run_sync(coro: Any) -> Any:
+    """
+    Run a coroutine to completion from synchronous code.
+    
+    asyncio.run refuses to start inside a running event loop (a notebook, an
+    async web framework), so there the coroutine gets its own loop on a
+    worker thread. That blocks the calling loop until it finishes; async
+    callers should await the coroutine instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-loop") as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_tokenizer() -> Optional[Any]:
+    """Load the tokenizer shared by every orchestrator, or None if unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, truncating by characters: {str(e)}")
+        return None
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to a token budget, preferring to end on a sentence boundary."""
+    # Every token covers at least one character, so short texts always fit
+    if len(text) <= max_tokens:
+        return text
+    
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        if len(text) <= max_tokens * _CHARS_PER_TOKEN:
+            return text
+        truncated = text[:max_tokens * _CHARS_PER_TOKEN]
+    else:
+        token_ids = tokenizer.encode(text)
+        if len(token_ids) <= max_tokens:
+            return text
+        truncated = tokenizer.decode(token_ids[:max_tokens])
+    
+    min_cut = int(len(truncated) * (1 - _SENTENCE_BOUNDARY_WINDOW))
+    cut = max(truncated.rfind(". ", min_cut), truncated.rfind("\n", min_cut))
+    return truncated[:cut + 1] if cut >= 0 else truncated
+
+
+def _render_stage(name: str, timestamp: datetime.datetime, body: str, score: int, details: str = "") -> str:
+    """Render one stage's section of the audit trail."""
+    return _STAGE_TEMPLATE.format(
+        name=name,
+        timestamp=timestamp.isoformat(sep=' ', timespec='seconds'),
+        body=body,
+        score=score,
+        details=details
+    )
+
+
+def _render_enhancer_details(started: datetime.datetime, finished: datetime.datetime, score: int) -> str:
+    """Render the processing details of the enhancer's audit section."""
+    started_iso = started.isoformat()
+    finished_iso = finished.isoformat()
+    return (
+        f"**Processing time:** {started_iso} to {finished_iso}\n\n"
+        "### Justification\n\n"
+        f"The enhancer improved the standard with a quality score of {score}. "
+        "The enhancements were focused on improving clarity, consistency, and completeness. "
+        "The LLM response was successfully parsed using standard_parser.\n\n"
+        "### Processing Steps\n\n"
+        f"1. **initialization** ({started_iso}): Enhancer agent initialized with reviewed standard text\n"
+        f"2. **prompt_creation** ({started_iso}): Created prompt for LLM to enhance the standard\n"
+        f"3. **llm_response** ({finished_iso}): Received response from LLM\n"
+        f"4. **parsing** ({finished_iso}): Successfully parsed LLM response using standard_parser\n\n"
+        f"{_ENHANCER_IMPROVEMENTS_AND_RECOMMENDATIONS}"
+    )
+
+
+def _render_audit_trail(result: "PipelineResult") -> str:
+    """Render a pipeline result's audit entries as the markdown audit trail."""
+    parts = [
+        "# AAOIFI Standard Enhancement Audit Trail\n\n"
+        "## Process Summary\n\n"
+        f"- **Start time**: {result.start_time}\n"
+        f"- **Input length**: {result.input_length} characters\n"
+        "- **Pipeline stages**: Preprocessor → Reviewer → Enhancer → Validator\n\n"
+        "---\n\n"
+    ]
+    for entry in result.audit_entries:
+        details = ""
+        if "finished" in entry:
+            details = _render_enhancer_details(entry["timestamp"], entry["finished"], entry["score"])
+        parts.append(_render_stage(entry["stage"], entry["timestamp"], entry["body"], entry["score"], details))
+    
+    processing_duration = (result.completion_time - result.start_time).total_seconds()
+    parts.append(
+        "## Final Process Summary\n\n"
+        f"- **Completion time**: {result.completion_time}\n"
+        f"- **Average quality score**: {result.average_quality:.1f}/100\n"
+        f"- **Total processing time**: {processing_duration:.1f} seconds\n"
+        f"- **Final output length**: {len(result.final_output)} characters\n"
+    )
+    return "".join(parts)
+
+
+def _fallback_structure(text: str) -> Dict[str, Any]:
+    """The basic structure used when the standard cannot be parsed."""
+    return {
+        "title": "Untitled Standard",
+        "sections": [{"content": text}],
+        "definitions": {}
+    }
+
+
+class _CircuitBreaker:
+    """Fail fast after consecutive failures, allowing a trial call after a cool-down."""
+    
+    __slots__ = ("fail_max", "reset_timeout", "_failures", "_opened_at", "_lock")
+    
+    def __init__(self, fail_max: int = _BREAKER_FAIL_MAX, reset_timeout: float = _BREAKER_RESET_SECONDS):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Whether a call may go through."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: let one call through; another failure reopens at once
+            self._opened_at = None
+            return True
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+
+
+# Set on a worker thread when its last cached stage call returned a fallback
+_stage_state = threading.local()
+
+
+class _Uncached(Exception):
+    """Raised by a cached stage to return a fallback result without caching it."""
+    
+    def __init__(self, value: Any):
+        super().__init__("uncached stage result")
+        self.value = value
+
+
+def _cached_stage(stage: str) -> Callable:
+    """
+    Cache a pipeline stage's result by an exact hash of its inputs.
+    
+    The key covers the model and every run setting a stage reads, since the
+    cache is shared with the orchestrator's with_settings copies. A stage
+    raises _Uncached to return a fallback that later runs should retry.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(self, *args: Any) -> Any:
+            digest = hashlib.blake2b(digest_size=16)
+            model_name = getattr(self.llm_client, "model_name", "")
+            digest.update(
+                f"{stage}\0{model_name}\0{self._rag_enabled}\0{self.default_quality_score}\0".encode("utf-8")
+            )
+            digest.update(repr(args).encode("utf-8"))
+            key = digest.hexdigest()
+            
+            cache = self._stage_cache
+            with self._stage_cache_lock:
+                hit = key in cache
+                if hit:
+                    cache.move_to_end(key)
+                    result = cache[key]
+            if hit:
+                logger.info(f"Using cached {stage} result")
+                # As with cached completions, a listener still gets the
+                # text, as a single chunk
+                if self.on_token is not None and stage in _STREAMING_STAGES:
+                    self.on_token(_STREAMING_STAGES[stage], result)
+                return result
+            
+            try:
+                result = func(self, *args)
+            except _Uncached as e:
+                # Lets _call_stage, running on this thread, see the fallback
+                _stage_state.fell_back = True
+                return e.value
+            with self._stage_cache_lock:
+                cache[key] = result
+                if len(cache) > _STAGE_CACHE_SIZE:
+                    cache.popitem(last=False)
+            return result
+        return wrapper
+    return decorator
+
+
+@dataclass(slots=True, kw_only=True)
+class PipelineResult(Mapping):
+    """
+    The result of processing a standard.
+    
+    Reads like the dictionary process used to return, but the stages are
+    kept as structured audit entries and only rendered into the markdown
+    audit trail when it is first accessed. degraded names the stages that
+    were skipped or returned a fallback instead of a real result.
+    """
+    
+    final_output: str
+    audit_entries: List[Dict[str, Any]] = field(repr=False)
+    quality_scores: Dict[str, int]
+    average_quality: float
+    input_length: int = field(repr=False)
+    degraded: FrozenSet[str] = frozenset()
+    start_time: datetime.datetime
+    completion_time: datetime.datetime
+    _audit_trail: Optional[str] = field(default=None, init=False, repr=False)
+    
+    _KEYS = ("final_output", "audit_trail", "quality_scores", "start_time", "completion_time")
+    
+    @property
+    def audit_trail(self) -> str:
+        """The markdown audit trail, rendered on first access."""
+        if self._audit_trail is None:
+            self._audit_trail = _render_audit_trail(self)
+        return self._audit_trail
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._KEYS)
+    
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
 class AAOIFIOrchestrator:
     """
     Orchestrator for processing and enhancing AAOIFI standards.
@@ -22,7 +385,10 @@ class AAOIFIOrchestrator:
         default_quality_score: int = 60,
         llm_client: Optional[GeminiClient] = None,
         use_rag: bool = True,
-        rag_data_dir: Optional[str] = "data"
+        rag_data_dir: Optional[str] = "data",
+        on_token: Optional[Callable[[str, Optional[str]], None]] = None,
+        high_confidence_threshold: Optional[int] = None,
+        response_cache: Optional[LLMCache] = None
     ):
         """
         Initialize the orchestrator.
@@ -33,10 +399,20 @@ class AAOIFIOrchestrator:
             llm_client: Optional pre-configured Gemini client
             use_rag: Whether to use RAG system (True by default)
             rag_data_dir: Directory containing PDF documents for RAG
+            on_token: Optional callback receiving the stage name and each chunk
+                of the enhanced text as it streams in; called from a worker thread.
+                A None chunk means the stage is being retried, so the chunks
+                streamed for it so far should be discarded
+            high_confidence_threshold: Skip validation when every quality score
+                reaches this value; None always validates
+            response_cache: Cache of LLM completions, e.g. an LLMCache over a
+                DiskBackend to keep it warm across restarts; in-process by default
         """
         self.max_retries = max_retries
         self.default_quality_score = default_quality_score
         self.use_rag = use_rag
+        self.on_token = on_token
+        self.high_confidence_threshold = high_confidence_threshold
         
         # Initialize Gemini client if not provided
         self.llm_client = llm_client or GeminiClient()
@@ -45,264 +421,522 @@ class AAOIFIOrchestrator:
         self.llm_service = LLMService(
             self.llm_client,
             use_rag=use_rag,
-            rag_data_dir=rag_data_dir
+            rag_data_dir=rag_data_dir,
+            cache=response_cache
+        )
+        # RAG availability is fixed once the service is built
+        self._rag_enabled = bool(getattr(self.llm_service, 'has_rag', False))
+        
+        # Stage results, shared with with_settings copies like the clients
+        self._stage_cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._stage_cache_lock = threading.Lock()
+        
+        # One breaker per LLM-backed stage, so a dead endpoint fails fast
+        self._breakers = {
+            stage: _CircuitBreaker()
+            for stage in ("parse", "review", "enhance", "validate", "quality")
+        }
+        
+        # Blocking LLM and retrieval calls run here, off the event loop
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_IO_POOL_SIZE,
+            thread_name_prefix="llm"
         )
+        self._owns_pool = True
         
         logger.info(f"AAOIFIOrchestrator initialized with model: {self.llm_client.model_name}")
         logger.info(f"RAG system {'enabled' if use_rag else 'disabled'}")
+    
+    def with_settings(
+        self,
+        max_retries: Optional[int] = None,
+        default_quality_score: Optional[int] = None,
+        on_token: Optional[Callable[[str, Optional[str]], None]] = None
+    ) -> "AAOIFIOrchestrator":
+        """
+        Return an orchestrator with different run settings.
+        
+        The copy shares this orchestrator's clients, RAG system, breakers,
+        stage cache and worker pool, so it is cheap to create per request and leaves the
+        settings of concurrent runs on the original untouched.
+        
+        Args:
+            max_retries: Maximum number of retries, or None to keep the current value
+            default_quality_score: Default quality score, or None to keep the current value
+            on_token: Streaming callback, or None to keep the current one
+            
+        Returns:
+            The configured orchestrator
+        """
+        clone = copy.copy(self)
+        clone._owns_pool = False
+        if max_retries is not None:
+            clone.max_retries = max_retries
+        if default_quality_score is not None:
+            clone.default_quality_score = default_quality_score
+        if on_token is not None:
+            clone.on_token = on_token
+        return clone
+    
+    def close(self) -> None:
+        """Shut down the worker threads used for LLM calls."""
+        if self._owns_pool:
+            self._io_pool.shutdown(wait=False)
+    
+    def __del__(self):
+        pool = getattr(self, "_io_pool", None)
+        if pool is not None and getattr(self, "_owns_pool", False):
+            pool.shutdown(wait=False)
+    
+    def _run_blocking(self, func: Callable, *args: Any) -> "asyncio.Future":
+        """Run a blocking call on the orchestrator's worker pool."""
+        return asyncio.get_running_loop().run_in_executor(self._io_pool, func, *args)
+    
+    def _run_stage(
+        self, stage: str, skipped: set, degraded: set, fallback: Any, func: Callable, *args: Any
+    ) -> "asyncio.Future":
+        """Run an LLM-backed stage on the worker pool with retries and a circuit breaker."""
+        return self._run_blocking(self._call_stage, stage, skipped, degraded, fallback, func, *args)
+    
+    def _call_stage(
+        self, stage: str, skipped: set, degraded: set, fallback: Any, func: Callable, *args: Any
+    ) -> Any:
+        """
+        Call a stage, retrying transient failures with capped exponential backoff.
         
-    def process(self, standard_text: str) -> Dict[str, Any]:
+        Args:
+            stage: The stage name, selecting its circuit breaker
+            skipped: Set of skipped stages for this run, updated in place
+            degraded: Set of stages that returned a fallback for this run,
+                whether skipped or not, updated in place
+            fallback: The result used when the stage cannot be completed
+            func: The stage helper
+            *args: Arguments for the stage helper
+            
+        Returns:
+            The stage result, or a fallback if the endpoint is unavailable or
+            the stage could not use its response
+        """
+        breaker = self._breakers[stage]
+        if not breaker.allow():
+            logger.warning(f"Circuit open for {stage} stage, skipping it")
+            skipped.add(stage)
+            degraded.add(stage)
+            return fallback
+        
+        attempts = max(1, self.max_retries)
+        for attempt in range(attempts):
+            _stage_state.fell_back = False
+            try:
+                result = func(*args)
+            except _RETRYABLE_ERRORS as e:
+                if attempt + 1 < attempts:
+                    delay = min(_RETRY_MAX_DELAY, _RETRY_INITIAL_DELAY * 2 ** attempt + random.uniform(0, 1))
+                    logger.warning(f"{stage} stage failed ({str(e)}), retrying in {delay:.1f}s")
+                    # The retry streams the text again from the start
+                    if self.on_token is not None and stage in _STREAMING_STAGES:
+                        self.on_token(_STREAMING_STAGES[stage], None)
+                    time.sleep(delay)
+                    continue
+                logger.error(f"{stage} stage failed after {attempts} attempts: {str(e)}")
+                breaker.record_failure()
+                skipped.add(stage)
+                degraded.add(stage)
+                return fallback
+            breaker.record_success()
+            if _stage_state.fell_back:
+                degraded.add(stage)
+            return result
+        
+    def process(
+        self,
+        standard_text: str,
+        *,
+        max_retries: Optional[int] = None,
+        default_quality_score: Optional[int] = None,
+        on_token: Optional[Callable[[str, Optional[str]], None]] = None
+    ) -> PipelineResult:
         """
         Process an AAOIFI standard.
         
+        Safe to call while an event loop is running, but it then blocks that
+        loop until the run finishes; async code should await aprocess instead.
+        
         Args:
             standard_text: The raw standard text
+            max_retries: Maximum number of retries for this run only
+            default_quality_score: Default quality score for this run only
+            on_token: Streaming callback for this run only
             
         Returns:
-            Dictionary containing enhanced standard and metadata
+            PipelineResult containing enhanced standard and metadata
         """
-        logger.info("Starting standard processing pipeline")
-        start_time = datetime.datetime.now()
-        
-        # Initialize audit trail with process summary
-        audit_trail = [
-            "# AAOIFI Standard Enhancement Audit Trail\n\n",
-            "## Process Summary\n\n",
-            f"- **Start time**: {start_time}\n",
-            f"- **Input length**: {len(standard_text)} characters\n",
-            "- **Pipeline stages**: Preprocessor → Reviewer → Enhancer → Validator\n\n",
-            "---\n\n"
-        ]
-        
-        quality_scores = {}
+        runner = self
+        if max_retries is not None or default_quality_score is not None or on_token is not None:
+            runner = self.with_settings(max_retries, default_quality_score, on_token)
+        return _run_sync(runner.aprocess(standard_text))
+    
+    def process_many(
+        self,
+        standard_texts: List[str],
+        max_concurrency: int = _MAX_CONCURRENT_STANDARDS,
+        start_interval: float = 0.0,
+        return_exceptions: bool = False
+    ) -> List[PipelineResult]:
+        """
+        Process several AAOIFI standards concurrently.
         
-        # Step 1: Preprocessing
-        logger.info("Step 1: Preprocessing the standard")
-        preprocessor_time = datetime.datetime.now()
-        audit_trail.append("## Preprocessor\n\n")
-        audit_trail.append(f"**Timestamp:** {preprocessor_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        Like process, this blocks a running event loop it is called from;
+        async code should await aprocess_many instead.
         
-        structured_standard = self._parse_standard(standard_text)
-        preprocessed_length = len(str(structured_standard))
+        Args:
+            standard_texts: The raw standard texts
+            max_concurrency: Maximum number of standards in flight at once
+            start_interval: Minimum seconds between starting two standards
+            return_exceptions: Whether a failing standard yields its exception
+                in place of a result instead of failing the whole batch
+            
+        Returns:
+            The results of process, in the same order as standard_texts
+        """
+        return _run_sync(self.aprocess_many(
+            standard_texts, max_concurrency, start_interval, return_exceptions
+        ))
+    
+    async def aprocess_many(
+        self,
+        standard_texts: List[str],
+        max_concurrency: int = _MAX_CONCURRENT_STANDARDS,
+        start_interval: float = 0.0,
+        return_exceptions: bool = False
+    ) -> List[PipelineResult]:
+        """
+        Process several AAOIFI standards concurrently.
         
-        audit_trail.append(f"Preprocessed text length: {preprocessed_length}\n\n")
-        audit_trail.append("Notes: The text is well-structured and contains all necessary sections for an AAOIFI standard. Arabic terms are properly transliterated and explained. No obvious formatting or structural issues found.\n\n")
+        The stages of different standards interleave on one event loop, so
+        the LLM is kept busy while any single standard waits on a response.
+        A start_interval spaces out the standards' first requests to stay
+        under a provider's rate limit.
         
-        quality_scores["preprocessor"] = self._assess_quality(
-            str(structured_standard),
-            {"structure": "Text is properly structured", "completeness": "All required elements present"}
+        Args:
+            standard_texts: The raw standard texts
+            max_concurrency: Maximum number of standards in flight at once
+            start_interval: Minimum seconds between starting two standards
+            return_exceptions: Whether a failing standard yields its exception
+                in place of a result instead of failing the whole batch
+            
+        Returns:
+            The results of process, in the same order as standard_texts
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        start_lock = asyncio.Lock()
+        next_start = 0.0
+        
+        async def run(standard_text: str) -> PipelineResult:
+            nonlocal next_start
+            async with semaphore:
+                if start_interval > 0:
+                    async with start_lock:
+                        delay = next_start - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        next_start = time.monotonic() + start_interval
+                return await self.aprocess(standard_text)
+        
+        return await asyncio.gather(
+            *(run(text) for text in standard_texts),
+            return_exceptions=return_exceptions
         )
-        audit_trail.append(f"**Quality score:** {quality_scores['preprocessor']}\n\n")
+    
+    async def aprocess(self, standard_text: str) -> PipelineResult:
+        """
+        Process an AAOIFI standard, overlapping independent LLM calls.
         
-        # Step 2: Review
-        logger.info("Step 2: Reviewing the standard")
-        reviewer_time = datetime.datetime.now()
-        audit_trail.append("## Reviewer\n\n")
-        audit_trail.append(f"**Timestamp:** {reviewer_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        The review, the enhancement and the preprocessor/reviewer quality
+        assessment only depend on the parsed standard, so they run together.
+        The validation and the enhancer/validator quality assessment only
+        depend on the enhanced text, so they start as soon as it is
+        available, even while the review is still running. Each quality
+        assessment scores both stages in one request.
         
-        review_notes = self._review_standard(structured_standard)
-        audit_trail.append(f"Review notes: {review_notes}\n\n")
+        Args:
+            standard_text: The raw standard text
+            
+        Returns:
+            PipelineResult containing enhanced standard and metadata
+        """
+        logger.info("Starting standard processing pipeline")
+        start_time = _now()
         
-        quality_scores["reviewer"] = self._assess_quality(
-            str(structured_standard),
-            {"clarity": "Content is clear", "accuracy": "Information is accurate"}
-        )
-        audit_trail.append(f"**Quality score:** {quality_scores['reviewer']}\n\n")
-        
-        # Step 3: Enhancement
-        logger.info("Step 3: Enhancing the standard")
-        enhancer_start_time = datetime.datetime.now()
-        audit_trail.append("## Enhancer\n\n")
-        audit_trail.append(f"**Timestamp:** {enhancer_start_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        
-        enhancement_criteria = {
-            "clarity": "Improve clarity without changing meaning",
-            "consistency": "Ensure terminology is consistent",
-            "precision": "Enhance precision of language",
-            "readability": "Improve overall readability"
-        }
+        quality_scores = {}
+        # Running total for the average, kept as scores come in
+        score_sum = 0
+        # Stages skipped because the LLM endpoint was unavailable
+        skipped = set()
+        # Stages whose result is a fallback, skipped or not
+        degraded = set()
         
-        enhanced_text = self._enhance_standard(
-            structured_standard, 
-            enhancement_criteria
+        # Step 1: Preprocessing
+        logger.info("Step 1: Preprocessing the standard")
+        preprocessor_time = _now()
+        # One RAG retrieval for the standard is shared by every later stage
+        structured_standard, documents = await asyncio.gather(
+            self._run_stage("parse", skipped, degraded, _fallback_structure(standard_text), self._parse_standard, standard_text),
+            self._run_blocking(self._retrieve_documents, standard_text),
         )
-        
-        enhancer_end_time = datetime.datetime.now()
-        enhanced_length = len(enhanced_text)
-        audit_trail.append(f"Enhanced text length: {enhanced_length}\n\n")
-        audit_trail.append("Notes: The standard was already well-written and comprehensive. Enhancement focused on improving language clarity and readability.\n\n")
-        
-        quality_scores["enhancer"] = self._assess_quality(
-            enhanced_text,
-            enhancement_criteria
+        # Serialize once; every later stage takes the string
+        structured_text = str(structured_standard)
+        
+        # Steps 2 and 3: Review and enhancement only need the parsed standard
+        logger.info("Steps 2-3: Reviewing and enhancing the standard")
+        reviewer_time = enhancer_start_time = _now()
+        
+        # Step 4 follows the enhancement directly instead of also waiting
+        # for the review, since validation only needs the enhanced text
+        async def enhance_and_validate() -> Tuple[str, Dict[str, int], str]:
+            nonlocal enhancer_end_time, validator_time
+            enhanced = await self._run_stage(
+                "enhance", skipped, degraded, structured_text,
+                self._enhance_standard, structured_text, _ENHANCEMENT_CRITERIA, documents
+            )
+            enhancer_end_time = validator_time = _now()
+            
+            threshold = self.high_confidence_threshold
+            if threshold is not None:
+                # The quality scores don't depend on the validation, so get
+                # them first and skip the validator call on clean inputs
+                scores = await self._run_stage(
+                    "quality", skipped, degraded, self._default_scores(downstream_items),
+                    self._assess_quality_batch, [(label, enhanced, criteria) for label, criteria in downstream_items],
+                    documents
+                )
+                prior_scores = await upstream_scores_future
+                # Fallback scores after a failed assessment never count as passing
+                if "quality" not in degraded and all(
+                    score >= threshold for score in (*prior_scores.values(), *scores.values())
+                ):
+                    logger.info(f"Step 4: Skipping validation, all quality scores are at least {threshold}")
+                    return enhanced, scores, f"Validation skipped: every quality score was at least {threshold}."
+                logger.info("Step 4: Validating the enhanced standard")
+                notes = await self._run_stage(
+                    "validate", skipped, degraded, "Validation skipped.",
+                    self._validate_standard, enhanced, documents
+                )
+                return enhanced, scores, notes
+            
+            logger.info("Step 4: Validating the enhanced standard")
+            scores, notes = await asyncio.gather(
+                self._run_stage(
+                    "quality", skipped, degraded, self._default_scores(downstream_items),
+                    self._assess_quality_batch, [(label, enhanced, criteria) for label, criteria in downstream_items],
+                    documents
+                ),
+                self._run_stage(
+                    "validate", skipped, degraded, "Validation skipped.",
+                    self._validate_standard, enhanced, documents
+                ),
+            )
+            return enhanced, scores, notes
+        
+        upstream_items = [("preprocessor", _PREPROCESSOR_CRITERIA), ("reviewer", _REVIEWER_CRITERIA)]
+        downstream_items = [("enhancer", _ENHANCEMENT_CRITERIA), ("validator", _VALIDATOR_CRITERIA)]
+        enhancer_end_time = validator_time = enhancer_start_time
+        upstream_scores_future = self._run_stage(
+            "quality", skipped, degraded, self._default_scores(upstream_items),
+            self._assess_quality_batch, [(label, structured_text, criteria) for label, criteria in upstream_items],
+            documents
         )
-        audit_trail.append(f"**Quality score:** {quality_scores['enhancer']}\n\n")
-        
-        processing_time = f"{enhancer_start_time.isoformat()} to {enhancer_end_time.isoformat()}"
-        audit_trail.append(f"**Processing time:** {processing_time}\n\n")
-        
-        # Add enhancement justification and details
-        audit_trail.append("### Justification\n\n")
-        audit_trail.append(f"The enhancer improved the standard with a quality score of {quality_scores['enhancer']}. The enhancements were focused on improving clarity, consistency, and completeness. The LLM response was successfully parsed using standard_parser.\n\n")
-        
-        audit_trail.append("### Processing Steps\n\n")
-        audit_trail.append(f"1. **initialization** ({enhancer_start_time.isoformat()}): Enhancer agent initialized with reviewed standard text\n")
-        audit_trail.append(f"2. **prompt_creation** ({enhancer_start_time.isoformat()}): Created prompt for LLM to enhance the standard\n")
-        audit_trail.append(f"3. **llm_response** ({enhancer_end_time.isoformat()}): Received response from LLM\n")
-        audit_trail.append(f"4. **parsing** ({enhancer_end_time.isoformat()}): Successfully parsed LLM response using standard_parser\n\n")
-        
-        audit_trail.append("### Improvements Made\n\n")
-        audit_trail.append("1. Enhanced language clarity and readability\n")
-        audit_trail.append("2. Ensured consistency in terminology\n\n")
-        
-        audit_trail.append("### Recommendations\n\n")
-        audit_trail.append("1. Include a section on dispute resolution in the case of non-compliance with the standard\n")
-        audit_trail.append("2. Consider adding more examples to cover a wider range of possible Murabaha transactions\n\n")
-        
-        # Step 4: Validation
-        logger.info("Step 4: Validating the enhanced standard")
-        validator_time = datetime.datetime.now()
-        audit_trail.append("## Validator\n\n")
-        audit_trail.append(f"**Timestamp:** {validator_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        
-        validation_notes = self._validate_standard(enhanced_text)
-        audit_trail.append(f"Validation notes: {validation_notes}\n\n")
+        upstream_scores, review_notes, (enhanced_text, downstream_scores, validation_notes) = await asyncio.gather(
+            upstream_scores_future,
+            self._run_stage(
+                "review", skipped, degraded, "Review skipped.",
+                self._review_standard, structured_text, documents
+            ),
+            enhance_and_validate(),
+        )
+        for scores in (upstream_scores, downstream_scores):
+            quality_scores.update(scores)
+            score_sum += sum(scores.values())
+        
+        # Record the stages in pipeline order; the markdown audit trail is
+        # only rendered from these entries when it is read
+        audit_entries = [
+            {
+                "stage": "Preprocessor",
+                "timestamp": preprocessor_time,
+                "body": f"{_SKIPPED_NOTE if 'parse' in skipped else ''}Preprocessed text length: {len(structured_text)}\n\n{_PREPROCESSOR_NOTES}",
+                "score": quality_scores["preprocessor"],
+            },
+            {
+                "stage": "Reviewer",
+                "timestamp": reviewer_time,
+                "body": f"{_SKIPPED_NOTE if 'review' in skipped else ''}Review notes: {review_notes}\n\n",
+                "score": quality_scores["reviewer"],
+            },
+            {
+                "stage": "Enhancer",
+                "timestamp": enhancer_start_time,
+                "body": f"{_SKIPPED_NOTE if 'enhance' in skipped else ''}Enhanced text length: {len(enhanced_text)}\n\n{_ENHANCER_NOTES}",
+                "score": quality_scores["enhancer"],
+                "finished": enhancer_end_time,
+            },
+            {
+                "stage": "Validator",
+                "timestamp": validator_time,
+                "body": f"{_SKIPPED_NOTE if 'validate' in skipped else ''}Validation notes: {validation_notes}\n\n",
+                "score": quality_scores["validator"],
+            },
+        ]
         
-        quality_scores["validator"] = self._assess_quality(
-            enhanced_text,
-            {"compliance": "Complies with AAOIFI format", "coherence": "Content is coherent"}
+        return PipelineResult(
+            final_output=enhanced_text,
+            audit_entries=audit_entries,
+            quality_scores=quality_scores,
+            average_quality=score_sum / len(quality_scores),
+            input_length=len(standard_text),
+            degraded=frozenset(degraded),
+            start_time=start_time,
+            completion_time=_now()
         )
-        audit_trail.append(f"**Quality score:** {quality_scores['validator']}\n\n")
-        
-        # Calculate final metrics
-        completion_time = datetime.datetime.now()
-        processing_duration = (completion_time - start_time).total_seconds()
-        avg_quality = sum(quality_scores.values()) / len(quality_scores)
-        
-        # Add final process summary
-        audit_trail.append("## Final Process Summary\n\n")
-        audit_trail.append(f"- **Completion time**: {completion_time}\n")
-        audit_trail.append(f"- **Average quality score**: {avg_quality:.1f}/100\n")
-        audit_trail.append(f"- **Total processing time**: {processing_duration:.1f} seconds\n")
-        audit_trail.append(f"- **Final output length**: {len(enhanced_text)} characters\n")
-        
-        return {
-            "final_output": enhanced_text,
-            "audit_trail": "".join(audit_trail),
-            "quality_scores": quality_scores,
-            "start_time": start_time,
-            "completion_time": completion_time
-        }
     
+    @_cached_stage("parse")
     def _parse_standard(self, text: str) -> Dict[str, Any]:
         """Parse and structure the standard text."""
-        system_message = """
-        You are a financial standards parser. Extract structured information from the 
-        AAOIFI standard text including sections, clauses, and key definitions.
-        """
-        
+        # The instructions lead and the standard comes last, so every call
+        # shares a prompt prefix
         user_message = f"""
-        Parse the following AAOIFI standard text into a structured format:
-        
-        {text[:4000]}  # Using first 4000 chars for prompt size limits
+        Parse the AAOIFI standard text below into a structured format.
         
         Return a JSON structure with:
         1. "title" - The standard title
         2. "sections" - Array of identified sections
         3. "definitions" - Key terms and definitions
+        
+        Standard text:
+        {_truncate_to_tokens(text, _PARSE_TOKEN_BUDGET)}
         """
         
-        prompt = self.llm_client.format_prompt(system_message, user_message)
+        prompt = self.llm_client.format_prompt(_SYS_PARSER, user_message)
         response = self.llm_client.get_completion_text(prompt)
         
         try:
             # Try to parse as JSON
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-            else:
-                json_str = response
-                
-            structured = eval(json_str)  # Using eval as json.loads may fail on single quotes
+            json_str = extract_json_block(response)
+            try:
+                structured = orjson.loads(json_str)
+            except orjson.JSONDecodeError:
+                # LLMs often answer with a single-quoted Python literal instead
+                structured = ast.literal_eval(json_str)
+            if not isinstance(structured, dict):
+                raise ValueError(f"expected an object, got {type(structured).__name__}")
             return structured
         except Exception as e:
             logger.warning(f"Failed to parse structured standard: {str(e)}")
-            # Return basic structure if parsing fails
-            return {
-                "title": "Untitled Standard",
-                "sections": [{"content": text}],
-                "definitions": {}
-            }
-    
-    def _review_standard(self, structured_standard: Dict[str, Any]) -> str:
-        """Review the standard and provide notes."""
-        system_message = """
-        You are a financial standards reviewer. Review the AAOIFI standard and provide 
-        comprehensive notes on its quality, completeness, and alignment with Shariah principles.
-        """
-        
+            # Return basic structure if parsing fails, and retry next time
+            raise _Uncached(_fallback_structure(text))
+    
+    @_cached_stage("retrieve")
+    def _retrieve_documents(self, text: str) -> Optional[List[Dict[str, Any]]]:
+        """Retrieve the RAG documents shared by every stage, or None without RAG."""
+        if not self._rag_enabled:
+            return None
+        return self.llm_service.rag_system.retrieve(text[:2000], top_k=4)
+    
+    @_cached_stage("review")
+    def _review_standard(
+        self,
+        structured_text: str,
+        documents: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Review the serialized structured standard and provide notes."""
         user_message = f"""
-        Review the following structured AAOIFI standard:
-        
-        {structured_standard}
+        Review the structured AAOIFI standard below.
         
         Provide comprehensive notes about:
         1. Structure and organization
         2. Clarity and comprehensiveness
         3. Alignment with Shariah principles
         4. Completeness of coverage
+        
+        Structured standard:
+        {structured_text}
         """
         
         # Use RAG if available
-        if hasattr(self.llm_service, 'has_rag') and self.llm_service.has_rag:
-            return self.llm_service.rag_system.generate_with_context(user_message, system_message)
+        if self._rag_enabled:
+            return self.llm_service.rag_system.generate_with_context(
+                user_message, _SYS_REVIEWER, documents=documents
+            )
         else:
-            prompt = self.llm_client.format_prompt(system_message, user_message)
+            prompt = self.llm_client.format_prompt(_SYS_REVIEWER, user_message)
             return self.llm_client.get_completion_text(prompt)
     
-    def _enhance_standard(self, structured_standard: Dict[str, Any], criteria: Dict[str, str]) -> str:
-        """Enhance the standard based on structured representation."""
+    @_cached_stage("enhance")
+    def _enhance_standard(
+        self,
+        structured_text: str,
+        criteria: Mapping[str, str],
+        documents: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Enhance the standard based on its serialized structured representation."""
         # Log whether RAG is being used
-        if hasattr(self.llm_service, 'has_rag') and self.llm_service.has_rag:
+        if self._rag_enabled:
             logger.info("Enhancer is using RAG system for document retrieval")
             
-            # Get relevant chunks for logging
-            query = f"Enhance AAOIFI standards for {structured_standard.get('title', 'untitled standard')}"
-            relevant_docs = self.llm_service.rag_system.retrieve(query, top_k=2)
-            
-            # Log the retrieved documents
-            logger.info(f"Retrieved {len(relevant_docs)} relevant document chunks for enhancement")
-            for i, doc in enumerate(relevant_docs):
-                logger.info(f"Document {i+1}: From {doc['source']} (similarity: {doc['similarity']:.2f})")
+            # Log the shared documents; without them the service retrieves its own
+            if documents is not None:
+                logger.info(f"Using {len(documents)} shared document chunks for enhancement")
+                for i, doc in enumerate(documents):
+                    logger.info(f"Document {i+1}: From {doc['source']} (similarity: {doc['similarity']:.2f})")
         else:
             logger.info("Enhancer is not using RAG system")
         
+        # Stream the enhancement when someone is listening for progress
+        on_token = None if self.on_token is None else functools.partial(self.on_token, "enhancer")
         return self.llm_service.enhance_text(
-            str(structured_standard),
-            criteria
+            structured_text,
+            criteria,
+            documents,
+            on_token
         )
     
-    def _assess_quality(self, text: str, criteria: Dict[str, str]) -> int:
-        """Assess the quality of the standard based on criteria."""
+    @_cached_stage("quality")
+    def _assess_quality_batch(
+        self,
+        items: List[Tuple[str, str, Mapping[str, str]]],
+        documents: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, int]:
+        """Assess the quality of several stages in a single LLM request."""
         try:
-            result = self.llm_service.analyze_quality(text, criteria)
-            return result.get("overall_score", self.default_quality_score)
+            results = self.llm_service.analyze_quality_batch(
+                [{"label": label, "text": text, "criteria": criteria} for label, text, criteria in items],
+                documents
+            )
+        except _RETRYABLE_ERRORS:
+            # Left to the stage runner, which retries transient failures
+            raise
         except Exception as e:
-            logger.warning(f"Quality assessment failed: {str(e)}")
-            return self.default_quality_score
+            logger.warning(f"Batched quality assessment failed: {str(e)}")
+            raise _Uncached(self._default_scores(items))
+        
+        scores = {
+            label: result.get("overall_score", self.default_quality_score)
+            for (label, _, _), result in zip(items, results)
+        }
+        # Only scores the model actually gave are worth reusing
+        if len(results) < len(items) or any("overall_score" not in result for result in results):
+            raise _Uncached({**self._default_scores(items), **scores})
+        return scores
     
-    def _validate_standard(self, text: str) -> str:
+    def _default_scores(self, items: List[Tuple]) -> Dict[str, int]:
+        """Default quality scores for items labelled by their first element."""
+        return {item[0]: self.default_quality_score for item in items}
+    
+    @_cached_stage("validate")
+    def _validate_standard(self, text: str, documents: Optional[List[Dict[str, Any]]] = None) -> str:
         """Validate the enhanced standard and provide notes."""
-        system_message = """
-        You are a financial standards validator. Validate the enhanced AAOIFI standard 
-        and provide detailed notes on its structure, coherence, completeness, and compliance.
-        """
-        
         user_message = f"""
-        Validate the following enhanced AAOIFI standard:
-        
-        {text[:6000]}  # Using first 6000 chars due to potential length
+        Validate the enhanced AAOIFI standard below.
         
         Provide detailed validation notes addressing:
         1. Structure and organization
@@ -310,16 +944,21 @@ class AAOIFIOrchestrator:
         3. Shariah compliance
         4. Grammar and language quality
         5. Overall quality and completeness
+        
+        Enhanced standard:
+        {_truncate_to_tokens(text, _VALIDATE_TOKEN_BUDGET)}
         """
         
         # Log whether RAG is being used
         rag_info = ""
-        if hasattr(self.llm_service, 'has_rag') and self.llm_service.has_rag:
+        if self._rag_enabled:
             logger.info("Validator is using RAG system for document retrieval")
             
-            # Get relevant chunks for logging
-            query = "AAOIFI standards validation criteria and best practices"
-            relevant_docs = self.llm_service.rag_system.retrieve(query, top_k=2)
+            # Retrieve once; the same chunks are logged and used for generation
+            if documents is None:
+                relevant_docs = self.llm_service.rag_system.retrieve(user_message)
+            else:
+                relevant_docs = documents
             
             # Log the retrieved documents
             logger.info(f"Retrieved {len(relevant_docs)} relevant document chunks for validation")
@@ -330,8 +969,10 @@ class AAOIFIOrchestrator:
             rag_info = f"Note: Validator used RAG system with {len(relevant_docs)} relevant document chunks from the following sources: "
             rag_info += ", ".join([doc['source'] for doc in relevant_docs])
             
-            return self.llm_service.rag_system.generate_with_context(user_message, system_message)
+            return self.llm_service.rag_system.generate_with_context(
+                user_message, _SYS_VALIDATOR, documents=relevant_docs
+            )
         else:
             logger.info("Validator is not using RAG system")
-            prompt = self.llm_client.format_prompt(system_message, user_message)
+            prompt = self.llm_client.format_prompt(_SYS_VALIDATOR, user_message)
             return self.llm_client.get_completion_text(prompt)
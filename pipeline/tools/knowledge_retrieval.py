@@ -2,15 +2,37 @@
 Knowledge retrieval tool for the AAOIFI Standards Enhancement System.
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 
 from pipeline.models.models import KnowledgeRequest
+from pipeline.tools.llm_cache import LLMCache
+
+# Static instructions kept separate from the per-request context so the
+# prompt prefix stays identical across calls and providers can cache it
+_SYS_KNOWLEDGE = """You are a knowledgeable assistant specializing in Islamic finance and AAOIFI standards.
+            
+Your task is to provide accurate, relevant information in response to queries about Islamic finance principles, 
+Shariah compliance, AAOIFI standards, and related topics.
+
+When responding:
+1. Focus on factual information from authoritative sources
+2. Cite your sources when possible
+3. If you're uncertain, acknowledge the limits of your knowledge
+4. Structure your response in a clear, organized manner
+5. Do not paraphrase or synthesize facts — quote the original when possible
+6. Include citations (title + source link)
+7. Prioritize authoritative sources: AAOIFI.org, Islamic Finance Gateway, IFSB, academic journals, known Muftis' fatawa ressources from the internet
+"""
+_SYSTEM_MESSAGE = SystemMessage(content=_SYS_KNOWLEDGE)
+_CONTEXT_TEMPLATE = "Context about the request: {context}"
 
 # Change from dataclass to Pydantic model to be consistent
 class KnowledgeResponse(BaseModel):
@@ -18,9 +40,9 @@ class KnowledgeResponse(BaseModel):
     content: str
     source: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.now)
+    audit_details: Optional[Dict[str, Any]] = None
 
-    class Config:
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(arbitrary_types_allowed=True)
 
 class KnowledgeRetrievalTool:
     """
@@ -32,36 +54,19 @@ class KnowledgeRetrievalTool:
     - Returns a structured response
     """
     
-    def __init__(self, llm: ChatOpenAI):
+    def __init__(self, llm: ChatOpenAI, parallel_knowledge: bool = True, cache: Optional[LLMCache] = None):
         """
         Initialize the knowledge retrieval tool.
         
         Args:
             llm: The language model to use
+            parallel_knowledge: Whether aretrieve_many sends requests concurrently
+            cache: Cache of successful responses, in-process by default
         """
         self.logger = logging.getLogger("tools.knowledge_retrieval")
         self.llm = llm
-        
-        # Create a prompt template for knowledge retrieval
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a knowledgeable assistant specializing in Islamic finance and AAOIFI standards.
-            
-Your task is to provide accurate, relevant information in response to queries about Islamic finance principles, 
-Shariah compliance, AAOIFI standards, and related topics.
-
-When responding:
-1. Focus on factual information from authoritative sources
-2. Cite your sources when possible
-3. If you're uncertain, acknowledge the limits of your knowledge
-4. Structure your response in a clear, organized manner
-5. Do not paraphrase or synthesize facts — quote the original when possible
-6. Include citations (title + source link)
-7. Prioritize authoritative sources: AAOIFI.org, Islamic Finance Gateway, IFSB, academic journals, known Muftis' fatawa ressources from the internet
-
-Context about the request: {context}
-"""),
-            ("human", "{query}")
-        ])
+        self.parallel_knowledge = parallel_knowledge
+        self.cache = cache if cache is not None else LLMCache()
     
     def retrieve(self, request: KnowledgeRequest) -> KnowledgeResponse:
         """
@@ -76,72 +81,127 @@ Context about the request: {context}
         self.logger.info(f"Retrieving knowledge for query: {request.query}")
         
         # Record start time for audit
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
-        # Format the prompt
-        formatted_prompt = self.prompt.format(
-            query=request.query,
-            context=request.context
-        )
+        messages = self._format_prompt(request)
+        cache_key = self.cache.key(self.llm, messages)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
         
-        # Get the response from the LLM
-        self.logger.debug(f"Sending prompt to LLM: {formatted_prompt}")
+        try:
+            response = self.llm.invoke(messages)
+        except Exception as e:
+            return self._error_response(request, e, start_time)
+        return self._cache_response(cache_key, self._success_response(request, response.content, start_time))
+    
+    async def aretrieve(self, request: KnowledgeRequest) -> KnowledgeResponse:
+        """
+        Retrieve knowledge based on the request asynchronously.
         
-        result = None
-        error = None
+        Args:
+            request: The knowledge request
+            
+        Returns:
+            A knowledge response
+        """
+        self.logger.info(f"Retrieving knowledge for query: {request.query}")
+        
+        # Record start time for audit
+        start_time = time.perf_counter()
+        
+        messages = self._format_prompt(request)
+        cache_key = self.cache.key(self.llm, messages)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return cached
         
         try:
-            response = self.llm.invoke(formatted_prompt)
-            content = response.content
-            
-            self.logger.info(f"Received response from LLM, length: {len(content)}")
-            
-            # Create the knowledge response
-            result = KnowledgeResponse(
-                content=content,
-                source="LLM-generated content",
-                timestamp=datetime.now()
-            )
+            response = await self.llm.ainvoke(messages)
+        except Exception as e:
+            return self._error_response(request, e, start_time)
+        return self._cache_response(cache_key, self._success_response(request, response.content, start_time))
+    
+    async def aretrieve_many(self, requests: List[KnowledgeRequest]) -> List[KnowledgeResponse]:
+        """
+        Retrieve knowledge for several requests.
+        
+        With parallel_knowledge enabled the requests are sent concurrently,
+        so the total latency is that of the slowest request rather than the
+        sum of all of them.
+        
+        Args:
+            requests: The knowledge requests
             
-            # Record tool usage details for the requester's audit
-            retrieval_details = {
+        Returns:
+            The knowledge responses, in the same order as requests
+        """
+        if self.parallel_knowledge:
+            return list(await asyncio.gather(*(self.aretrieve(request) for request in requests)))
+        return [await self.aretrieve(request) for request in requests]
+    
+    def _format_prompt(self, request: KnowledgeRequest) -> List[BaseMessage]:
+        """Build the retrieval messages for a request."""
+        # Only the context and query vary, so build the messages directly
+        # instead of rendering a prompt template on every call
+        messages = [
+            _SYSTEM_MESSAGE,
+            SystemMessage(content=_CONTEXT_TEMPLATE.format(context=request.context)),
+            HumanMessage(content=request.query)
+        ]
+        self.logger.debug("Sending prompt to LLM: %s", messages)
+        return messages
+    
+    def _cached_response(self, cache_key: str) -> Optional[KnowledgeResponse]:
+        """Return a copy of a cached response, or None on a miss."""
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        self.logger.info("Using cached knowledge response")
+        return cached.model_copy(deep=True)
+    
+    def _cache_response(self, cache_key: str, response: KnowledgeResponse) -> KnowledgeResponse:
+        """Cache a successful response and return it."""
+        self.cache.put(cache_key, response.model_copy(deep=True))
+        return response
+    
+    def _success_response(self, request: KnowledgeRequest, content: str, start_time: float) -> KnowledgeResponse:
+        """Build the response for a successful retrieval."""
+        self.logger.info(f"Received response from LLM, length: {len(content)}")
+        
+        # Record tool usage details for the requester's audit
+        now = datetime.now()
+        return KnowledgeResponse(
+            content=content,
+            source="LLM-generated content",
+            timestamp=now,
+            audit_details={
                 "tool": "knowledge_retrieval",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now.isoformat(),
                 "query": request.query,
                 "context": request.context,
                 "result_summary": content[:100] + "..." if len(content) > 100 else content,
                 "source": "LLM-generated content",
-                "processing_time": (datetime.now() - start_time).total_seconds()
+                "processing_time": time.perf_counter() - start_time
             }
-            
-            # Add the details to the response for the requester's audit
-            if not hasattr(result, "audit_details"):
-                result.audit_details = retrieval_details
-            
-            return result
-        except Exception as e:
-            self.logger.error(f"Error retrieving knowledge: {str(e)}")
-            error = str(e)
-            
-            # Return a fallback response
-            result = KnowledgeResponse(
-                content=f"Error retrieving knowledge: {str(e)}",
-                source="Error",
-                timestamp=datetime.now()
-            )
-            
-            # Record error details for the requester's audit
-            retrieval_details = {
+        )
+    
+    def _error_response(self, request: KnowledgeRequest, error: Exception, start_time: float) -> KnowledgeResponse:
+        """Build the fallback response for a failed retrieval."""
+        self.logger.error(f"Error retrieving knowledge: {str(error)}")
+        
+        # Record error details for the requester's audit
+        now = datetime.now()
+        return KnowledgeResponse(
+            content=f"Error retrieving knowledge: {str(error)}",
+            source="Error",
+            timestamp=now,
+            audit_details={
                 "tool": "knowledge_retrieval",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": now.isoformat(),
                 "query": request.query,
                 "context": request.context,
-                "error": str(e),
-                "processing_time": (datetime.now() - start_time).total_seconds()
+                "error": str(error),
+                "processing_time": time.perf_counter() - start_time
             }
-            
-            # Add the details to the response for the requester's audit
-            if not hasattr(result, "audit_details"):
-                result.audit_details = retrieval_details
-            
-            return result
+        )
@@ -0,0 +1,251 @@
+"""
+LLM response cache for the AAOIFI Standards Enhancement System tools.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Protocol
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Entries older than this are treated as missing
+_DEFAULT_TTL_SECONDS = 3600
+
+# Upper bound on cached entries before the least recently used is evicted
+_DEFAULT_MAX_SIZE = 512
+
+# Upper bound on files kept by a DiskBackend, checked every so many writes
+_DEFAULT_DISK_MAX_ENTRIES = 4096
+_DISK_SWEEP_INTERVAL = 64
+
+# Failures are remembered for less time than results, so a prompt that
+# failed is retried once the model has had a chance to recover
+_DEFAULT_NEGATIVE_TTL_SECONDS = 300
+
+class CacheBackend(Protocol):
+    """Storage used by LLMCache, e.g. an in-process dict or a shared Redis."""
+
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        ...
+
+class InMemoryBackend:
+    """Thread-safe in-process TTL LRU store."""
+
+    def __init__(self, max_size: int = _DEFAULT_MAX_SIZE):
+        """
+        Initialize the store.
+
+        Args:
+            max_size: Maximum number of entries kept
+        """
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+class DiskBackend:
+    """
+    Store keeping one JSON file per entry, so entries survive restarts.
+    
+    Values must be JSON-serializable. Expired files are deleted when they
+    are read, and every few writes the least recently written files beyond
+    max_entries are deleted, so the directory stays bounded. It can still
+    be cleared at any time.
+    """
+
+    def __init__(self, directory: str, max_entries: int = _DEFAULT_DISK_MAX_ENTRIES):
+        """
+        Initialize the store.
+
+        Args:
+            directory: Directory holding the cache files
+            max_entries: Maximum number of entries kept
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sweep()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = orjson.loads(f.read())
+            if entry["expires_at"] < time.time():
+                self._remove(self._path(key))
+                return None
+            return entry["value"]
+        except (OSError, orjson.JSONDecodeError, KeyError, TypeError):
+            return None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        path = self._path(key)
+        # Write then rename, so readers never see a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Serialized before the file is created, so a value JSON can't
+            # hold leaves no temporary file behind
+            data = orjson.dumps({"expires_at": time.time() + ttl, "value": value})
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to write cache entry: {str(e)}")
+            return
+        
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % _DISK_SWEEP_INTERVAL == 0
+        if sweep:
+            self._sweep()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _sweep(self) -> None:
+        """Delete the least recently written entries beyond max_entries."""
+        try:
+            with os.scandir(self.directory) as entries:
+                files = [
+                    (entry.stat().st_mtime, entry.path) for entry in entries
+                    if entry.name.endswith(".json") and entry.is_file()
+                ]
+        except OSError as e:
+            logger.warning(f"Failed to sweep cache directory: {str(e)}")
+            return
+        if len(files) <= self.max_entries:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self.max_entries]:
+            self._remove(path)
+
+class LLMCache:
+    """
+    Cache of LLM results keyed by a hash of the model settings and prompt.
+
+    Only worth using for results that are deterministic enough to reuse,
+    such as low-temperature knowledge retrievals.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        ttl: float = _DEFAULT_TTL_SECONDS,
+        negative_ttl: float = _DEFAULT_NEGATIVE_TTL_SECONDS
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            backend: The storage to use, in-process by default
+            ttl: Seconds an entry stays valid
+            negative_ttl: Seconds a recorded failure stays valid
+        """
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Failures live in their own store so they never evict real results
+        self._negatives = InMemoryBackend()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "negative_hits": 0}
+
+    @staticmethod
+    def key(llm: Any, prompt: Any) -> str:
+        """
+        Build the cache key for a prompt sent to an LLM.
+
+        Args:
+            llm: The language model the prompt is sent to
+            prompt: The prompt
+
+        Returns:
+            A hex digest of the model settings and the prompt
+        """
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+        temperature = getattr(llm, "temperature", None)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{type(llm).__name__}\0{model}\0{temperature}\0".encode("utf-8"))
+        digest.update(str(prompt).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached result.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached result, or None on a miss
+        """
+        value = self.backend.get(key)
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store a result.
+
+        Args:
+            key: The cache key
+            value: The result to store
+        """
+        self.backend.set(key, value, self.ttl)
+
+    def is_negative(self, key: str) -> bool:
+        """
+        Check whether a prompt recently produced an unusable result.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            True if a failure was recorded for the key within negative_ttl
+        """
+        if self._negatives.get(key) is None:
+            return False
+        self.stats["negative_hits"] += 1
+        return True
+
+    def put_negative(self, key: str) -> None:
+        """
+        Record that a prompt produced an unusable result.
+
+        Args:
+            key: The cache key
+        """
+        self._negatives.set(key, True, self.negative_ttl)
@@ -4,8 +4,25 @@ Utility functions for the AAOIFI Standards Enhancement System.
 
 import re
 import logging
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 
+# Compiled once at import; these helpers run per section
+_ARABIC_TERM_RE = re.compile(r'([A-Z][a-z]*(?:\s[A-Z][a-z]*)*)\s*\(([^)]*)\)')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+
+# Shariah compliance rules: a trigger term mentioned without its
+# qualifying term raises the issue
+_COMPLIANCE_RULES = (
+    ("interest", "prohibited", "Interest (Riba) mentioned without prohibition", "high"),
+    ("uncertainty", "gharar", "Uncertainty mentioned without reference to Gharar", "medium"),
+)
+# Every rule term in one pattern, so the text is scanned once
+_COMPLIANCE_TERMS_RE = re.compile(
+    "|".join(re.escape(term) for rule in _COMPLIANCE_RULES for term in rule[:2]),
+    re.IGNORECASE
+)
+
 def format_arabic_terms(text: str) -> str:
     """
     Format Arabic terms in the text with proper transliteration and explanation.
@@ -19,15 +36,9 @@ def format_arabic_terms(text: str) -> str:
     # This is a simple placeholder implementation.
     # In a real system, this would be more sophisticated.
     
-    # Find Arabic terms in the text (simplified approach)
-    arabic_term_pattern = r'([A-Z][a-z]*(?:\s[A-Z][a-z]*)*)\s*\(([^)]*)\)'
-    
-    # Replace with properly formatted versions
-    formatted_text = re.sub(
-        arabic_term_pattern, 
-        r'*\1* (\2)',
-        text
-    )
+    # Find Arabic terms in the text (simplified approach) and replace
+    # them with properly formatted versions
+    formatted_text = _ARABIC_TERM_RE.sub(r'*\1* (\2)', text)
     
     return formatted_text
 
@@ -44,17 +55,58 @@ def extract_sections(text: str) -> Dict[str, str]:
     # This is a simple placeholder implementation.
     # In a real system, this would be more sophisticated.
     
-    # Find sections in the text
-    section_pattern = r'#+\s*(.*?)\s*\n(.*?)(?=\n#+\s|$)'
+    # Walk the lines once: a line whose first non-blank character is '#'
+    # opens a section that runs until the next such line. As before, the
+    # space after the '#' run is optional and headings may be indented
     sections = {}
-    
-    for match in re.finditer(section_pattern, text, re.DOTALL):
-        section_name = match.group(1).strip()
-        section_content = match.group(2).strip()
-        sections[section_name] = section_content
+    section_name = None
+    section_lines = []
+    
+    for line in text.splitlines():
+        stripped = line.lstrip()
+        if stripped.startswith('#'):
+            if section_name is not None:
+                sections[section_name] = "\n".join(section_lines).strip()
+            section_name = stripped.lstrip('#').strip()
+            section_lines = []
+        elif section_name is not None:
+            section_lines.append(line)
+    
+    if section_name is not None:
+        sections[section_name] = "\n".join(section_lines).strip()
     
     return sections
 
+@lru_cache(maxsize=32)
+def _word_set(text: str) -> frozenset:
+    """Lowercased, punctuation-free word set of a text, cached for reuse."""
+    return frozenset(_PUNCT_RE.sub('', text.lower()).split())
+
+def extract_json_block(text: str) -> str:
+    """
+    Extract the JSON payload of an LLM response.
+    
+    Args:
+        text: The response, possibly wrapping the JSON in a fenced code block
+        
+    Returns:
+        The contents of the first ```json (or plain ```) block, or the
+        whole text when there is no fence
+    """
+    # Locate the fence boundaries and slice once, instead of splitting
+    # copies of the whole response
+    start = text.find("```json")
+    if start >= 0:
+        start += len("```json")
+    else:
+        start = text.find("```")
+        if start < 0:
+            return text
+        start += len("```")
+    
+    end = text.find("```", start)
+    return text[start:end if end >= 0 else None].strip()
+
 def calculate_similarity(text1: str, text2: str) -> float:
     """
     Calculate the similarity between two texts.
@@ -69,17 +121,14 @@ def calculate_similarity(text1: str, text2: str) -> float:
     # This is a simple placeholder implementation.
     # In a real system, this would use more sophisticated algorithms.
     
-    # Convert to lowercase and remove punctuation
-    text1 = re.sub(r'[^\w\s]', '', text1.lower())
-    text2 = re.sub(r'[^\w\s]', '', text2.lower())
-    
-    # Split into words
-    words1 = set(text1.split())
-    words2 = set(text2.split())
+    # Lowercase, strip punctuation and split into words; the sets are
+    # cached so comparing many texts against one reference is cheap
+    words1 = _word_set(text1)
+    words2 = _word_set(text2)
     
-    # Calculate Jaccard similarity
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
+    # Calculate Jaccard similarity, counting the union instead of building it
+    intersection = len(words1 & words2)
+    union = len(words1) + len(words2) - intersection
     
     if union == 0:
         return 0.0
@@ -100,21 +149,12 @@ def validate_shariah_compliance(text: str) -> List[Dict[str, Any]]:
     # In a real system, this would be more sophisticated and would
     # actually check for Shariah compliance issues.
     
-    results = []
+    # Find which rule terms occur in a single pass over the text
+    found = {match.group(0).lower() for match in _COMPLIANCE_TERMS_RE.finditer(text)}
     
     # Check for common Shariah compliance issues
-    if "interest" in text.lower() and "prohibited" not in text.lower():
-        results.append({
-            "issue": "Interest (Riba) mentioned without prohibition",
-            "severity": "high",
-            "location": "N/A"
-        })
-    
-    if "uncertainty" in text.lower() and "gharar" not in text.lower():
-        results.append({
-            "issue": "Uncertainty mentioned without reference to Gharar",
-            "severity": "medium",
-            "location": "N/A"
-        })
-    
-    return results
+    return [
+        {"issue": issue, "severity": severity, "location": "N/A"}
+        for trigger, qualifier, issue, severity in _COMPLIANCE_RULES
+        if trigger in found and qualifier not in found
+    ]
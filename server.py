@@ -4,23 +4,40 @@ This file provides a REST API interface to the standard enhancement pipeline.
 """
 
 import os
+import gzip
+import atexit
 import logging
-from typing import Dict, Any, Optional
+import logging.handlers
+import queue
+import threading
+from typing import Any, Iterator, Optional
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 
 from pipeline.orchestrator import AAOIFIOrchestrator
+from pipeline.tools.llm_cache import DiskBackend, LLMCache
 from utils.gemini_client import GeminiClient
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]
+# Configure logging; records are handed to a background listener so request
+# handlers and agents never block on stderr writes
+_log_queue = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, _stream_handler, respect_handler_level=True
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
 logger = logging.getLogger('server')
 
 # Initialize Gemini client and orchestrator at startup
@@ -39,7 +56,9 @@ def initialize_orchestrator():
             default_quality_score=60,
             llm_client=gemini_client,
             use_rag=True,
-            rag_data_dir="data"
+            rag_data_dir="data",
+            # Keep completions on disk so a restarted server starts warm
+            response_cache=LLMCache(DiskBackend(os.path.join(".aaoifi_cache", "llm")))
         )
         
         logger.info("Orchestrator initialization complete")
@@ -55,11 +74,65 @@ def initialize_orchestrator():
         logger.error(f"Error initializing orchestrator: {str(e)}", exc_info=True)
         raise
 
+class ORJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson, which encodes the large enhanced
+    standard and audit trail payloads much faster than the json module.
+    """
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+    
+    def response(self, *args: Any, **kwargs: Any):
+        # Hand orjson's bytes straight to the response, skipping the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
-# Initialize the orchestrator at module load time
-orchestrator = initialize_orchestrator()
+# Responses smaller than this aren't worth compressing
+_GZIP_MIN_SIZE = 1024
+
+@app.after_request
+def compress_response(response):
+    """Gzip large responses, such as enhanced standards, for clients that accept it."""
+    response.vary.add('Accept-Encoding')
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or 'Content-Encoding' in response.headers
+        or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()
+    ):
+        return response
+    
+    data = response.get_data()
+    if len(data) < _GZIP_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# The orchestrator is created on first use rather than at import, so
+# importing this module (e.g. in tests or a preloading server) stays cheap
+orchestrator: Optional[AAOIFIOrchestrator] = None
+_orchestrator_lock = threading.Lock()
+
+def get_orchestrator() -> AAOIFIOrchestrator:
+    """Get the shared orchestrator, initializing it on first use."""
+    global orchestrator
+    if orchestrator is None:
+        with _orchestrator_lock:
+            if orchestrator is None:
+                orchestrator = initialize_orchestrator()
+    return orchestrator
 
 @app.route('/enhance', methods=['POST'])
 def enhance_standard():
@@ -74,9 +147,9 @@ def enhance_standard():
     
     Returns the enhanced standard text and an audit trail of the process.
     """
-    global orchestrator
-    
-    if not orchestrator:
+    try:
+        orchestrator = get_orchestrator()
+    except Exception:
         logger.error("Orchestrator not initialized")
         return jsonify({"error": "Server not properly initialized"}), 500
     
@@ -88,22 +161,27 @@ def enhance_standard():
         return jsonify({"error": "Standard text cannot be empty"}), 400
     
     standard_text = data['standard_text']
-    max_retries = data.get('max_retries', orchestrator.max_retries)
-    default_quality = data.get('default_quality', orchestrator.default_quality_score)
+    # None keeps the orchestrator's own setting
+    max_retries = data.get('max_retries')
+    default_quality = data.get('default_quality')
     
     logger.info("Received enhancement request")
     logger.info(f"Input text length: {len(standard_text)} characters")
     
-    # Update orchestrator configuration if provided in the request
-    if max_retries != orchestrator.max_retries:
-        orchestrator.max_retries = max_retries
-    
-    if default_quality != orchestrator.default_quality_score:
-        orchestrator.default_quality_score = default_quality
+    if data.get('stream'):
+        return app.response_class(
+            _stream_enhancement(orchestrator, standard_text, max_retries, default_quality),
+            mimetype="application/x-ndjson"
+        )
     
     try:
-        # Process the standard text
-        result = orchestrator.process(standard_text)
+        # Process the standard text; the request's settings only apply to
+        # this run, so concurrent requests can't change each other's
+        result = orchestrator.process(
+            standard_text,
+            max_retries=max_retries,
+            default_quality_score=default_quality
+        )
         
         # Prepare the response
         response = {
@@ -118,6 +196,52 @@ def enhance_standard():
         logger.error(f"Error enhancing standard: {str(e)}", exc_info=True)
         return jsonify({"error": f"Error processing standard: {str(e)}"}), 500
 
+def _stream_enhancement(
+    orchestrator: AAOIFIOrchestrator,
+    standard_text: str,
+    max_retries: Optional[int],
+    default_quality: Optional[int]
+) -> Iterator[bytes]:
+    """
+    Run the pipeline in the background and yield its progress as NDJSON.
+    
+    Each line is an event: "token" events carry chunks of the enhanced text
+    as they are generated, a "restart" event means the stage is retried and
+    its tokens so far should be discarded, and the stream ends with a
+    "result" event holding the same fields as the buffered response, or an
+    "error" event.
+    """
+    events = queue.SimpleQueue()
+    
+    def on_token(stage: str, chunk: Optional[str]) -> None:
+        if chunk is None:
+            events.put({"event": "restart", "stage": stage})
+        else:
+            events.put({"event": "token", "stage": stage, "data": chunk})
+    
+    def run() -> None:
+        try:
+            result = orchestrator.process(
+                standard_text,
+                max_retries=max_retries,
+                default_quality_score=default_quality,
+                on_token=on_token
+            )
+            events.put({
+                "event": "result",
+                "enhanced_standard": result["final_output"],
+                "audit_trail": result["audit_trail"]
+            })
+            logger.info("Enhancement completed successfully")
+        except Exception as e:
+            logger.error(f"Error enhancing standard: {str(e)}", exc_info=True)
+            events.put({"event": "error", "error": f"Error processing standard: {str(e)}"})
+        events.put(None)
+    
+    threading.Thread(target=run, name="enhance-stream", daemon=True).start()
+    while (event := events.get()) is not None:
+        yield orjson.dumps(event) + b"\n"
+
 @app.route('/', methods=['GET'])
 def health_check():
     """
@@ -140,6 +264,9 @@ if __name__ == "__main__":
     # Run the Flask app with debug enabled in development
     debug_mode = os.getenv("FLASK_ENV", "production") == "development"
     
+    # Fail fast on a bad configuration instead of on the first request
+    get_orchestrator()
+    
     # Run the server
     logger.info(f"Starting server on port {port}, debug mode: {debug_mode}")
     app.run(host="0.0.0.0", port=port, debug=debug_mode)
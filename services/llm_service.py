@@ -3,13 +3,45 @@ Service for LLM operations using Google's Gemini API.
 """
 import os
 import json
+import functools
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+import orjson
+from typing import Callable, Dict, Any, List, Mapping, Optional, Tuple
 from utils.gemini_client import GeminiClient
 from utils.rag_system import RAGSystem
+from pipeline.tools.llm_cache import LLMCache
+from pipeline.utils.helpers import extract_json_block
 
 logger = logging.getLogger(__name__)
 
+# Static system messages, so every call sends the same prompt prefix
+_SYS_ENHANCER = (
+    "You are a skilled financial standards editor. Your task is to enhance the given text "
+    "according to the specified criteria while preserving the original meaning and intent. "
+    "Focus on clarity, precision, and consistency."
+)
+_SYS_QUALITY = (
+    "You are a financial standards quality analyzer. Evaluate the given text against the "
+    "specified criteria and provide scores and detailed feedback."
+)
+_SYS_QUALITY_BATCH = (
+    "You are a financial standards quality analyzer. Evaluate each given text against "
+    "its specified criteria and provide an overall score for each evaluation."
+)
+
+@functools.lru_cache(maxsize=64)
+def _frozen_criteria_json(items: Tuple[Tuple[str, Any], ...]) -> str:
+    return json.dumps(dict(items))
+
+def _criteria_json(criteria: Mapping[str, Any]) -> str:
+    """Serialize criteria for a prompt, once per distinct set of criteria."""
+    items = tuple(criteria.items())
+    try:
+        return _frozen_criteria_json(items)
+    except TypeError:
+        # Unhashable values (e.g. nested lists) can't be memoized
+        return json.dumps(dict(items))
+
 class LLMService:
     """Service for handling LLM operations with Gemini."""
     
@@ -17,7 +49,8 @@ class LLMService:
         self, 
         gemini_client: Optional[GeminiClient] = None,
         use_rag: bool = True,
-        rag_data_dir: Optional[str] = "data"
+        rag_data_dir: Optional[str] = "data",
+        cache: Optional[LLMCache] = None
     ):
         """
         Initialize LLM service.
@@ -26,8 +59,10 @@ class LLMService:
             gemini_client: Optional pre-configured Gemini client
             use_rag: Whether to use RAG system (True by default)
             rag_data_dir: Directory containing PDF documents for RAG
+            cache: Cache of completions for repeated prompts, in-process by default
         """
         self.client = gemini_client or GeminiClient()
+        self.cache = cache if cache is not None else LLMCache()
         self.has_rag = False
         
         # Initialize RAG system if enabled
@@ -45,26 +80,28 @@ class LLMService:
         else:
             logger.info("RAG system disabled by configuration")
         
-    def enhance_text(self, text: str, criteria: Dict[str, Any]) -> str:
+    def enhance_text(
+        self,
+        text: str,
+        criteria: Mapping[str, Any],
+        documents: Optional[List[Dict[str, Any]]] = None,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> str:
         """
         Enhance text according to specified criteria.
         
         Args:
             text: Text to enhance
             criteria: Enhancement criteria
+            documents: Already retrieved RAG documents to reuse
+            on_token: Optional callback for each chunk of streamed text
             
         Returns:
             Enhanced text
         """
-        system_message = """
-        You are a skilled financial standards editor. Your task is to enhance the given text
-        according to the specified criteria while preserving the original meaning and intent.
-        Focus on clarity, precision, and consistency.
-        """
-        
         user_message = f"""
         Please enhance the following text according to these criteria:
-        {json.dumps(criteria)}
+        {_criteria_json(criteria)}
         
         Text to enhance:
         {text}
@@ -74,25 +111,26 @@ class LLMService:
         if self.has_rag:
             logger.info("Using RAG system for text enhancement")
             
-            # Get relevant chunks for logging
-            query = "AAOIFI standards enhancement best practices"
-            relevant_docs = self.rag_system.retrieve(query, top_k=2)
-            logger.info(f"Retrieved {len(relevant_docs)} relevant document chunks for enhancement")
+            # Retrieve once; the same chunks are cited and used for generation
+            if documents is None:
+                relevant_docs = self.rag_system.retrieve(user_message)
+                logger.info(f"Retrieved {len(relevant_docs)} relevant document chunks for enhancement")
+            else:
+                relevant_docs = documents
             
             # Include the sources in the prompt
             sources_info = "\n\nThis enhancement is informed by AAOIFI standards documentation from: "
             sources_info += ", ".join([doc['source'] for doc in relevant_docs])
             
-            response = self.rag_system.generate_with_context(user_message, system_message)
+            response = self._generate(user_message, _SYS_ENHANCER, relevant_docs, on_token)
             
             # Append the sources information at the end of the enhanced text
             return response + sources_info
         else:
             logger.info("RAG system not available for text enhancement")
-            prompt = self.client.format_prompt(system_message, user_message)
-            return self.client.get_completion_text(prompt)
+            return self._generate(user_message, _SYS_ENHANCER, on_token=on_token)
         
-    def analyze_quality(self, text: str, criteria: Dict[str, Any]) -> Dict[str, Any]:
+    def analyze_quality(self, text: str, criteria: Mapping[str, Any]) -> Dict[str, Any]:
         """
         Analyze the quality of text according to criteria.
         
@@ -103,47 +141,164 @@ class LLMService:
         Returns:
             Analysis results including scores and feedback
         """
-        system_message = """
-        You are a financial standards quality analyzer. Evaluate the given text against the 
-        specified criteria and provide scores and detailed feedback.
-        """
-        
+        # The instructions lead and the text comes last, so calls with the
+        # same criteria share a prompt prefix
         user_message = f"""
-        Analyze the quality of the following text according to these criteria:
-        {json.dumps(criteria)}
-        
-        Text to analyze:
-        {text}
+        Analyze the quality of the text below according to these criteria:
+        {_criteria_json(criteria)}
         
         Provide your response as a JSON object with:
         1. "scores" - a dictionary mapping each criterion to a score (0-100)
         2. "overall_score" - the weighted average score
         3. "feedback" - detailed feedback for each criterion
         4. "improvements" - specific improvement recommendations
+        
+        Text to analyze:
+        {text}
         """
         
-        # Get response (using RAG if available)
-        if self.has_rag:
-            response = self.rag_system.generate_with_context(user_message, system_message)
-        else:
-            prompt = self.client.format_prompt(system_message, user_message)
-            response = self.client.get_completion_text(prompt)
+        # A prompt whose response recently failed to parse goes straight to
+        # the fallback instead of paying for another call
+        cache_key = self._cache_key(user_message, _SYS_QUALITY)
+        if self.cache.is_negative(cache_key):
+            logger.warning("Quality analysis failed recently for this text, using fallback")
+            return self._quality_fallback()
+        
+        # Only responses that parse are cached as results
+        response = self._generate(user_message, _SYS_QUALITY, cache_response=False)
         
         try:
-            # Extract the JSON part from the response
-            json_str = response
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                
-            return json.loads(json_str)
+            analysis = self._parse_json_response(response)
         except (json.JSONDecodeError, IndexError) as e:
             logger.warning(f"Failed to parse JSON from response: {str(e)}")
-            # Fallback: return basic structure
-            return {
-                "overall_score": 70,
-                "scores": {},
-                "feedback": "Failed to parse detailed feedback",
-                "improvements": ["Consider manual review"]
-            }
+            self.cache.put_negative(cache_key)
+            return self._quality_fallback()
+        
+        self.cache.put(cache_key, response)
+        return analysis
+    
+    @staticmethod
+    def _quality_fallback() -> Dict[str, Any]:
+        """Basic analysis returned when the model's response can't be parsed."""
+        return {
+            "overall_score": 70,
+            "scores": {},
+            "feedback": "Failed to parse detailed feedback",
+            "improvements": ["Consider manual review"]
+        }
+    
+    def analyze_quality_batch(
+        self,
+        items: List[Dict[str, Any]],
+        documents: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze the quality of several texts in a single LLM request.
+        
+        Args:
+            items: Dictionaries with a unique "label", the "text" to analyze
+                and its quality "criteria"
+            documents: Already retrieved RAG documents to reuse
+            
+        Returns:
+            Analysis results in the same order as items, with an
+            "overall_score" for each item the model scored
+        """
+        # Texts shared by several evaluations are only included once
+        text_ids: Dict[str, int] = {}
+        texts: List[str] = []
+        evaluations: List[str] = []
+        for item in items:
+            text_id = text_ids.get(item["text"])
+            if text_id is None:
+                text_id = text_ids[item["text"]] = len(texts) + 1
+                texts.append(f"Text {text_id}:\n{item['text']}")
+            evaluations.append(f'- "{item["label"]}": Text {text_id} against {_criteria_json(item["criteria"])}')
+        
+        labels = ", ".join(f'"{item["label"]}": <score>' for item in items)
+        evaluations_block = "\n".join(evaluations)
+        texts_block = "\n\n".join(texts)
+        user_message = f"""
+        Analyze the quality of the texts below for each of these evaluations:
+        {evaluations_block}
+        
+        Provide your response as a JSON object of the form {{"scores": {{{labels}}}}},
+        where each score is an integer from 0 to 100.
+        
+        {texts_block}
+        """
+        
+        # As in analyze_quality, a prompt whose response recently failed to
+        # parse gets no scores instead of another call
+        cache_key = self._cache_key(user_message, _SYS_QUALITY_BATCH, documents)
+        if self.cache.is_negative(cache_key):
+            logger.warning("Batched quality analysis failed recently for these texts, returning no scores")
+            return [{} for _ in items]
+        
+        # Only responses scoring every item are cached as results
+        response = self._generate(user_message, _SYS_QUALITY_BATCH, documents, cache_response=False)
+        
+        try:
+            scores = self._parse_json_response(response).get("scores", {})
+        except (json.JSONDecodeError, IndexError, AttributeError) as e:
+            logger.warning(f"Failed to parse JSON from batched response: {str(e)}")
+            self.cache.put_negative(cache_key)
+            return [{} for _ in items]
+        
+        results = []
+        for item in items:
+            score = scores.get(item["label"])
+            if isinstance(score, (int, float)):
+                results.append({"overall_score": int(score)})
+            else:
+                logger.warning(f"No quality score returned for {item['label']}")
+                results.append({})
+        if all(results):
+            self.cache.put(cache_key, response)
+        return results
+    
+    def _generate(
+        self,
+        user_message: str,
+        system_message: str,
+        documents: Optional[List[Dict[str, Any]]] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+        cache_response: bool = True
+    ) -> str:
+        """Get a completion, using RAG if available and the cache for repeated prompts."""
+        cache_key = self._cache_key(user_message, system_message, documents)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info("Using cached completion")
+            if on_token is not None:
+                on_token(cached)
+            return cached
+        
+        if self.has_rag:
+            response = self.rag_system.generate_with_context(
+                user_message, system_message, documents=documents, on_token=on_token
+            )
+        else:
+            prompt = self.client.format_prompt(system_message, user_message)
+            response = self.client.get_completion_text(prompt, on_token=on_token)
+        
+        if response and cache_response:
+            self.cache.put(cache_key, response)
+        return response
+    
+    def _cache_key(
+        self,
+        user_message: str,
+        system_message: str,
+        documents: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Build the cache key for a completion request."""
+        doc_texts = [doc["text"] for doc in documents] if documents else []
+        return self.cache.key(self.client, (self.has_rag, system_message, user_message, doc_texts))
+    
+    @staticmethod
+    def _parse_json_response(response: str) -> Any:
+        """Extract and parse the JSON part of a response."""
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers
+        # keep catching the latter
+        return orjson.loads(extract_json_block(response))
@@ -8,17 +8,28 @@ import sys
 import json
 import logging
 import argparse
+import asyncio
 import tempfile
 import requests
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
+
+# Tests run offline, so RAG uses hash-based embeddings instead of the API
+os.environ.setdefault("USE_FAKE_EMBEDDINGS", "true")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('test')
 
 # Import system components
-from pipeline.orchestrator import AAOIFIOrchestrator
+from langchain_community.chat_models.fake import FakeListChatModel
+from pipeline.agents.enhancer import Enhancer
+from pipeline.knowledge_retrieval import retriever
+from pipeline.models.models import KnowledgeRequest
+from pipeline.utils.helpers import extract_sections
+from pipeline.orchestrator import AAOIFIOrchestrator, PipelineResult, _CircuitBreaker
+from pipeline.tools.llm_cache import DiskBackend, LLMCache
+from services.llm_service import LLMService
 from utils.gemini_client import GeminiClient
 from utils.rag_system import RAGSystem
 from utils.pdf_processor import PDFProcessor
@@ -66,6 +77,26 @@ The IFI purchases a commodity for $10,000 and sells it for £7,700 to be paid af
 This standard is effective from January 1, 2023.
 """
 
+class FakeLLMClient:
+    """Stand-in for GeminiClient that answers prompts with a function and records them."""
+    
+    model_name = "fake-model"
+    temperature = 0
+    
+    def __init__(self, respond=None):
+        self.respond = respond or (lambda prompt: "Response text")
+        self.prompts = []
+    
+    def format_prompt(self, system_message, user_message):
+        return f"{system_message}\n\n{user_message}"
+    
+    def get_completion_text(self, prompt, on_token=None, **kwargs):
+        self.prompts.append(prompt)
+        text = self.respond(prompt)
+        if on_token is not None:
+            on_token(text)
+        return text
+
 class TestAAOIFIEnhancementSystem(unittest.TestCase):
     """Test cases for the AAOIFI Standards Enhancement System."""
     
@@ -80,6 +111,7 @@ class TestAAOIFIEnhancementSystem(unittest.TestCase):
         
         # Create a mock Gemini client for testing
         self.gemini_client = MagicMock(spec=GeminiClient)
+        self.gemini_client.model_name = "gemini-1.5-pro"
         self.gemini_client.get_completion_text.return_value = "Enhanced text"
         self.gemini_client.format_prompt.return_value = "Formatted prompt"
         
@@ -115,17 +147,20 @@ class TestAAOIFIEnhancementSystem(unittest.TestCase):
     
     def test_rag_integration(self):
         """Test RAG integration."""
-        # Create a simple PDF for testing RAG
+        # Create a simple PDF for testing RAG; it goes in this test's own
+        # directory so tests running in parallel never see a half-built index
         try:
             from reportlab.pdfgen import canvas
-            pdf_path = os.path.join(self.data_dir, "test_doc.pdf")
+            rag_dir = os.path.join(self.temp_dir, "data")
+            os.makedirs(rag_dir)
+            pdf_path = os.path.join(rag_dir, "test_doc.pdf")
             c = canvas.Canvas(pdf_path)
             c.drawString(100, 750, "This is a test document for RAG integration.")
             c.drawString(100, 730, "It contains information about AAOIFI standards.")
             c.save()
             
             # Test PDF processor
-            pdf_processor = PDFProcessor(self.data_dir)
+            pdf_processor = PDFProcessor(rag_dir)
             chunks = pdf_processor.process_all_documents(chunk_size=100)
             
             self.assertTrue(len(chunks) > 0)
@@ -133,7 +168,7 @@ class TestAAOIFIEnhancementSystem(unittest.TestCase):
             
             # Test RAG system with integration
             with patch.dict(os.environ, {"GEMINI_API_KEY": "test_key"}):
-                rag_system = RAGSystem(self.gemini_client, self.data_dir)
+                rag_system = RAGSystem(self.gemini_client, rag_dir)
                 results = rag_system.retrieve("AAOIFI standards", top_k=1)
                 
                 # Should at least return one result from our test PDF
@@ -205,6 +240,498 @@ class TestAAOIFIEnhancementSystem(unittest.TestCase):
             logger.warning("Flask server not running, skipping API tests")
             self.skipTest("Flask server not running")
 
+class TestEnhancerFallback(unittest.TestCase):
+    """Tests for the enhancer's handling of unparsable LLM responses."""
+    
+    def test_parse_failure_keeps_reviewed_text(self):
+        """Test that a response nothing can parse falls back to the input text."""
+        enhancer = Enhancer(FakeListChatModel(responses=["not json at all"]), default_quality_score=55)
+        state = {"reviewed_text": "Original text", "quality_scores": {}, "knowledge_requests": []}
+        
+        with patch.object(Enhancer, "_parse_unstructured_response", side_effect=ValueError("boom")):
+            result = enhancer._process(state)
+        
+        self.assertEqual(result["enhanced_text"], "Original text")
+        self.assertEqual(result["quality_scores"]["enhancer"], 55)
+        self.assertIn("boom", result["notes"])
+
+class TestStageCache(unittest.TestCase):
+    """Tests for the orchestrator's cache of stage results."""
+    
+    def test_repeated_stage_is_served_from_cache(self):
+        """Test that a stage with the same inputs only calls the LLM once."""
+        client = FakeLLMClient()
+        orchestrator = AAOIFIOrchestrator(llm_client=client, use_rag=False)
+        
+        first = orchestrator._review_standard("structured", None)
+        second = orchestrator._review_standard("structured", None)
+        
+        self.assertEqual(first, second)
+        self.assertEqual(len(client.prompts), 1)
+        orchestrator._review_standard("other structured", None)
+        self.assertEqual(len(client.prompts), 2)
+    
+    def test_cache_is_per_orchestrator(self):
+        """Test that orchestrators with the same model don't share results."""
+        first = AAOIFIOrchestrator(llm_client=FakeLLMClient(lambda prompt: "first"), use_rag=False)
+        second = AAOIFIOrchestrator(llm_client=FakeLLMClient(lambda prompt: "second"), use_rag=False)
+        
+        self.assertEqual(first._review_standard("structured", None), "first")
+        self.assertEqual(second._review_standard("structured", None), "second")
+    
+    def test_cache_key_includes_default_quality_score(self):
+        """Test that copies with another default quality score don't reuse results."""
+        client = FakeLLMClient()
+        orchestrator = AAOIFIOrchestrator(llm_client=client, use_rag=False, default_quality_score=60)
+        
+        orchestrator._review_standard("structured", None)
+        orchestrator.with_settings(default_quality_score=80)._review_standard("structured", None)
+        orchestrator.with_settings(max_retries=3)._review_standard("structured", None)
+        
+        self.assertEqual(len(client.prompts), 2)
+    
+    def test_parse_fallback_is_not_cached(self):
+        """Test that a standard whose parse failed is parsed again next time."""
+        client = FakeLLMClient(lambda prompt: "not a structure")
+        orchestrator = AAOIFIOrchestrator(llm_client=client, use_rag=False)
+        
+        self.assertEqual(orchestrator._parse_standard("Standard")["title"], "Untitled Standard")
+        client.respond = lambda prompt: '{"title": "T", "sections": ["S"], "definitions": {}}'
+        self.assertEqual(orchestrator._parse_standard("Standard")["sections"], ["S"])
+
+class TestQualityFallback(unittest.TestCase):
+    """Tests for the default scores used when quality assessment fails."""
+    
+    ITEMS = [("enhancer", "Enhanced text", {"clarity": "Content is clear"})]
+    
+    def test_failed_assessment_is_not_cached(self):
+        """Test that default scores after a failure are replaced by real scores on the next call."""
+        orchestrator = AAOIFIOrchestrator(llm_client=FakeLLMClient(), use_rag=False, default_quality_score=65)
+        
+        with patch.object(
+            orchestrator.llm_service, "analyze_quality_batch",
+            side_effect=[ValueError("bad response"), [{"overall_score": 90}]]
+        ):
+            self.assertEqual(orchestrator._assess_quality_batch(self.ITEMS, None), {"enhancer": 65})
+            self.assertEqual(orchestrator._assess_quality_batch(self.ITEMS, None), {"enhancer": 90})
+    
+    def test_missing_scores_are_not_cached(self):
+        """Test that a response without a score for an item is asked again."""
+        orchestrator = AAOIFIOrchestrator(llm_client=FakeLLMClient(), use_rag=False, default_quality_score=65)
+        
+        with patch.object(
+            orchestrator.llm_service, "analyze_quality_batch",
+            side_effect=[[{}], [{"overall_score": 90}], [{"overall_score": 50}]]
+        ) as analyze:
+            self.assertEqual(orchestrator._assess_quality_batch(self.ITEMS, None), {"enhancer": 65})
+            self.assertEqual(orchestrator._assess_quality_batch(self.ITEMS, None), {"enhancer": 90})
+            self.assertEqual(orchestrator._assess_quality_batch(self.ITEMS, None), {"enhancer": 90})
+            self.assertEqual(analyze.call_count, 2)
+
+class TestRunSettings(unittest.TestCase):
+    """Tests for settings passed to a single process call."""
+    
+    def test_each_call_sees_its_own_default_quality_score(self):
+        """Test that default scores follow the call's default_quality_score, with no reuse across calls."""
+        # Quality requests get no scores back, so every stage falls back to the default
+        client = FakeLLMClient(lambda prompt: "no scores here")
+        orchestrator = AAOIFIOrchestrator(llm_client=client, use_rag=False, default_quality_score=70)
+        
+        low = orchestrator.process(SAMPLE_STANDARD, default_quality_score=60)
+        high = orchestrator.process(SAMPLE_STANDARD, default_quality_score=80)
+        default = orchestrator.process(SAMPLE_STANDARD)
+        
+        self.assertEqual(set(low["quality_scores"].values()), {60})
+        self.assertEqual(set(high["quality_scores"].values()), {80})
+        self.assertEqual(set(default["quality_scores"].values()), {70})
+        self.assertEqual(orchestrator.default_quality_score, 70)
+    
+    def test_fallback_stages_mark_result_degraded(self):
+        """Test that a run only counts as clean when no stage fell back."""
+        scores = '{"scores": {"preprocessor": 80, "reviewer": 80, "enhancer": 80, "validator": 80}}'
+        structure = '{"title": "T", "sections": ["S"], "definitions": {}}'
+        client = FakeLLMClient(lambda prompt: scores if '"scores"' in prompt else structure)
+        clean = AAOIFIOrchestrator(llm_client=client, use_rag=False).process(SAMPLE_STANDARD)
+        self.assertEqual(clean.degraded, frozenset())
+        
+        client = FakeLLMClient(lambda prompt: "not json")
+        degraded = AAOIFIOrchestrator(llm_client=client, use_rag=False).process(SAMPLE_STANDARD)
+        self.assertEqual(degraded.degraded, {"parse", "quality"})
+
+class TestSyncEntryPoints(unittest.TestCase):
+    """Tests for the blocking entry points."""
+    
+    def test_process_inside_running_loop(self):
+        """Test that process works when called from a coroutine."""
+        orchestrator = AAOIFIOrchestrator(llm_client=FakeLLMClient(), use_rag=False)
+        
+        async def caller():
+            return orchestrator.process(SAMPLE_STANDARD), orchestrator.process_many([SAMPLE_STANDARD])
+        
+        result, results = asyncio.run(caller())
+        self.assertEqual(result["final_output"], "Response text")
+        self.assertEqual(len(results), 1)
+
+class TestStreamingRetry(unittest.TestCase):
+    """Tests for streamed stages that are retried."""
+    
+    def test_retry_signals_restart_before_streaming_again(self):
+        """Test that tokens from a failed attempt are followed by a restart marker."""
+        class FlakyClient(FakeLLMClient):
+            def get_completion_text(self, prompt, on_token=None, **kwargs):
+                if not self.prompts:
+                    self.prompts.append(prompt)
+                    on_token("partial")
+                    raise ConnectionError("dropped")
+                return super().get_completion_text(prompt, on_token, **kwargs)
+        
+        events = []
+        orchestrator = AAOIFIOrchestrator(
+            llm_client=FlakyClient(), use_rag=False,
+            on_token=lambda stage, chunk: events.append((stage, chunk))
+        )
+        with patch("pipeline.orchestrator.time.sleep"):
+            result = orchestrator._call_stage(
+                "enhance", set(), set(), "fallback",
+                orchestrator._enhance_standard, "structured", {"clarity": "Content is clear"}, None
+            )
+        
+        self.assertEqual(result, "Response text")
+        self.assertEqual(events, [("enhancer", "partial"), ("enhancer", None), ("enhancer", "Response text")])
+
+class TestExtractSections(unittest.TestCase):
+    """Tests for splitting markdown text into sections."""
+    
+    def test_headings_without_space_and_indented(self):
+        """Test that '#Title' and indented headings open sections like '# Title' does."""
+        self.assertEqual(
+            extract_sections("#Title\ncontent\n## Sub\nmore"),
+            {"Title": "content", "Sub": "more"}
+        )
+        self.assertEqual(
+            extract_sections("intro\n  ## Indented\nbody\n\t#Tab\nlast"),
+            {"Indented": "body", "Tab": "last"}
+        )
+    
+    def test_empty_and_trailing_sections(self):
+        """Test that consecutive headings and a heading on the last line keep their own sections."""
+        self.assertEqual(
+            extract_sections("# One\n# Two\ntext\n# Three"),
+            {"One": "", "Two": "text", "Three": ""}
+        )
+
+class TestKnowledgeSummaryCache(unittest.TestCase):
+    """Tests for the knowledge retriever's cache of search summaries."""
+    
+    def test_failed_search_summary_is_not_cached(self):
+        """Test that a summary of a failed search is made again on the next request."""
+        llm = MagicMock(model_name="fake-model")
+        llm.invoke.return_value = MagicMock(content="error summary")
+        llm.ainvoke = AsyncMock(return_value=MagicMock(content="second summary"))
+        with patch.dict(os.environ, {"SERPAPI_API_KEY": ""}), \
+                patch.object(retriever, "_get_llm", return_value=llm):
+            knowledge_retriever = retriever.KnowledgeRetriever()
+        request = KnowledgeRequest(requester="enhancer", query="Murabaha ownership", context="Test")
+        
+        with patch.dict(retriever._SUMMARY_CACHE, clear=True):
+            first = knowledge_retriever._process_request(request)
+            second = asyncio.run(knowledge_retriever._aprocess_request(request))
+            self.assertEqual(len(retriever._SUMMARY_CACHE), 0)
+        
+        self.assertEqual(first.content, "error summary")
+        self.assertEqual(second.content, "second summary")
+
+class TestHighConfidenceSkip(unittest.TestCase):
+    """Tests for skipping validation when every quality score is high."""
+    
+    def test_high_scores_skip_validation(self):
+        """Test that real scores at the threshold skip the validator call."""
+        scores = '{"scores": {"preprocessor": 85, "reviewer": 85, "enhancer": 85, "validator": 85}}'
+        client = FakeLLMClient(lambda prompt: scores if '"scores"' in prompt else "Response text")
+        orchestrator = AAOIFIOrchestrator(llm_client=client, use_rag=False, high_confidence_threshold=80)
+        
+        result = orchestrator.process(SAMPLE_STANDARD)
+        self.assertIn("Validation skipped: every quality score was at least 80", result["audit_trail"])
+    
+    def test_fallback_scores_never_skip_validation(self):
+        """Test that default scores after an unparsable assessment still get validated."""
+        client = FakeLLMClient(lambda prompt: "not json")
+        orchestrator = AAOIFIOrchestrator(
+            llm_client=client, use_rag=False, default_quality_score=90, high_confidence_threshold=80
+        )
+        
+        result = orchestrator.process(SAMPLE_STANDARD)
+        self.assertEqual(set(result["quality_scores"].values()), {90})
+        self.assertNotIn("Validation skipped", result["audit_trail"])
+        self.assertIn("Validation notes: not json", result["audit_trail"])
+
+class TestStreamingCacheHit(unittest.TestCase):
+    """Tests for streaming a stage served from the stage cache."""
+    
+    def test_cached_enhancement_streams_as_one_chunk(self):
+        """Test that a repeated run still streams the enhanced text."""
+        orchestrator = AAOIFIOrchestrator(llm_client=FakeLLMClient(), use_rag=False)
+        
+        first, second = [], []
+        orchestrator.process(SAMPLE_STANDARD, on_token=lambda stage, chunk: first.append((stage, chunk)))
+        orchestrator.process(SAMPLE_STANDARD, on_token=lambda stage, chunk: second.append((stage, chunk)))
+        
+        self.assertEqual(first, [("enhancer", "Response text")])
+        self.assertEqual(second, [("enhancer", "Response text")])
+
+class TestQualityNegativeCache(unittest.TestCase):
+    """Tests for the short-lived cache of unparsable quality responses."""
+    
+    ITEMS = [{"label": "enhancer", "text": "Enhanced text", "criteria": {"clarity": "Content is clear"}}]
+    
+    def test_unparsable_batch_response_is_not_requested_again(self):
+        """Test that a batch whose response failed to parse returns no scores without another call."""
+        client = FakeLLMClient(lambda prompt: "not json")
+        service = LLMService(client, use_rag=False)
+        
+        self.assertEqual(service.analyze_quality_batch(self.ITEMS), [{}])
+        self.assertEqual(service.analyze_quality_batch(self.ITEMS), [{}])
+        self.assertEqual(len(client.prompts), 1)
+        self.assertEqual(service.cache.stats["negative_hits"], 1)
+    
+    def test_failure_expires_and_good_response_is_cached(self):
+        """Test that the prompt is retried once the failure expires, and a scored response is reused."""
+        client = FakeLLMClient(lambda prompt: "not json")
+        service = LLMService(client, use_rag=False, cache=LLMCache(negative_ttl=0))
+        service.analyze_quality_batch(self.ITEMS)
+        
+        client.respond = lambda prompt: '{"scores": {"enhancer": 88}}'
+        self.assertEqual(service.analyze_quality_batch(self.ITEMS), [{"overall_score": 88}])
+        self.assertEqual(service.analyze_quality_batch(self.ITEMS), [{"overall_score": 88}])
+        self.assertEqual(len(client.prompts), 2)
+    
+    def test_partially_scored_response_is_not_cached(self):
+        """Test that a response missing an item's score is requested again."""
+        client = FakeLLMClient(lambda prompt: '{"scores": {}}')
+        service = LLMService(client, use_rag=False)
+        
+        service.analyze_quality_batch(self.ITEMS)
+        service.analyze_quality_batch(self.ITEMS)
+        self.assertEqual(len(client.prompts), 2)
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for the per-stage circuit breaker."""
+    
+    def test_opens_after_consecutive_failures_and_half_opens_after_timeout(self):
+        """Test the closed, open and half-open transitions."""
+        breaker = _CircuitBreaker(fail_max=2, reset_timeout=10)
+        with patch("pipeline.orchestrator.time.monotonic", return_value=100.0) as now:
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+            
+            now.return_value = 111.0
+            self.assertTrue(breaker.allow())
+            # A failed trial call reopens the breaker at once
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+    
+    def test_success_resets_failure_count(self):
+        """Test that only consecutive failures open the breaker."""
+        breaker = _CircuitBreaker(fail_max=2, reset_timeout=10)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+    
+    def test_open_breaker_skips_stage(self):
+        """Test that a stage behind an open breaker returns its fallback without calling it."""
+        orchestrator = AAOIFIOrchestrator(llm_client=FakeLLMClient(), use_rag=False)
+        orchestrator._breakers["review"] = _CircuitBreaker(fail_max=1)
+        orchestrator._breakers["review"].record_failure()
+        skipped, degraded = set(), set()
+        stage = MagicMock()
+        
+        self.assertEqual(orchestrator._call_stage("review", skipped, degraded, "Review skipped.", stage), "Review skipped.")
+        stage.assert_not_called()
+        self.assertEqual(skipped, {"review"})
+        self.assertEqual(degraded, {"review"})
+
+class TestPipelineResult(unittest.TestCase):
+    """Tests for the mapping interface of pipeline results."""
+    
+    def test_reads_like_the_result_dictionary(self):
+        """Test that a result has the old dictionary's keys and a rendered audit trail."""
+        result = AAOIFIOrchestrator(llm_client=FakeLLMClient(), use_rag=False).process(SAMPLE_STANDARD)
+        
+        self.assertIsInstance(result, PipelineResult)
+        self.assertEqual(
+            set(dict(result)),
+            {"final_output", "audit_trail", "quality_scores", "start_time", "completion_time"}
+        )
+        self.assertNotIn("average_quality", result)
+        with self.assertRaises(KeyError):
+            result["audit_entries"]
+        for stage in ("Preprocessor", "Reviewer", "Enhancer", "Validator"):
+            self.assertIn(stage, result["audit_trail"])
+        self.assertIs(result.audit_trail, result["audit_trail"])
+        self.assertEqual(result.average_quality, sum(result["quality_scores"].values()) / 4)
+
+class TestLLMCacheBackends(unittest.TestCase):
+    """Tests for the LLM cache's storage backends."""
+    
+    def test_disk_backend_survives_restart_and_expires(self):
+        """Test that entries are shared by backends on the same directory until they expire."""
+        with tempfile.TemporaryDirectory() as directory:
+            LLMCache(DiskBackend(directory)).put("key", "value")
+            self.assertEqual(LLMCache(DiskBackend(directory)).get("key"), "value")
+            
+            LLMCache(DiskBackend(directory), ttl=-1).put("old", "value")
+            self.assertIsNone(DiskBackend(directory).get("old"))
+    
+    def test_disk_backend_deletes_expired_and_excess_entries(self):
+        """Test that expired files are deleted on read and the oldest beyond the cap on a sweep."""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = DiskBackend(directory, max_entries=10)
+            backend.set("old", "value", -1)
+            self.assertIsNone(backend.get("old"))
+            self.assertEqual(os.listdir(directory), [])
+            
+            for i in range(20):
+                backend.set(f"key{i}", i, 60)
+                os.utime(os.path.join(directory, f"key{i}.json"), (1000 + i, 1000 + i))
+            DiskBackend(directory, max_entries=10)
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                sorted(f"key{i}.json" for i in range(10, 20))
+            )
+            
+            # Writes sweep the directory on their own every so often
+            backend = DiskBackend(directory, max_entries=10)
+            for i in range(64):
+                backend.set(f"new{i}", i, 60)
+            self.assertEqual(len(os.listdir(directory)), 10)
+    
+    def test_disk_backend_skips_unserializable_values(self):
+        """Test that a value JSON can't hold is not stored and doesn't raise."""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = DiskBackend(directory)
+            backend.set("key", object(), 60)
+            self.assertIsNone(backend.get("key"))
+            self.assertEqual(os.listdir(directory), [])
+    
+    def test_negative_entries_are_kept_apart_and_expire(self):
+        """Test that a recorded failure is never returned as a result and expires on its own TTL."""
+        cache = LLMCache(negative_ttl=60)
+        cache.put_negative("key")
+        self.assertTrue(cache.is_negative("key"))
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(cache.stats, {"hits": 0, "misses": 1, "negative_hits": 1})
+        
+        expired = LLMCache(negative_ttl=-1)
+        expired.put_negative("key")
+        self.assertFalse(expired.is_negative("key"))
+
+class TestChunkText(unittest.TestCase):
+    """Tests for the sliding-window chunking of PDF text."""
+    
+    def test_windows_overlap_and_reach_the_end(self):
+        """Test that windows advance by the size minus the overlap and cover every word."""
+        words = [f"w{i}" for i in range(12)]
+        # 25 characters make 5 words and 10 characters overlap 2 of them
+        chunks = PDFProcessor("unused").chunk_text(" ".join(words), chunk_size=25, overlap=10)
+        
+        self.assertEqual(
+            [chunk["text"].split() for chunk in chunks],
+            [words[0:5], words[3:8], words[6:11], words[9:12]]
+        )
+        self.assertEqual([chunk["size"] for chunk in chunks], [len(chunk["text"]) for chunk in chunks])
+    
+    def test_short_and_empty_texts(self):
+        """Test that a text within one window is one chunk and an empty text is none."""
+        processor = PDFProcessor("unused")
+        self.assertEqual(processor.chunk_text("one two", chunk_size=25, overlap=10), [{"text": "one two", "size": 7}])
+        self.assertEqual(processor.chunk_text("   "), [])
+        # An overlap as large as the window still moves forward
+        self.assertEqual(len(processor.chunk_text("a b c d", chunk_size=10, overlap=50)), 3)
+
+class TestIncrementalIndex(unittest.TestCase):
+    """Tests for rebuilding the RAG vector store when PDFs change."""
+    
+    @staticmethod
+    def _chunks(processor, chunk_size=1000, overlap=200, pdf_files=None):
+        return [
+            {"text": f"Text of {name}", "size": 12, "source": name, "chunk_id": f"{name}_0"}
+            for name in pdf_files
+        ]
+    
+    def test_only_changed_pdfs_are_embedded_again(self):
+        """Test that added and changed PDFs are embedded and deleted ones dropped."""
+        with tempfile.TemporaryDirectory() as directory, patch.object(
+            PDFProcessor, "process_all_documents", autospec=True, side_effect=self._chunks
+        ) as process:
+            def write(name, content):
+                path = os.path.join(directory, name)
+                with open(path, "wb") as f:
+                    f.write(content)
+                # Newer than any vector store saved so far
+                later = os.path.getmtime(path) + len(process.call_args_list) + 10
+                os.utime(path, (later, later))
+            
+            write("a.pdf", b"first")
+            write("b.pdf", b"second")
+            rag = RAGSystem(MagicMock(), pdf_directory=directory)
+            self.assertEqual(sorted(process.call_args.kwargs["pdf_files"]), ["a.pdf", "b.pdf"])
+            
+            write("b.pdf", b"second, edited")
+            rag = RAGSystem(MagicMock(), pdf_directory=directory)
+            self.assertEqual(process.call_args.kwargs["pdf_files"], ["b.pdf"])
+            self.assertEqual(sorted(doc["source"] for doc in rag.vector_store.documents), ["a.pdf", "b.pdf"])
+            
+            os.remove(os.path.join(directory, "a.pdf"))
+            rag = RAGSystem(MagicMock(), pdf_directory=directory)
+            self.assertEqual(process.call_count, 2)
+            self.assertEqual([doc["source"] for doc in rag.vector_store.documents], ["b.pdf"])
+            self.assertEqual(len(rag.vector_store.embeddings), 1)
+            self.assertEqual(set(rag.vector_store.file_hashes), {"b.pdf"})
+            
+            rag = RAGSystem(MagicMock(), pdf_directory=directory)
+            self.assertEqual(process.call_count, 2)
+
+class TestBatchedPaths(unittest.TestCase):
+    """Tests for the requests and runs that cover several items at once."""
+    
+    def test_shared_text_is_sent_once(self):
+        """Test that evaluations of the same text share it in the batched prompt."""
+        client = FakeLLMClient(lambda prompt: '{"scores": {"first": 70, "second": 80}}')
+        service = LLMService(client, use_rag=False)
+        
+        results = service.analyze_quality_batch([
+            {"label": "first", "text": "Same text", "criteria": {"clarity": "Clear"}},
+            {"label": "second", "text": "Same text", "criteria": {"accuracy": "Accurate"}},
+        ])
+        
+        self.assertEqual(results, [{"overall_score": 70}, {"overall_score": 80}])
+        self.assertEqual(len(client.prompts), 1)
+        self.assertEqual(client.prompts[0].count("Same text"), 1)
+        self.assertNotIn("Text 2", client.prompts[0])
+    
+    def test_process_many_keeps_order_and_can_return_exceptions(self):
+        """Test that results come back in input order and a failing standard can be isolated."""
+        client = FakeLLMClient(lambda prompt: "Response text")
+        orchestrator = AAOIFIOrchestrator(llm_client=client, use_rag=False)
+        
+        results = orchestrator.process_many([SAMPLE_STANDARD, "Second standard"], start_interval=0.01)
+        self.assertEqual([result.input_length for result in results], [len(SAMPLE_STANDARD), len("Second standard")])
+        
+        aprocess = orchestrator.aprocess
+        
+        async def fail_on_bad(standard_text):
+            if standard_text == "bad":
+                raise ValueError("bad")
+            return await aprocess(standard_text)
+        
+        with patch.object(orchestrator, "aprocess", side_effect=fail_on_bad):
+            results = orchestrator.process_many(["bad", SAMPLE_STANDARD], return_exceptions=True)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIsInstance(results[1], PipelineResult)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run tests for AAOIFI Standards Enhancement System')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
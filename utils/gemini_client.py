@@ -3,7 +3,9 @@ Utility for interacting with Google's Gemini API.
 """
 import os
 import logging
-from typing import Dict, Any, List, Optional
+import functools
+import threading
+from typing import Callable, Dict, Any, Iterator, List, Optional
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -12,22 +14,48 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# genai.configure() discards the SDK's cached clients and their open gRPC
+# channels, so it is only called again when the key actually changes
+_configured_api_key: Optional[str] = None
+_configure_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def _generative_model(model_name: str) -> genai.GenerativeModel:
+    """Get the process-wide model object for a model name."""
+    return genai.GenerativeModel(model_name=model_name)
+
 class GeminiClient:
-    """Client for interacting with Google's Gemini API."""
+    """
+    Client for interacting with Google's Gemini API.
     
-    def __init__(self):
+    Safe to share between threads: the model object holds no per-call state,
+    and every instance for a model shares it and the SDK's connection.
+    """
+    
+    def __init__(self, model_name: Optional[str] = None):
+        """
+        Initialize the client.
+        
+        Args:
+            model_name: The Gemini model to use, defaulting to GEMINI_MODEL
+        """
         self.api_key = os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set")
             
-        self.model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+        self.model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
         self.temperature = float(os.getenv("TEMPERATURE", 0.7))
         self.max_output_tokens = int(os.getenv("MAX_OUTPUT_TOKENS", 2048))
         self.top_p = float(os.getenv("TOP_P", 0.9))
         self.top_k = int(os.getenv("TOP_K", 40))
         
-        # Initialize Gemini client
-        genai.configure(api_key=self.api_key)
+        # Initialize Gemini client; every instance shares the SDK's
+        # process-wide HTTP/2 channel
+        global _configured_api_key
+        with _configure_lock:
+            if _configured_api_key != self.api_key:
+                genai.configure(api_key=self.api_key)
+                _configured_api_key = self.api_key
         
         # Set up generation config
         self.generation_config = {
@@ -38,7 +66,7 @@ class GeminiClient:
         }
         
         # Initialize the model
-        self.model = genai.GenerativeModel(model_name=self.model_name)
+        self.model = _generative_model(self.model_name)
         
     def get_completion(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """
@@ -92,19 +120,53 @@ class GeminiClient:
             logger.error(f"Error extracting text from Gemini API response: {str(e)}")
             return ""
             
-    def get_completion_text(self, prompt: str, **kwargs) -> str:
+    def stream_completion(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Stream a completion from Gemini API as it is generated.
+        
+        Args:
+            prompt: The prompt to complete
+            **kwargs: Additional parameters to pass to the API
+            
+        Yields:
+            Chunks of generated text
+        """
+        for chunk in self.get_completion(prompt, stream=True, **kwargs):
+            try:
+                text = chunk.text
+            except (AttributeError, IndexError, KeyError, ValueError):
+                # Chunks without text parts (e.g. safety metadata) carry nothing to yield
+                continue
+            if text:
+                yield text
+            
+    def get_completion_text(
+        self,
+        prompt: str,
+        on_token: Optional[Callable[[str], None]] = None,
+        **kwargs
+    ) -> str:
         """
         Get completion and extract text in one call.
         
         Args:
             prompt: The prompt to complete
+            on_token: Optional callback for each chunk of text; when given,
+                the completion is streamed so chunks arrive as generated
             **kwargs: Additional parameters to pass to the API
             
         Returns:
             Generated text
         """
-        response = self.get_completion(prompt, **kwargs)
-        return self.extract_text(response)
+        if on_token is None:
+            response = self.get_completion(prompt, **kwargs)
+            return self.extract_text(response)
+        
+        chunks = []
+        for text in self.stream_completion(prompt, **kwargs):
+            chunks.append(text)
+            on_token(text)
+        return "".join(chunks)
         
     def format_prompt(self, system_message: str, user_message: str) -> str:
         """
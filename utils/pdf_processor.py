@@ -3,12 +3,36 @@ Utility for processing PDFs and extracting text content.
 """
 import os
 import logging
-from typing import List, Dict, Any, Optional
-import PyPDF2
-import re
+import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional, Tuple
+import pypdfium2 as pdfium
 
 logger = logging.getLogger(__name__)
 
+# Rough average length of a word plus its separator, for converting
+# character budgets into word counts
+_CHARS_PER_WORD = 5
+
+def _extract_text(pdf_path: str) -> str:
+    """Extract the text of every page of a PDF; module-level so worker processes can run it."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        text = []
+        
+        for page in pdf:
+            textpage = page.get_textpage()
+            # PDFium ends lines with \r\n; chunking expects plain newlines
+            text.append(textpage.get_text_range().replace("\r\n", "\n"))
+            # PDFium handles are native memory, so release them page by page
+            textpage.close()
+            page.close()
+        
+        return "\n".join(text)
+    finally:
+        pdf.close()
+
 class PDFProcessor:
     """Class for extracting and processing text from PDF documents."""
     
@@ -22,26 +46,74 @@ class PDFProcessor:
         self.pdf_directory = pdf_directory
         self.processed_pdfs = {}
         
-    def load_all_pdfs(self) -> Dict[str, str]:
+    def list_pdfs(self) -> List[Tuple[str, str]]:
+        """
+        List the PDFs in the directory.
+        
+        Returns:
+            (filename, path) pairs for each PDF file
+        """
+        # DirEntry caches its type, so skipping directories costs no extra stat
+        with os.scandir(self.pdf_directory) as entries:
+            return [
+                (entry.name, entry.path) for entry in entries
+                if entry.name.lower().endswith('.pdf') and entry.is_file()
+            ]
+    
+    def load_all_pdfs(self, pdf_files: Optional[List[str]] = None) -> Dict[str, str]:
         """
         Load and extract text from all PDFs in the directory.
         
+        Args:
+            pdf_files: Filenames to load instead of every PDF
+        
         Returns:
             Dictionary mapping PDF filenames to extracted text
         """
-        pdf_files = [f for f in os.listdir(self.pdf_directory) if f.lower().endswith('.pdf')]
+        pdfs = self.list_pdfs()
+        if pdf_files is not None:
+            wanted = set(pdf_files)
+            pdfs = [(name, path) for name, path in pdfs if name in wanted]
+        pdf_files = [name for name, _ in pdfs]
+        pdf_paths = [path for _, path in pdfs]
         logger.info(f"Found {len(pdf_files)} PDF files in {self.pdf_directory}")
         
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(self.pdf_directory, pdf_file)
+        workers = min(len(pdf_paths), os.cpu_count() or 1)
+        if workers > 1:
+            # Text extraction is CPU-bound pure Python, so it runs in
+            # separate processes rather than threads. Workers are spawned,
+            # not forked: forking a threaded server (e.g. gunicorn gthread)
+            # can copy locks held by other threads and deadlock the child
             try:
-                self.processed_pdfs[pdf_file] = self.extract_text_from_pdf(pdf_path)
-                logger.info(f"Successfully extracted text from {pdf_file}")
-            except Exception as e:
-                logger.error(f"Error extracting text from {pdf_file}: {str(e)}")
+                with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                ) as executor:
+                    futures = [executor.submit(_extract_text, path) for path in pdf_paths]
+                    for pdf_file, future in zip(pdf_files, futures):
+                        self._store_text(pdf_file, future.result)
+                return self.processed_pdfs
+            except (BrokenProcessPool, OSError, RuntimeError) as e:
+                # E.g. spawned workers unable to re-import a script without
+                # a __main__ guard; extract the rest here instead
+                logger.warning(f"Parallel PDF extraction unavailable, extracting sequentially: {str(e)}")
+        
+        for pdf_file, pdf_path in zip(pdf_files, pdf_paths):
+            if pdf_file not in self.processed_pdfs:
+                self._store_text(pdf_file, lambda: self.extract_text_from_pdf(pdf_path))
         
         return self.processed_pdfs
     
+    def _store_text(self, pdf_file: str, extract) -> None:
+        """Record the text returned by extract(), logging instead of raising on failure."""
+        try:
+            self.processed_pdfs[pdf_file] = extract()
+            logger.info(f"Successfully extracted text from {pdf_file}")
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            logger.error(f"Error extracting text from {pdf_file}: {str(e)}")
+    
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """
         Extract text from a PDF file.
@@ -52,71 +124,67 @@ class PDFProcessor:
         Returns:
             Extracted text from the PDF
         """
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = []
-            
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                text.append(page.extract_text())
-            
-            return "\n".join(text)
+        return _extract_text(pdf_path)
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
         """
-        Split text into chunks based on paragraphs with optional overlapping.
+        Split text into overlapping chunks with a sliding window over its words.
         
         Args:
             text: Text to chunk
-            chunk_size: Maximum size of each chunk in characters
-            overlap: Number of characters to overlap between chunks
+            chunk_size: Approximate size of each chunk in characters
+            overlap: Approximate number of characters to overlap between chunks
             
         Returns:
             List of dictionaries containing chunks and metadata
         """
-        # Split by paragraphs (empty lines)
-        paragraphs = re.split(r'\n\s*\n', text)
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
-        
-        chunks = []
-        current_chunk = ""
-        
-        for paragraph in paragraphs:
-            # If adding this paragraph would exceed the chunk size, save current chunk
-            if len(current_chunk) + len(paragraph) > chunk_size and current_chunk:
-                chunks.append({"text": current_chunk, "size": len(current_chunk)})
-                # Keep overlap from the end of the current chunk
-                current_chunk = current_chunk[-overlap:] if overlap > 0 else ""
-            
-            # Add paragraph to current chunk
-            if current_chunk:
-                current_chunk += "\n\n" + paragraph
-            else:
-                current_chunk = paragraph
+        # Sizes are converted to word counts once, so the window moves by
+        # index and never re-slices the chunk strings
+        words = text.split()
+        if not words:
+            return []
+        chunk_words = max(1, chunk_size // _CHARS_PER_WORD)
+        overlap_words = min(max(0, overlap // _CHARS_PER_WORD), chunk_words - 1)
+        stride = chunk_words - overlap_words
         
-        # Add the last chunk if not empty
-        if current_chunk:
-            chunks.append({"text": current_chunk, "size": len(current_chunk)})
+        # A window is only needed while it reaches past the previous one
+        chunk_texts = [
+            " ".join(words[start:start + chunk_words])
+            for start in range(0, max(len(words) - overlap_words, 1), stride)
+        ]
         
-        return chunks
+        return [{"text": chunk, "size": len(chunk)} for chunk in chunk_texts]
     
-    def process_all_documents(self, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+    def process_all_documents(
+        self,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        pdf_files: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
         """
         Process all PDFs and create chunked documents with metadata.
         
         Args:
             chunk_size: Maximum size of each chunk in characters
             overlap: Number of characters to overlap between chunks
+            pdf_files: Filenames to process instead of every PDF
             
         Returns:
             List of chunks with metadata
         """
-        if not self.processed_pdfs:
-            self.load_all_pdfs()
+        if pdf_files is None:
+            if not self.processed_pdfs:
+                self.load_all_pdfs()
+            texts = self.processed_pdfs
+        else:
+            missing = [f for f in pdf_files if f not in self.processed_pdfs]
+            if missing:
+                self.load_all_pdfs(missing)
+            texts = {f: self.processed_pdfs[f] for f in pdf_files if f in self.processed_pdfs}
         
         all_chunks = []
         
-        for pdf_file, text in self.processed_pdfs.items():
+        for pdf_file, text in texts.items():
             chunks = self.chunk_text(text, chunk_size, overlap)
             
             # Add metadata to each chunk
@@ -125,5 +193,5 @@ class PDFProcessor:
                 chunk["chunk_id"] = f"{pdf_file}_{i}"
                 all_chunks.append(chunk)
         
-        logger.info(f"Created {len(all_chunks)} chunks from {len(self.processed_pdfs)} PDFs")
+        logger.info(f"Created {len(all_chunks)} chunks from {len(texts)} PDFs")
         return all_chunks
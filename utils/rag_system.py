@@ -2,9 +2,14 @@
 Retrieval-Augmented Generation (RAG) system.
 """
 import os
+import time
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import functools
+import concurrent.futures
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import numpy as np
+import google.generativeai as genai
 
 from utils.pdf_processor import PDFProcessor
 from utils.vector_store import VectorStore
@@ -12,58 +17,122 @@ from utils.gemini_client import GeminiClient
 
 logger = logging.getLogger(__name__)
 
+# The embeddings API accepts at most this many texts per request
+_EMBED_BATCH_SIZE = 100
+
+# Upper bound on embedding requests in flight at once when embedding many chunks
+_MAX_CONCURRENT_EMBED_REQUESTS = 8
+
+# Number of recent query embeddings kept, so repeated retrievals for the
+# same text don't call the API again
+_QUERY_CACHE_SIZE = 128
+
 class EmbeddingProvider:
     """
     Embedding provider using the Gemini API.
     """
     
-    def __init__(self, gemini_client: GeminiClient):
+    def __init__(self, gemini_client: GeminiClient, use_fake_embeddings: Optional[bool] = None):
         """
         Initialize the embedding provider.
         
         Args:
             gemini_client: Gemini API client
+            use_fake_embeddings: Use offline hash-based vectors instead of the
+                embeddings API, for tests only; defaults to the
+                USE_FAKE_EMBEDDINGS environment variable
         """
         self.gemini_client = gemini_client
+        if use_fake_embeddings is None:
+            use_fake_embeddings = os.getenv("USE_FAKE_EMBEDDINGS", "").lower() in ("1", "true", "yes")
+        self.use_fake_embeddings = use_fake_embeddings
+        # Saved vector stores record this, so switching models rebuilds them
+        self.model_name = "fake-md5" if use_fake_embeddings else os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+        # Requests are started at most this often, to stay under the rate limit
+        self.request_interval = 60.0 / int(os.getenv("GEMINI_RPM", 300))
+        self._cached_embedding = functools.lru_cache(maxsize=_QUERY_CACHE_SIZE)(self._embed_one)
     
-    def get_embedding(self, text: str) -> np.ndarray:
+    def get_embedding(self, text: str, task_type: str = "RETRIEVAL_QUERY") -> np.ndarray:
         """
         Get embedding for text using the Gemini API.
         
-        Since Gemini API doesn't have a direct embedding endpoint like OpenAI,
-        we'll use a workaround by asking the model to generate a numeric representation.
-        
         Args:
             text: Text to embed
+            task_type: What the embedding is used for, e.g. RETRIEVAL_QUERY
+                for search queries
             
         Returns:
-            Embedding vector as numpy array
+            Embedding vector as numpy array, shared between calls with the
+            same text so it must not be modified
         """
-        try:
-            # For simplicity, we'll use a hash-based approach for demo purposes
-            # In a production environment, you would use a proper embedding model
-            import hashlib
-            
-            # Create a hash of the text
-            hash_object = hashlib.md5(text.encode())
-            hash_hex = hash_object.hexdigest()
-            
-            # Convert to a pseudo-embedding of 768 dimensions
-            embedding = np.zeros(768)
-            for i, char in enumerate(hash_hex):
-                pos = i % 768
-                embedding[pos] += ord(char)
-            
-            # Normalize the embedding
-            norm = np.linalg.norm(embedding)
-            if norm > 0:
-                embedding = embedding / norm
-            
-            return embedding
+        return self._cached_embedding(text, task_type)
+    
+    def _embed_one(self, text: str, task_type: str) -> np.ndarray:
+        """Embed a single text, returning a read-only vector safe to cache."""
+        embedding = self.get_embeddings_batch([text], task_type)[0]
+        embedding.setflags(write=False)
+        return embedding
+    
+    def get_embeddings_batch(self, texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> np.ndarray:
+        """
+        Get embeddings for many texts, sending them to the API in batches.
+        
+        Args:
+            texts: Texts to embed
+            task_type: What the embeddings are used for, e.g. RETRIEVAL_DOCUMENT
+                for stored chunks
             
-        except Exception as e:
-            logger.error(f"Error generating embedding: {str(e)}")
-            return np.ones(768) / np.sqrt(768)  # Fallback to a normalized vector of ones
+        Returns:
+            float32 array with one embedding row per text
+        """
+        if self.use_fake_embeddings:
+            return np.stack([self._fake_embedding(text) for text in texts]).astype(np.float32)
+        
+        batches = [texts[start:start + _EMBED_BATCH_SIZE] for start in range(0, len(texts), _EMBED_BATCH_SIZE)]
+        if len(batches) == 1:
+            return np.asarray(self._embed(batches[0], task_type), dtype=np.float32)
+        
+        # The SDK's channel is shared by threads, so batches are sent
+        # concurrently, with their starts spaced out by request_interval
+        futures = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(batches), _MAX_CONCURRENT_EMBED_REQUESTS),
+            thread_name_prefix="embed"
+        ) as executor:
+            for i, batch in enumerate(batches):
+                if i:
+                    time.sleep(self.request_interval)
+                futures.append(executor.submit(self._embed, batch, task_type))
+        
+        rows = []
+        for future in futures:
+            rows.extend(future.result())
+        return np.asarray(rows, dtype=np.float32)
+    
+    def _embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """Embed one batch of texts with a single API request."""
+        result = genai.embed_content(model=self.model_name, content=texts, task_type=task_type)
+        return result["embedding"]
+    
+    @staticmethod
+    def _fake_embedding(text: str) -> np.ndarray:
+        """Hash-based stand-in for an embedding, with no semantic meaning."""
+        # Create a hash of the text
+        hash_object = hashlib.md5(text.encode())
+        hash_hex = hash_object.hexdigest()
+        
+        # Convert to a pseudo-embedding of 768 dimensions
+        embedding = np.zeros(768)
+        for i, char in enumerate(hash_hex):
+            pos = i % 768
+            embedding[pos] += ord(char)
+        
+        # Normalize the embedding
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        
+        return embedding
 
 class RAGSystem:
     """
@@ -89,23 +158,60 @@ class RAGSystem:
     
     def _initialize(self):
         """Initialize the RAG system by processing documents and building the vector store."""
-        # Check if a saved vector store exists
-        vector_store_path = os.path.join(self.pdf_directory, "vector_store.pkl")
+        # Load the saved vector store and only re-embed the PDFs that were
+        # added or changed since it was saved
+        vector_store_path = os.path.join(self.pdf_directory, "vector_store.json")
+        pdfs = self.pdf_processor.list_pdfs()
         
-        if os.path.exists(vector_store_path):
-            # Load the existing vector store
-            if self.vector_store.load(vector_store_path):
+        if os.path.exists(vector_store_path) and self.vector_store.load(vector_store_path):
+            if not self._index_is_stale(vector_store_path, pdfs):
                 logger.info("Loaded existing vector store")
                 return
         
-        # Process documents and build the vector store
-        logger.info("Building new vector store from PDF documents")
-        chunks = self.pdf_processor.process_all_documents()
-        self.vector_store.add_documents(chunks)
+        current_hashes = {name: self._file_hash(path) for name, path in pdfs}
+        changed = [
+            name for name, file_hash in current_hashes.items()
+            if self.vector_store.file_hashes.get(name) != file_hash
+        ]
+        # Drop chunks of changed or deleted PDFs, and of any source the
+        # store has no hash for
+        unchanged = set(current_hashes) - set(changed)
+        stale_sources = {doc.get("source") for doc in self.vector_store.documents} - unchanged
+        self.vector_store.remove_sources(stale_sources)
         
-        # Save the vector store
+        if changed:
+            logger.info(f"Embedding {len(changed)} new or changed PDF documents")
+            chunks = self.pdf_processor.process_all_documents(pdf_files=changed)
+            if not self.vector_store.add_documents(chunks):
+                # Left without a hash, so they are retried on the next start
+                changed = []
+        
+        self.vector_store.file_hashes = {
+            name: current_hashes[name] for name in unchanged | set(changed)
+        }
         self.vector_store.save(vector_store_path)
     
+    def _index_is_stale(self, vector_store_path: str, pdfs: List[Tuple[str, str]]) -> bool:
+        """Check whether any PDF was added, removed or changed after the vector store was saved."""
+        if {name for name, _ in pdfs} != set(self.vector_store.file_hashes):
+            logger.info("PDF documents were added or removed since the vector store was saved, updating it")
+            return True
+        saved_at = os.path.getmtime(vector_store_path)
+        for name, path in pdfs:
+            if os.path.getmtime(path) > saved_at:
+                logger.info(f"{name} changed since the vector store was saved, updating it")
+                return True
+        return False
+    
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        """Get the SHA-256 of a file's contents."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
     def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
         """
         Retrieve relevant documents for a query.
@@ -123,7 +229,14 @@ class RAGSystem:
             logger.info(f"  Result {i+1}: From {doc['source']} (similarity: {doc['similarity']:.2f})")
         return results
     
-    def generate_with_context(self, query: str, system_message: str, top_k: int = 3) -> str:
+    def generate_with_context(
+        self,
+        query: str,
+        system_message: str,
+        top_k: int = 3,
+        documents: Optional[List[Dict[str, Any]]] = None,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> str:
         """
         Generate a response with context from retrieved documents.
         
@@ -131,12 +244,15 @@ class RAGSystem:
             query: Query text
             system_message: System message/instructions
             top_k: Number of documents to retrieve
+            documents: Already retrieved documents to use instead of
+                retrieving for this query
+            on_token: Optional callback for each chunk of streamed text
             
         Returns:
             Generated response
         """
-        # Retrieve relevant documents
-        relevant_docs = self.retrieve(query, top_k)
+        # Retrieve relevant documents unless they were shared by the caller
+        relevant_docs = documents if documents is not None else self.retrieve(query, top_k)
         
         # Create context from retrieved documents
         context = "\n\n".join([
@@ -144,14 +260,14 @@ class RAGSystem:
             for doc in relevant_docs
         ])
         
-        # Create prompt with context
+        # The context comes first, so calls sharing documents share a prompt prefix
         prompt = f"""
-{system_message}
-
 Here is relevant information from AAOIFI standards documentation:
 
 {context}
 
+{system_message}
+
 Based on this information and your knowledge, please respond to the following:
 
 {query}
@@ -160,7 +276,7 @@ Based on this information and your knowledge, please respond to the following:
         # Generate response
         logger.info(f"Generating response with context from {len(relevant_docs)} documents")
         start_time = logger.info("Starting generation with context")
-        response = self.gemini_client.get_completion_text(prompt)
+        response = self.gemini_client.get_completion_text(prompt, on_token=on_token)
         logger.info(f"Completed generation with context")
         
         return response
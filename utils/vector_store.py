@@ -5,8 +5,8 @@ import os
 import json
 import logging
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
-import pickle
+import orjson
+from typing import List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -24,25 +24,80 @@ class VectorStore:
             embedding_provider: Object that provides embeddings for text
         """
         self.documents = []
-        self.embeddings = []
+        # One unit-length float32 row per document, so cosine similarity
+        # is a single matrix-vector product
+        self.embeddings = np.empty((0, 0), dtype=np.float32)
         self.embedding_provider = embedding_provider
+        # Content hash of each source file whose chunks are in the store
+        self.file_hashes: Dict[str, str] = {}
         
-    def add_documents(self, documents: List[Dict[str, Any]]):
+    def add_documents(self, documents: List[Dict[str, Any]]) -> bool:
         """
         Add documents to the vector store and generate embeddings.
         
         Args:
             documents: List of document chunks with text and metadata
-        """
-        for doc in documents:
-            # Generate embedding for the document text
-            embedding = self.get_embedding(doc["text"])
             
-            if embedding is not None:
-                self.documents.append(doc)
-                self.embeddings.append(embedding)
+        Returns:
+            Whether the documents were embedded and added
+        """
+        if not documents:
+            return True
+        
+        # Embed every chunk in as few requests as possible
+        embeddings = self.get_embeddings([doc["text"] for doc in documents])
+        if embeddings is None:
+            return False
+        
+        self.documents.extend(documents)
+        embeddings = self._normalize(embeddings)
+        if len(self.embeddings):
+            self.embeddings = np.concatenate([self.embeddings, embeddings])
+        else:
+            self.embeddings = embeddings
         
         logger.info(f"Added {len(documents)} documents to the vector store")
+        return True
+    
+    def remove_sources(self, sources: Set[str]):
+        """
+        Remove every document that came from the given source files.
+        
+        Args:
+            sources: Source filenames whose documents are removed
+        """
+        keep = np.array([doc.get("source") not in sources for doc in self.documents], dtype=bool)
+        if keep.all():
+            return
+        
+        self.documents = [doc for doc, kept in zip(self.documents, keep) if kept]
+        self.embeddings = self.embeddings[keep]
+        for source in sources:
+            self.file_hashes.pop(source, None)
+        
+        logger.info(f"Removed {len(keep) - len(self.documents)} documents from the vector store")
+    
+    def get_embeddings(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Get embeddings for document texts using the embedding provider.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            Array with one embedding row per text, or None on failure
+        """
+        try:
+            if self.embedding_provider:
+                if hasattr(self.embedding_provider, "get_embeddings_batch"):
+                    return self.embedding_provider.get_embeddings_batch(texts)
+                return np.stack([self.embedding_provider.get_embedding(text) for text in texts])
+            else:
+                # Fallback to simple embeddings if no provider is available
+                return np.tile(np.ones(768) / np.sqrt(768), (len(texts), 1))
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {str(e)}")
+            return None
     
     def get_embedding(self, text: str) -> np.ndarray:
         """
@@ -66,6 +121,16 @@ class VectorStore:
             logger.error(f"Error generating embedding: {str(e)}")
             return None
     
+    @staticmethod
+    def _normalize(embeddings: Any) -> np.ndarray:
+        """Convert embeddings to one contiguous float32 array of unit-length rows."""
+        matrix = np.array(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Zero vectors stay zero instead of turning into NaNs
+        norms[norms == 0] = 1
+        matrix /= norms
+        return matrix
+    
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """
         Search for documents similar to the query.
@@ -77,7 +142,7 @@ class VectorStore:
         Returns:
             List of document chunks with similarity scores
         """
-        if not self.documents or not self.embeddings:
+        if not self.documents or not len(self.embeddings):
             logger.warning("Vector store is empty")
             return []
         
@@ -86,16 +151,18 @@ class VectorStore:
         if query_embedding is None:
             return []
         
-        # Convert list of embeddings to numpy array for efficient computation
-        embeddings_array = np.array(self.embeddings)
-        
-        # Compute cosine similarity
-        similarities = np.dot(embeddings_array, query_embedding) / (
-            np.linalg.norm(embeddings_array, axis=1) * np.linalg.norm(query_embedding)
-        )
+        # Rows are pre-normalized, so cosine similarity is one matrix-vector product
+        query_norm = np.linalg.norm(query_embedding)
+        if query_norm == 0:
+            return []
+        similarities = self.embeddings @ (query_embedding / query_norm).astype(np.float32)
         
-        # Get indices of top k results
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        # Select the top k without sorting every similarity, then order them
+        if top_k < len(similarities):
+            top_indices = np.argpartition(similarities, -top_k)[-top_k:]
+        else:
+            top_indices = np.arange(len(similarities))
+        top_indices = top_indices[np.argsort(similarities[top_indices])[::-1]]
         
         # Return top k documents with similarity scores
         results = []
@@ -106,21 +173,41 @@ class VectorStore:
         
         return results
     
+    def _embedding_model(self) -> Optional[str]:
+        """Get the name of the model the embeddings come from."""
+        return getattr(self.embedding_provider, "model_name", None)
+    
+    @staticmethod
+    def _embeddings_path(filepath: str) -> str:
+        """Get the path of the embeddings file that goes with a store's JSON file."""
+        return os.path.splitext(filepath)[0] + ".npy"
+    
     def save(self, filepath: str):
         """
         Save the vector store to disk.
         
+        The documents and metadata go to filepath as JSON and the embeddings
+        to a .npy file next to it. The JSON file is written last, so its
+        modification time covers both.
+        
         Args:
-            filepath: Path to save the vector store
+            filepath: Path of the JSON file to save the vector store to
         """
         data = {
             "documents": self.documents,
-            "embeddings": self.embeddings,
+            "file_hashes": self.file_hashes,
+            "embedding_model": self._embedding_model(),
             "timestamp": datetime.now().isoformat()
         }
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(data, f)
+        # Write then rename, so a crash never leaves a half-written store
+        embeddings_path = self._embeddings_path(filepath)
+        with open(f"{embeddings_path}.tmp", 'wb') as f:
+            np.save(f, self.embeddings)
+        os.replace(f"{embeddings_path}.tmp", embeddings_path)
+        with open(f"{filepath}.tmp", 'wb') as f:
+            f.write(orjson.dumps(data))
+        os.replace(f"{filepath}.tmp", filepath)
         
         logger.info(f"Vector store saved to {filepath}")
     
@@ -128,19 +215,35 @@ class VectorStore:
         """
         Load the vector store from disk.
         
+        The embeddings are memory-mapped rather than read, so pages are
+        only loaded as searches touch them.
+        
         Args:
-            filepath: Path to load the vector store from
+            filepath: Path of the JSON file to load the vector store from
         """
-        if not os.path.exists(filepath):
+        embeddings_path = self._embeddings_path(filepath)
+        if not os.path.exists(filepath) or not os.path.exists(embeddings_path):
             logger.warning(f"Vector store file {filepath} does not exist")
             return False
         
         try:
             with open(filepath, 'rb') as f:
-                data = pickle.load(f)
+                data = orjson.loads(f.read())
+            
+            # Vectors from another model aren't comparable with new queries
+            if data.get("embedding_model") != self._embedding_model():
+                logger.info(f"Vector store {filepath} was built with a different embedding model")
+                return False
+            
+            embeddings = np.load(embeddings_path, mmap_mode="r")
+            if len(embeddings) != len(data["documents"]):
+                logger.warning(f"Vector store {filepath} has mismatched documents and embeddings")
+                return False
             
             self.documents = data["documents"]
-            self.embeddings = data["embeddings"]
+            self.file_hashes = data.get("file_hashes", {})
+            # Rows were normalized before saving
+            self.embeddings = embeddings
             
             logger.info(f"Vector store loaded from {filepath} with {len(self.documents)} documents")
             return True